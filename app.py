@@ -1,16 +1,16 @@
-from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for, flash, session
+from flask import (render_template, request, jsonify, redirect, url_for, flash, session, abort,
+                   Response, stream_with_context)
+from werkzeug.security import safe_join
 import os
 import time
 import json
-import pdfplumber
-import requests
-import zipfile
-import shutil
-import csv
 import re
-from email_invoice_downloader import connect_to_email, download_invoice_attachments
-from dotenv import load_dotenv
-from datetime import datetime
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import quote
+from sqlalchemy import and_, delete, insert, select
+from sqlalchemy.exc import IntegrityError
+from datetime import date, datetime, timedelta
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 # 修改导入语句，适应新版本的Werkzeug
 try:
@@ -22,23 +22,24 @@ except ImportError:
     except ImportError:
         # 如果仍然找不到，使用urllib.parse作为备选
         from urllib.parse import urlparse as url_parse
-from models import db, User, EmailAccount, InvoiceHistory, Invoice
+from models import db, User, EmailAccount, InvoiceHistory, Invoice, parse_amount_cents, parse_invoice_date
 from forms import LoginForm, RegistrationForm, EmailAccountForm, InvoiceDownloadForm
+from sync_scheduler import SyncScheduler
+from imap_idle import IdleListener
+from jobs import JobCancelled, PRIORITY_INTERACTIVE, PRIORITY_IMPORT, PRIORITY_SYNC, PRIORITY_BACKFILL
+from invoice_search import ensure_fts, apply_search
+from keyset import KeysetPage, paginate_keyset, count_capped
+from maintenance import run_task
+from file_serving import send_download
+from chunked_upload import UploadError
+from watch_folder import WatchFolder
+from zip_stream import stream_zip, csv_bytes
+from metrics import IMPORT_FILES, LLM_REQUESTS, LLM_TOKENS, stage_timer, timed_chunks
+from app_factory import (create_app, load_env, job_manager, listing_cache, file_remover, blob_store, archive_cache,
+                         storage_gc, chunked_uploads)
+from rollups import TRACKED_FIELDS, apply_invoice_records, rebuild_rollups, summary_totals, summary_by, summary_years
 
-# 加载环境变量
-load_dotenv(override=True)
-
-app = Flask(__name__)
-app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-key-please-change-in-production')
-app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URI', 'sqlite:///app.db')
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-# 添加SERVER_NAME配置，用于在非请求上下文中生成URL
-# 注意：这个配置在开发环境中可能会导致一些问题，如果遇到问题可以移除
-# app.config['SERVER_NAME'] = os.getenv('SERVER_NAME', 'localhost:5001')
-
-# 初始化数据库
-db.init_app(app)
+app = create_app()
 
 # 初始化登录管理器
 login_manager = LoginManager()
@@ -56,7 +57,7 @@ class Config:
     @classmethod
     def _ensure_env_loaded(cls):
         """确保环境变量已加载"""
-        load_dotenv(override=True)
+        load_env()
 
     @classmethod
     def get_model(cls):
@@ -89,24 +90,18 @@ class Config:
         cls._ensure_env_loaded()
         return os.getenv('APP_HOST') or '0.0.0.0'
 
-# 全局变量，用于跟踪处理进度
-processing_status = {
-    'status': 'idle',  # 状态：idle, processing, complete, error
-    'current': 0,      # 当前处理的文件索引
-    'total': 0,        # 总文件数
-    'current_file': '',  # 当前处理的文件名
-    'redirect_url': '',  # 处理完成后的重定向URL
-    'error': ''        # 错误信息
-}
-
 def extract_invoice_info(pdf_path):
     """使用自定义 OpenAI 代理服务器从PDF发票中提取信息"""
+    # PDF解析和HTTP请求的模块较大，只在需要提取发票的进程中加载
+    import pdfplumber
+    import requests
+    
     requested_model = Config.get_model()
     #print(f"请求使用的模型: {requested_model}")  # 打印请求的模型
     
     try:
         # 读取 PDF 文本
-        with pdfplumber.open(pdf_path) as pdf:
+        with stage_timer('pdf_parse'), pdfplumber.open(pdf_path) as pdf:
             text = pdf.pages[0].extract_text()
         
         # 构建 prompt
@@ -140,21 +135,27 @@ def extract_invoice_info(pdf_path):
         api_endpoint = f"{api_base}/v1/chat/completions"
 
         # 调用自定义 OpenAI 代理服务器
-        response = requests.post(
-            api_endpoint,
-            json={
-                "model": Config.get_model(),
-                "messages": [
-                    {"role": "system", "content": "你是一个专门处理发票信息的助手，请严格按照要求的JSON格式返回提取的信息。日期必须使用YYYY-MM-DD格式。如果是机票或者火车票，请务必把【出发地-目的地，出发日期，出发时间，航班号/车次，舱位等级】填入项目名称。"},
-                    {"role": "user", "content": prompt}
-                ],
-                "temperature": 0
-            },
-            headers={
-                'Content-Type': 'application/json',
-                'Authorization': f'Bearer {Config.get_api_key()}'
-            }
-        )
+        try:
+            with stage_timer('llm_request'):
+                response = requests.post(
+                    api_endpoint,
+                    json={
+                        "model": Config.get_model(),
+                        "messages": [
+                            {"role": "system", "content": "你是一个专门处理发票信息的助手，请严格按照要求的JSON格式返回提取的信息。日期必须使用YYYY-MM-DD格式。如果是机票或者火车票，请务必把【出发地-目的地，出发日期，出发时间，航班号/车次，舱位等级】填入项目名称。"},
+                            {"role": "user", "content": prompt}
+                        ],
+                        "temperature": 0
+                    },
+                    headers={
+                        'Content-Type': 'application/json',
+                        'Authorization': f'Bearer {Config.get_api_key()}'
+                    }
+                )
+        except requests.RequestException:
+            LLM_REQUESTS.inc(status='error')
+            raise
+        LLM_REQUESTS.inc(status='ok' if response.ok else 'error')
         
         # 打印原始响应以进行调试
         print("API Response:", response.text)
@@ -166,6 +167,9 @@ def extract_invoice_info(pdf_path):
         try:
             result = response.json()
             actual_model = result.get('model', 'unknown')  # 获取实际使用的模型
+            usage = result.get('usage') or {}
+            LLM_TOKENS.inc(usage.get('prompt_tokens') or 0, type='prompt')
+            LLM_TOKENS.inc(usage.get('completion_tokens') or 0, type='completion')
             
             # 检查响应结构
             if 'response' in result:
@@ -235,217 +239,204 @@ def extract_invoice_info(pdf_path):
         print(f"处理过程中出现错误: {e}")
         return None
 
-def create_invoice_csv(invoice_info_list, output_dir):
-    """创建发票信息的CSV文件"""
-    csv_path = os.path.join(output_dir, "发票信息汇总.csv")
-    
-    # 定义CSV表头
-    fieldnames = ['发票号码', '开票日期', '开票方名称', '含税金额', '项目名称', '原文件名', '重命名后文件名']
-    
-    # 写入CSV文件
-    with open(csv_path, 'w', newline='', encoding='utf-8-sig') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-        
-        for info in invoice_info_list:
-            # 获取原始文件名
-            original_filename = info.get('filename', '')
-            
-            # 构建重命名后的文件名
-            invoice_date = info.get('invoice_date', '未知日期').replace('/', '-').replace(' ', '')
-            seller = info.get('seller', '未知开票方').replace('/', '_')
-            # 单独处理反斜杠
-            seller = seller.replace('\\', '_')
-            if len(seller) > 20:
-                seller = seller[:20]
-            amount = info.get('amount', '未知金额')
-            invoice_no = info.get('invoice_no', '未知发票号')
-            
-            # 去掉方括号，直接使用连字符分隔
-            new_filename = f"{invoice_date}-{seller}-{amount}-{invoice_no}.pdf"
-            new_filename = new_filename.replace(':', '_').replace('*', '_').replace('?', '_').replace('"', '_').replace('<', '_').replace('>', '_').replace('|', '_')
-            
-            writer.writerow({
-                '发票号码': info.get('invoice_no', ''),
-                '开票日期': info.get('invoice_date', ''),
-                '开票方名称': info.get('seller', ''),
-                '含税金额': info.get('amount', ''),
-                '项目名称': info.get('project_name', ''),
-                '原文件名': original_filename,
-                '重命名后文件名': new_filename
-            })
-    
-    return csv_path
+# 导出ZIP中CSV汇总表的字段
+EXPORT_CSV_FIELDS = ['发票号码', '开票日期', '开票方名称', '含税金额', '项目名称', '原文件名', '文件名']
 
-def rename_invoice_files(invoice_info_list):
-    """根据提取的信息重命名发票文件"""
-    renamed_files = []
-    renamed_dir = 'renamed_invoices'
-    
-    # 确保目录存在
-    if os.path.exists(renamed_dir):
-        shutil.rmtree(renamed_dir)  # 清空目录
-    os.makedirs(renamed_dir)
-    
-    for info in invoice_info_list:
-        try:
-            # 获取原始文件路径
-            original_path = info['filepath']
-            
-            # 清理文件名中的非法字符
-            invoice_date = info.get('invoice_date', '未知日期').replace('/', '-').replace(' ', '')
-            seller = info.get('seller', '未知开票方').replace('/', '_')
-            # 单独处理反斜杠
-            seller = seller.replace('\\', '_')
-            amount = info.get('amount', '未知金额')
-            invoice_no = info.get('invoice_no', '未知发票号')
-            
-            # 限制文件名长度
-            if len(seller) > 20:
-                seller = seller[:20]
-            
-            # 构建新文件名 - 去掉方括号，直接使用连字符分隔
-            new_filename = f"{invoice_date}-{seller}-{amount}-{invoice_no}.pdf"
-            # 替换文件名中的非法字符
-            new_filename = new_filename.replace(':', '_').replace('*', '_').replace('?', '_').replace('"', '_').replace('<', '_').replace('>', '_').replace('|', '_')
-            
-            # 新文件路径
-            new_path = os.path.join(renamed_dir, new_filename)
-            
-            # 复制并重命名文件
-            shutil.copy2(original_path, new_path)
-            renamed_files.append(new_path)
-            
-            print(f"重命名文件: {os.path.basename(original_path)} -> {new_filename}")
-        except Exception as e:
-            print(f"重命名文件时出错: {e}")
-    
-    # 创建CSV文件
-    csv_path = create_invoice_csv(invoice_info_list, renamed_dir)
-    renamed_files.append(csv_path)
-    
-    return renamed_dir, renamed_files
+def invoice_zip_entries(invoices, csv_name="发票信息汇总.csv"):
+    """生成导出ZIP的条目：各发票原文件（以当前文件名命名）和CSV汇总表"""
+    for invoice in invoices:
+        if invoice.file_path:
+            yield invoice.current_filename or os.path.basename(invoice.file_path), invoice.file_path
+    rows = ({
+        '发票号码': invoice.invoice_no,
+        '开票日期': invoice.invoice_date,
+        '开票方名称': invoice.seller,
+        '含税金额': invoice.amount,
+        '项目名称': invoice.project_name,
+        '原文件名': invoice.original_filename,
+        '文件名': invoice.current_filename
+    } for invoice in invoices)
+    yield csv_name, csv_bytes(EXPORT_CSV_FIELDS, rows)
 
-def create_invoice_zip(renamed_dir, user_id=None):
-    """创建发票文件的ZIP压缩包"""
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    zip_filename = f"invoices_{timestamp}.zip"
-    
+def archive_fingerprint(invoices):
+    """描述压缩包内容的元组，用作ZIP缓存键；发票文件或导出字段变化时随之变化"""
+    return tuple((invoice.id, invoice.file_path, invoice.content_hash, invoice.current_filename,
+                  invoice.original_filename, invoice.invoice_no, invoice.invoice_date, invoice.seller,
+                  invoice.amount, invoice.project_name) for invoice in invoices)
+
+def zip_response(entries, download_name, cache_key=None):
+    """以流式响应返回ZIP压缩包；指定 cache_key 时同时写入ZIP缓存"""
+    chunks = timed_chunks(stream_zip(entries), 'zip_build')
+    if cache_key:
+        chunks = archive_cache.stream_and_store(cache_key, chunks)
+    response = Response(stream_with_context(chunks), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{quote(download_name)}"
+    return response
+
+def invoice_record(invoice_info, history_id, user_id):
+    """根据提取的发票信息构建数据库记录的字段值"""
+    # 获取原始文件名
+    original_filename = invoice_info.get('filename', '')
+    
+    # 获取发票日期（应该已经是YYYY-MM-DD格式）
+    invoice_date = invoice_info.get('invoice_date', '未知日期')
+    
+    # 构建重命名后的文件名
+    seller = invoice_info.get('seller', '未知开票方').replace('/', '_')
+    # 单独处理反斜杠
+    seller = seller.replace('\\', '_')
+    if len(seller) > 20:
+        seller = seller[:20]
+    amount = invoice_info.get('amount', '未知金额')
+    invoice_no = invoice_info.get('invoice_no', '未知发票号')
+    
+    # 去掉方括号，直接使用连字符分隔
+    new_filename = f"{invoice_date}-{seller}-{amount}-{invoice_no}.pdf"
+    new_filename = new_filename.replace(':', '_').replace('*', '_').replace('?', '_').replace('"', '_').replace('<', '_').replace('>', '_').replace('|', '_')
+    
+    return {
+        'user_id': user_id,
+        'history_id': history_id,
+        'invoice_no': invoice_info.get('invoice_no', ''),
+        'invoice_date': invoice_info.get('invoice_date', ''),
+        'seller': invoice_info.get('seller', ''),
+        'amount': invoice_info.get('amount', ''),
+        'project_name': invoice_info.get('project_name', ''),
+        'invoice_date_std': parse_invoice_date(invoice_info.get('invoice_date', '')),
+        'amount_cents': parse_amount_cents(invoice_info.get('amount', '')),
+        'original_filename': original_filename,
+        'current_filename': new_filename,
+        'file_path': invoice_info.get('filepath', ''),
+        'content_hash': invoice_info.get('content_hash')
+    }
+
+def invoice_insert_ignore():
+    """构建遇到唯一索引冲突时忽略的发票插入语句（INSERT ... ON CONFLICT DO NOTHING）"""
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == 'mysql':
+        return insert(Invoice).prefix_with('IGNORE')
+    else:
+        return insert(Invoice)
+    return dialect_insert(Invoice).on_conflict_do_nothing()
+
+def insert_invoice(record):
+    """插入一条发票记录并计入汇总表（不提交），发票号已存在时返回 None，否则返回新发票的ID"""
+    stmt = invoice_insert_ignore().values(**record)
+    if db.engine.dialect.insert_returning:
+        invoice_id = db.session.execute(stmt.returning(Invoice.id)).scalar()
+    else:
+        # MySQL 不支持 RETURNING，INSERT IGNORE 忽略插入时影响行数为0
+        result = db.session.execute(stmt)
+        invoice_id = result.lastrowid if result.rowcount else None
+    if invoice_id is not None:
+        # 插入语句不经过ORM事件，需要手动计入汇总表
+        apply_invoice_records(db.session.connection(), [record])
+    return invoice_id
+
+def save_invoice_to_db(invoice_info, history_id=None, user_id=None):
+    """将发票信息保存到数据库"""
     # 如果没有提供user_id，则使用current_user.id
     if user_id is None and current_user and hasattr(current_user, 'id'):
         user_id = current_user.id
     
-    # 为每个用户创建单独的目录
-    user_static_dir = os.path.join('static', f'user_{user_id}')
-    os.makedirs(user_static_dir, exist_ok=True)
-    
-    zip_path = os.path.join(user_static_dir, zip_filename)
+    # 如果没有user_id，则无法保存
+    if not user_id:
+        print("无法保存发票：未提供user_id")
+        return None
     
-    # 创建ZIP文件
-    with zipfile.ZipFile(zip_path, 'w') as zipf:
-        for root, dirs, files in os.walk(renamed_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                # 将文件添加到ZIP中，使用相对路径
-                zipf.write(file_path, os.path.basename(file_path))
+    record = invoice_record(invoice_info, history_id, user_id)
+    print(f"保存发票到数据库: 发票号={record['invoice_no']}, 原始文件名={record['original_filename']}, 新文件名={record['current_filename']}")
     
-    return zip_filename
-
-def save_invoice_to_db(invoice_info, history_id=None, user_id=None):
-    """将发票信息保存到数据库"""
     try:
-        # 如果没有提供user_id，则使用current_user.id
-        if user_id is None and current_user and hasattr(current_user, 'id'):
-            user_id = current_user.id
-        
-        # 如果没有user_id，则无法保存
-        if not user_id:
-            print("无法保存发票：未提供user_id")
-            return None
-        
-        # 获取原始文件名
-        original_filename = invoice_info.get('filename', '')
-        
-        # 获取发票日期（应该已经是YYYY-MM-DD格式）
-        invoice_date = invoice_info.get('invoice_date', '未知日期')
-        
-        # 构建重命名后的文件名
-        seller = invoice_info.get('seller', '未知开票方').replace('/', '_')
-        # 单独处理反斜杠
-        seller = seller.replace('\\', '_')
-        if len(seller) > 20:
-            seller = seller[:20]
-        amount = invoice_info.get('amount', '未知金额')
-        invoice_no = invoice_info.get('invoice_no', '未知发票号')
-        
-        # 去掉方括号，直接使用连字符分隔
-        new_filename = f"{invoice_date}-{seller}-{amount}-{invoice_no}.pdf"
-        new_filename = new_filename.replace(':', '_').replace('*', '_').replace('?', '_').replace('"', '_').replace('<', '_').replace('>', '_').replace('|', '_')
-        
-        # 打印调试信息
-        print(f"保存发票到数据库: 原始文件名={original_filename}, 新文件名={new_filename}")
-        print(f"发票信息: 发票号={invoice_no}, 日期={invoice_date}, 卖家={seller}, 金额={amount}")
-        
-        # 创建发票记录
-        invoice = Invoice(
-            user_id=user_id,
-            history_id=history_id,
-            invoice_no=invoice_info.get('invoice_no', ''),
-            invoice_date=invoice_info.get('invoice_date', ''),
-            seller=invoice_info.get('seller', ''),
-            amount=invoice_info.get('amount', ''),
-            project_name=invoice_info.get('project_name', ''),
-            original_filename=original_filename,
-            current_filename=new_filename,
-            file_path=invoice_info.get('filepath', '')
-        )
-        
-        # 打印发票对象信息
-        print(f"创建的发票对象: user_id={invoice.user_id}, invoice_no={invoice.invoice_no}, invoice_date={invoice.invoice_date}")
-        
-        # 添加到数据库会话
-        db.session.add(invoice)
-        
-        # 提交更改
+        # 插入发票记录，发票号已存在时由唯一索引忽略本次插入
+        invoice_id = insert_invoice(record)
         db.session.commit()
-        
-        # 验证发票是否成功保存
-        saved_invoice = Invoice.query.filter_by(user_id=user_id, invoice_no=invoice_no).first()
-        if saved_invoice:
-            print(f"发票成功保存到数据库: ID={saved_invoice.id}")
-        else:
-            print(f"警告：发票可能未成功保存到数据库")
-        
-        return invoice
+        if invoice_id is None:
+            print(f"发票已存在，忽略本次保存: {record['invoice_no']}")
+            return None
+        listing_cache.invalidate(user_id)
+        print(f"发票成功保存到数据库: ID={invoice_id}")
+        return db.session.get(Invoice, invoice_id)
     except Exception as e:
-        # 回滚事务
+        # 回滚事务；用ORM重新插入同一条记录会再次违反同样的约束，不再重试
         db.session.rollback()
         print(f"保存发票到数据库时出错: {str(e)}")
-        # 尝试再次保存，使用新的会话
-        try:
-            print("尝试使用新会话重新保存发票...")
-            with app.app_context():
-                # 创建新的会话
-                new_invoice = Invoice(
-                    user_id=user_id,
-                    history_id=history_id,
-                    invoice_no=invoice_info.get('invoice_no', ''),
-                    invoice_date=invoice_info.get('invoice_date', ''),
-                    seller=invoice_info.get('seller', ''),
-                    amount=invoice_info.get('amount', ''),
-                    project_name=invoice_info.get('project_name', ''),
-                    original_filename=original_filename,
-                    current_filename=new_filename,
-                    file_path=invoice_info.get('filepath', '')
-                )
-                db.session.add(new_invoice)
-                db.session.commit()
-                print(f"使用新会话成功保存发票: ID={new_invoice.id}")
-                return new_invoice
-        except Exception as e2:
-            print(f"使用新会话保存发票时再次出错: {str(e2)}")
-            db.session.rollback()
-            return None
+        return None
+
+def save_invoices_bulk(invoice_info_list, history_id, user_id):
+    """批量保存一次导入的发票
+    
+    用一次 IN 查询找出已存在的发票号，批次内重复的发票号只保留第一张，
+    新发票按 IMPORT_DB_CHUNK_SIZE 分块批量插入，每块提交一次。
+    返回 (新发票信息列表, 重复发票信息列表)。
+    """
+    chunk_size = app.config['IMPORT_DB_CHUNK_SIZE']
+    
+    # 查询已存在的发票号（分块以避免超出SQLite的参数数量限制）
+    invoice_nos = list({info.get('invoice_no') for info in invoice_info_list if info.get('invoice_no')})
+    existing = set()
+    with stage_timer('dedupe'):
+        for i in range(0, len(invoice_nos), chunk_size):
+            rows = db.session.query(Invoice.invoice_no).filter(
+                Invoice.user_id == user_id,
+                Invoice.invoice_no.in_(invoice_nos[i:i + chunk_size])
+            ).all()
+            existing.update(row[0] for row in rows)
+    
+    new_invoices = []
+    duplicate_invoices = []
+    for info in invoice_info_list:
+        invoice_no = info.get('invoice_no', '')
+        if invoice_no and invoice_no in existing:
+            duplicate_invoices.append(info)
+            print(f"发现重复发票: {invoice_no}")
+            continue
+        if invoice_no:
+            existing.add(invoice_no)
+        new_invoices.append(info)
+    
+    # 分块批量插入，每块一个事务；并发导入抢先写入的发票由唯一索引忽略
+    records = [invoice_record(info, history_id, user_id) for info in new_invoices]
+    use_returning = db.engine.dialect.insert_executemany_returning
+    inserted_nos = set()
+    rebuild_needed = False
+    for i in range(0, len(records), chunk_size):
+        chunk = records[i:i + chunk_size]
+        with stage_timer('db_write'):
+            stmt = invoice_insert_ignore()
+            # 插入语句不经过ORM事件，在同一事务中手动计入汇总表
+            if use_returning:
+                rows = db.session.execute(stmt.returning(Invoice.invoice_no), chunk).all()
+                chunk_nos = {row[0] for row in rows}
+                inserted_nos.update(chunk_nos)
+                apply_invoice_records(db.session.connection(),
+                                      [record for record in chunk if not record['invoice_no'] or record['invoice_no'] in chunk_nos])
+            else:
+                result = db.session.execute(stmt, chunk)
+                if result.rowcount == len(chunk):
+                    apply_invoice_records(db.session.connection(), chunk)
+                else:
+                    # 无法得知哪些行被忽略，改为重建该用户的汇总
+                    rebuild_needed = True
+            db.session.commit()
+        listing_cache.invalidate(user_id)
+    
+    if rebuild_needed:
+        rebuild_rollups(user_id)
+    
+    if use_returning:
+        raced = [info for info in new_invoices
+                 if info.get('invoice_no') and info.get('invoice_no') not in inserted_nos]
+        if raced:
+            duplicate_invoices.extend(raced)
+            new_invoices = [info for info in new_invoices if info not in raced]
+    
+    print(f"批量保存发票: 新增 {len(new_invoices)} 张，重复 {len(duplicate_invoices)} 张")
+    return new_invoices, duplicate_invoices
 
 @app.route('/')
 def index():
@@ -507,13 +498,57 @@ def dashboard():
     """用户仪表盘"""
     email_accounts = EmailAccount.query.filter_by(user_id=current_user.id).all()
     histories = InvoiceHistory.query.filter_by(user_id=current_user.id).order_by(InvoiceHistory.processed_at.desc()).limit(10).all()
-    return render_template('dashboard.html', email_accounts=email_accounts, histories=histories)
+    
+    # 统计数据只读取汇总表
+    now = datetime.now()
+    stats = {
+        'total': summary_totals(current_user.id),
+        'this_year': summary_totals(current_user.id, now.strftime('%Y')),
+        'this_month': summary_totals(current_user.id, now.strftime('%Y-%m')),
+        'top_sellers': summary_by(current_user.id, 'seller', limit=5),
+        'top_categories': summary_by(current_user.id, 'category', limit=5)
+    }
+    return render_template('dashboard.html', email_accounts=email_accounts, histories=histories, stats=stats)
+
+@app.route('/reports')
+@login_required
+def reports():
+    """发票统计报表（按月份、开票方、项目分类汇总）"""
+    years = summary_years(current_user.id)
+    year = request.args.get('year', years[0] if years else '')
+    if year == 'all':
+        year = ''
+    
+    return render_template('reports.html',
+                           years=years,
+                           year=year,
+                           totals=summary_totals(current_user.id, year),
+                           by_month=summary_by(current_user.id, 'month', year=year, order_by_amount=False),
+                           by_seller=summary_by(current_user.id, 'seller', year=year, limit=50),
+                           by_category=summary_by(current_user.id, 'category', year=year))
 
 @app.route('/process_status')
 @login_required
 def process_status():
     """获取处理进度"""
-    return jsonify(processing_status)
+    job_id = request.args.get('job_id')
+    if job_id:
+        job = job_manager.get(job_id, current_user.id)
+    else:
+        jobs = job_manager.jobs_for_user(current_user.id)
+        job = jobs[0] if jobs else None
+    
+    if not job:
+        return jsonify({'status': 'idle', 'current': 0, 'total': 0, 'current_file': '', 'redirect_url': '', 'error': ''})
+    return jsonify(job.to_dict())
+
+@app.route('/jobs/<job_id>/cancel', methods=['POST'])
+@login_required
+def cancel_job(job_id):
+    """取消后台任务"""
+    if job_manager.cancel(job_id, current_user.id):
+        return jsonify({'success': True})
+    return jsonify({'success': False, 'error': '任务不存在或已结束'}), 404
 
 @app.route('/email_accounts', methods=['GET', 'POST'])
 @login_required
@@ -525,7 +560,9 @@ def email_accounts():
             user_id=current_user.id,
             email_address=form.email_address.data,
             password=form.password.data,  # 实际应用中应加密存储
-            description=form.description.data
+            description=form.description.data,
+            sync_enabled=form.sync_enabled.data,
+            sync_interval=form.sync_interval.data
         )
         db.session.add(account)
         db.session.commit()
@@ -554,6 +591,24 @@ def delete_email_account(id):
     flash('邮箱账号已删除')
     return redirect(url_for('email_accounts'))
 
+@app.route('/email_account/<int:id>/toggle_sync', methods=['POST'])
+@login_required
+def toggle_email_account_sync(id):
+    """开启或关闭邮箱账号的定时同步"""
+    account = db.session.get(EmailAccount, id)
+    if not account or account.user_id != current_user.id:
+        flash('邮箱账号不存在')
+        return redirect(url_for('email_accounts'))
+    
+    account.sync_enabled = not account.sync_enabled
+    if account.sync_enabled:
+        # 重新开启时清除失败记录，避免沿用之前的退避时间
+        account.sync_failures = 0
+        account.last_sync_error = None
+    db.session.commit()
+    flash('已开启定时同步' if account.sync_enabled else '已关闭定时同步')
+    return redirect(url_for('email_accounts'))
+
 @app.route('/download_invoices', methods=['GET', 'POST'])
 @login_required
 def download_invoices():
@@ -583,17 +638,6 @@ def download_invoices():
 @login_required
 def show_processing():
     """显示处理进度页面"""
-    # 重置处理状态
-    global processing_status
-    processing_status = {
-        'status': 'idle',
-        'current': 0,
-        'total': 0,
-        'current_file': '',
-        'redirect_url': '',
-        'error': ''
-    }
-    
     # 从会话中获取数据
     email = session.get('email_for_download')
     password = session.get('password_for_download')
@@ -611,17 +655,295 @@ def show_processing():
     # 在线程启动前保存用户ID
     user_id = current_user.id
     
-    # 启动后台处理线程
-    import threading
-    thread = threading.Thread(target=process_invoices_thread, args=(email, password, search_date, user_id))
-    thread.daemon = True
-    thread.start()
+    # 提交后台任务，大范围回溯导入使用较低的优先级，避免阻塞其他用户的小批量导入
+    priority = PRIORITY_IMPORT
+    backfill_since = datetime.now() - timedelta(days=app.config['JOB_BACKFILL_DAYS'])
+    if not search_date or search_date < backfill_since.strftime('%Y-%m-%d'):
+        priority = PRIORITY_BACKFILL
+    job = job_manager.submit(user_id, 'import', process_invoices_thread,
+                             args=(email, password, search_date, user_id), priority=priority)
+    
+    return render_template('processing.html', job_id=job.id)
+
+def import_invoice_files(file_paths, user_id, email_account_id=None, search_date=None, job=None, filenames=None,
+                         move_files=True):
+    """提取发票信息、创建处理历史并把新发票保存到数据库
+    
+    手动导入、批量上传、后台定时同步与命令行导入共用此流程。多个文件并行提取，并发数受每个用户的
+    大模型调用配额（JOB_USER_MAX_LLM_CALLS）限制。传入 job 时会更新任务进度，
+    并在每个文件开始提取前检查任务是否已被取消。filenames 为 {文件路径: 原始文件名}，
+    用于已经存入内容存储的上传文件。move_files 为 False 时把文件复制到内容存储，保留原文件。
+    """
+    filenames = filenames or {}
+    status = job.status if job else {}
+    
+    result = {
+        'invoice_info': [],
+        'duplicate_invoices': [],  # 存储重复的发票信息
+        'new_invoices': [],  # 存储新的发票信息
+        'saved_invoices': [],  # 存储成功保存到数据库的发票信息
+        'failed_files': [],  # 未能提取出发票信息的文件
+        'history_id': None
+    }
+    
+    status['total'] = len(file_paths)
+    # 先按文件内容去重：与已导入发票内容相同的文件（包括本批中的重复文件）不再调用大模型提取
+    with stage_timer('dedupe'):
+        digests = {file_path: blob_store.digest_of(file_path) or blob_store.hash_file(file_path)
+                   for file_path in file_paths}
+        with app.app_context():
+            known = invoices_by_content_hash(user_id, set(digests.values()))
+    content_duplicates = []
+    duplicate_files = []
+    pending = []
+    for file_path in file_paths:
+        filename = filenames.get(file_path) or os.path.basename(file_path)
+        digest = digests[file_path]
+        if digest in known:
+            content_duplicates.append(dict(known[digest] or {}, filename=filename))
+            print(f"发现内容相同的发票文件: {filename}")
+            # 下载目录中的重复文件不再需要；内容存储中的文件与已有发票共用，保留原文件时也不删除
+            if move_files and not blob_store.is_blob_path(file_path):
+                duplicate_files.append(file_path)
+            continue
+        known[digest] = None
+        pending.append(file_path)
+    file_remover.remove(duplicate_files)
+    
+    def extract(file_path):
+        if job:
+            job.check_cancelled()
+        with job_manager.llm_slot(user_id):
+            return extract_invoice_info(file_path)
+    
+    extracted = {}
+    status['current'] = len(file_paths) - len(pending)
+    workers = max(1, min(app.config['JOB_USER_MAX_LLM_CALLS'], len(pending)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='invoice-extract') as executor:
+        futures = {executor.submit(extract, file_path): file_path for file_path in pending}
+        for future in as_completed(futures):
+            file_path = futures[future]
+            extracted[file_path] = future.result()
+            status['current'] += 1
+            status['current_file'] = filenames.get(file_path) or os.path.basename(file_path)
+    
+    for file_path in pending:
+        info = extracted[file_path]
+        if not info:
+            result['failed_files'].append(file_path)
+            continue
+        info['filename'] = filenames.get(file_path) or info['filename']
+        # 存入内容存储（上传的文件已在存储中），发票记录指向存储中的文件
+        digest = digests[file_path]
+        if blob_store.is_blob_path(file_path):
+            info['content_hash'], info['filepath'] = digest, file_path
+        else:
+            info['content_hash'], info['filepath'] = blob_store.put_file(file_path, digest, move=move_files)
+        result['invoice_info'].append(info)
+    
+    with app.app_context():
+        # 创建处理历史
+        user = db.session.get(User, user_id)
+        if not user:
+            raise RuntimeError('用户会话已过期，请重新登录')
+        
+        history = InvoiceHistory(
+            user_id=user_id,
+            email_account_id=email_account_id,
+            search_date=search_date,
+            invoice_count=0,  # 先设为0，后面再更新
+            processed_at=datetime.utcnow()
+        )
+        db.session.add(history)
+        db.session.flush()  # 获取ID，随第一批发票一起提交
+        result['history_id'] = history.id
+        print(f"创建处理历史记录，ID: {history.id}")
+        
+        # 一次查询完成去重，并批量写入新发票
+        if job:
+            job.check_cancelled()
+        status['current_file'] = '正在保存发票...'
+        result['new_invoices'], result['duplicate_invoices'] = save_invoices_bulk(
+            result['invoice_info'], result['history_id'], user_id
+        )
+        result['saved_invoices'] = result['new_invoices']
+        # 发票号重复的发票不保存，其文件若没有被其他发票引用则删除
+        file_remover.remove(unreferenced_files(result['duplicate_invoices']))
+        result['duplicate_invoices'] = content_duplicates + result['duplicate_invoices']
+        
+        # 使用实际保存成功的发票数量更新处理历史
+        history.invoice_count = len(result['saved_invoices'])
+        db.session.commit()
     
-    return render_template('processing.html')
+    IMPORT_FILES.inc(len(result['saved_invoices']), result='saved')
+    IMPORT_FILES.inc(len(result['duplicate_invoices']), result='duplicate')
+    IMPORT_FILES.inc(len(result['failed_files']), result='failed')
+    return result
+
+def invoices_by_content_hash(user_id, digests):
+    """查询用户已导入的、文件内容摘要在 digests 中的发票，返回 {摘要: 发票信息}"""
+    digests = list(digests)
+    chunk_size = app.config['IMPORT_DB_CHUNK_SIZE']
+    invoice_table = Invoice.__table__
+    known = {}
+    for i in range(0, len(digests), chunk_size):
+        rows = db.session.execute(
+            select(invoice_table.c.content_hash, invoice_table.c.invoice_no, invoice_table.c.invoice_date,
+                   invoice_table.c.seller, invoice_table.c.amount, invoice_table.c.project_name,
+                   invoice_table.c.file_path.label('filepath'))
+            .where(invoice_table.c.user_id == user_id,
+                   invoice_table.c.content_hash.in_(digests[i:i + chunk_size]))
+        ).mappings()
+        for row in rows:
+            known[row['content_hash']] = dict(row)
+    return known
+
+def unreferenced_files(records):
+    """从记录（含 file_path/filepath 和 content_hash）中找出可以删除的文件
+    
+    内容存储中的文件可能被多张发票（包括其他用户的发票）共用，仍被引用时不删除；修改时间在
+    STORAGE_GC_GRACE_HOURS 之内的也不删除，其他导入可能刚复用了该文件、还没有提交发票记录，
+    这些文件由孤儿文件清理在保留期过后处理。
+    """
+    paths = {}
+    for record in records:
+        path = record.get('file_path') or record.get('filepath')
+        if path:
+            paths[path] = record.get('content_hash')
+    digests = list({digest for digest in paths.values() if digest})
+    chunk_size = app.config['IMPORT_DB_CHUNK_SIZE']
+    referenced = set()
+    for i in range(0, len(digests), chunk_size):
+        referenced.update(db.session.execute(
+            select(Invoice.content_hash).where(Invoice.content_hash.in_(digests[i:i + chunk_size])).distinct()
+        ).scalars())
+    cutoff = time.time() - app.config['STORAGE_GC_GRACE_HOURS'] * 3600
+    removable = []
+    for path, digest in paths.items():
+        if digest and digest in referenced:
+            continue
+        if blob_store.is_blob_path(path):
+            try:
+                if os.path.getmtime(path) > cutoff:
+                    continue
+            except OSError:
+                continue
+        removable.append(path)
+    return removable
 
-def process_invoices_thread(email, password, search_date, user_id):
-    """后台线程处理发票"""
-    global processing_status
+def connect_to_email(email_address, password):
+    """连接IMAP邮箱（邮件处理模块在首次连接时才加载）"""
+    from email_invoice_downloader import connect_to_email as connect
+    return connect(email_address, password)
+
+def job_download_dir(job=None):
+    """每个任务使用独立的下载目录，避免并发任务互相覆盖文件"""
+    if job:
+        return os.path.join('downloads', f'job_{job.id}')
+    return os.path.join('downloads', datetime.now().strftime('%Y%m%d%H%M%S%f'))
+
+def sync_email_account(account_id, uids=None, job=None, date_since=None):
+    """增量同步单个邮箱账号中的发票（供定时同步、IDLE推送与命令行调用）
+    
+    只下载UID大于上次同步位置的邮件；首次同步时检索最近 SYNC_INITIAL_DAYS 天的邮件。
+    uids 不为空时只下载这些已知的新邮件，省去一次搜索。指定 date_since 时检索该日期之后的
+    全部邮件（用于回溯导入），已导入的发票按内容和发票号去重。返回同步结果摘要。
+    """
+    from email_invoice_downloader import get_uidvalidity, search_invoice_uids, download_attachments_by_uid
+    
+    with app.app_context():
+        account = db.session.get(EmailAccount, account_id)
+        if not account:
+            raise RuntimeError(f'邮箱账号 {account_id} 不存在')
+        user_id = account.user_id
+        email_address = account.email_address
+        password = account.password
+        last_uid = account.last_sync_uid
+        uidvalidity = account.sync_uidvalidity
+    
+    imap = connect_to_email(email_address, password)
+    if not imap:
+        raise RuntimeError('邮箱连接失败，请检查账号和授权码是否正确')
+    
+    download_dir = job_download_dir(job)
+    try:
+        imap.select('INBOX')
+        current_uidvalidity = get_uidvalidity(imap)
+        if date_since:
+            last_uid = None
+        elif not last_uid or current_uidvalidity != uidvalidity:
+            # 首次同步或UIDVALIDITY变化，按日期回溯
+            last_uid = None
+            date_since = datetime.utcnow() - timedelta(days=app.config['SYNC_INITIAL_DAYS'])
+        
+        if uids and last_uid and date_since is None:
+            # 跳过已经同步过的邮件（定时同步可能已处理）
+            uids = sorted(uid for uid in uids if uid > last_uid)
+        else:
+            uids = search_invoice_uids(imap, since_uid=last_uid, date_since=date_since)
+        print(f"邮箱 {email_address} 发现 {len(uids)} 封新邮件")
+        
+        if job:
+            job.check_cancelled()
+        files = download_attachments_by_uid(imap, uids, download_dir) if uids else []
+        summary = {'account_id': account_id, 'email': email_address, 'messages': len(uids),
+                   'files': len(files), 'saved': 0, 'duplicates': 0, 'failed': 0}
+        
+        if files:
+            result = import_invoice_files(files, user_id, email_account_id=account_id, job=job)
+            summary.update(saved=len(result['saved_invoices']), duplicates=len(result['duplicate_invoices']),
+                           failed=len(result['failed_files']), history_id=result['history_id'])
+            print(f"邮箱 {email_address} 同步导入 {len(result['saved_invoices'])} 张新发票，"
+                  f"{len(result['duplicate_invoices'])} 张重复")
+        
+        with app.app_context():
+            account = db.session.get(EmailAccount, account_id)
+            if account:
+                account.last_synced_at = datetime.utcnow()
+                account.sync_uidvalidity = current_uidvalidity
+                if uids:
+                    account.last_sync_uid = max(uids + [account.last_sync_uid or 0])
+                db.session.commit()
+        return summary
+    finally:
+        try:
+            imap.logout()
+        except Exception as e:
+            print(f"关闭IMAP连接时出错: {e}")
+
+def run_sync_job(account_id, uids=None):
+    """把邮箱同步作为后台任务提交并等待完成，使其与其他任务共享并发配额"""
+    with app.app_context():
+        account = db.session.get(EmailAccount, account_id)
+        if not account:
+            raise RuntimeError(f'邮箱账号 {account_id} 不存在')
+        user_id = account.user_id
+    
+    job = job_manager.submit(user_id, 'sync', sync_email_account, args=(account_id, uids), priority=PRIORITY_SYNC)
+    job.wait()
+    if job.status['status'] == 'error':
+        raise RuntimeError(job.status['error'])
+    return job.result
+
+def run_watch_job(user_id, file_paths):
+    """把监控目录中的一批文件作为后台任务导入并等待完成，返回导入结果"""
+    job = job_manager.submit(user_id, 'watch', import_invoice_files, args=(file_paths, user_id), priority=PRIORITY_SYNC)
+    job.wait()
+    if job.status['status'] == 'error':
+        raise RuntimeError(job.status['error'])
+    return job.result
+
+# 初始化定时同步调度器与IMAP IDLE推送监听（后者由 imap_idle.py 以守护进程方式运行）
+sync_scheduler = SyncScheduler(app, run_sync_job)
+idle_listener = IdleListener(app, connect_to_email, run_sync_job, sync_scheduler.account_lock)
+# 监控目录导入，由 watch_folder.py 以守护进程方式运行
+watch_folder = WatchFolder(app, run_watch_job)
+
+def process_invoices_thread(email, password, search_date, user_id, job):
+    """后台任务处理发票"""
+    from email_invoice_downloader import download_invoice_attachments
+    
+    processing_status = job.status
     
     try:
         processing_status['status'] = 'processing'
@@ -648,14 +970,11 @@ def process_invoices_thread(email, password, search_date, user_id):
             # 下载附件
             processing_status['current_file'] = '正在下载邮件附件...'
             start_time = time.time()
-            downloaded_count = download_invoice_attachments(imap, date_since=date_since)
+            downloads_dir = job_download_dir(job)
+            downloaded_count = download_invoice_attachments(imap, date_since=date_since, download_dir=downloads_dir)
+            job.check_cancelled()
             
             # 获取下载的文件列表并提取信息
-            downloads_dir = 'downloads'
-            invoice_info = []
-            duplicate_invoices = []  # 存储重复的发票信息
-            new_invoices = []  # 存储新的发票信息
-            saved_invoices = []  # 存储成功保存到数据库的发票
             
             if os.path.exists(downloads_dir):
                 files = [f for f in os.listdir(downloads_dir) if f.lower().endswith('.pdf')]
@@ -667,124 +986,25 @@ def process_invoices_thread(email, password, search_date, user_id):
                     processing_status['redirect_url'] = "/download_invoices"
                     return
                 
-                for i, file in enumerate(files):
-                    processing_status['current'] = i + 1
-                    file_path = os.path.join(downloads_dir, file)
-                    processing_status['current_file'] = file
-                    
-                    info = extract_invoice_info(file_path)
-                    if info:
-                        invoice_info.append(info)
-                
-                # 创建处理历史
-                history_id = None
+                # 查找是否使用了保存的邮箱账号
+                email_account_id = None
                 with app.app_context():
-                    try:
-                        # 获取用户对象
-                        user = db.session.get(User, user_id)
-                        if not user:
-                            processing_status['status'] = 'error'
-                            processing_status['error'] = '用户会话已过期，请重新登录'
-                            return
-                        
-                        history = InvoiceHistory(
-                            user_id=user_id,
-                            search_date=date_since.date() if date_since else None,
-                            invoice_count=0,  # 先设为0，后面再更新
-                            processed_at=datetime.utcnow()
-                        )
-                        
-                        # 查找是否使用了保存的邮箱账号
-                        email_account = EmailAccount.query.filter_by(user_id=user_id, email_address=email).first()
-                        if email_account:
-                            history.email_account_id = email_account.id
-                        
-                        db.session.add(history)
-                        db.session.commit()
-                        history_id = history.id
-                        print(f"成功创建处理历史记录，ID: {history_id}")
-                    except Exception as e:
-                        print(f"创建处理历史时出错: {e}")
-                        processing_status['status'] = 'error'
-                        processing_status['error'] = f'创建处理历史时出错: {str(e)}'
-                        return
+                    email_account = EmailAccount.query.filter_by(user_id=user_id, email_address=email).first()
+                    if email_account:
+                        email_account_id = email_account.id
                 
-                # 检查每张发票是否已存在
-                processing_status['current_file'] = '正在检查重复发票...'
-                for info in invoice_info:
-                    try:
-                        with app.app_context():
-                            # 创建新的数据库会话
-                            is_duplicate = False
-                            try:
-                                is_duplicate = check_duplicate_invoice(info, user_id)
-                            except Exception as check_error:
-                                print(f"检查重复发票时出错: {check_error}")
-                                # 继续处理，假设不是重复的
-                                is_duplicate = False
-                            
-                            if is_duplicate:
-                                # 发票已存在，添加到重复列表
-                                duplicate_invoices.append(info)
-                                print(f"发现重复发票: {info.get('invoice_no', '')}")
-                            else:
-                                # 新发票，添加到新发票列表
-                                new_invoices.append(info)
-                                print(f"发现新发票: {info.get('invoice_no', '')}")
-                                
-                                # 立即保存到数据库，确保即使处理中断也能保存部分结果
-                                try:
-                                    saved_invoice = save_invoice_to_db(info, history_id, user_id)
-                                    if saved_invoice:
-                                        print(f"成功保存发票到数据库: ID={saved_invoice.id}, 发票号={saved_invoice.invoice_no}")
-                                        saved_invoices.append(saved_invoice)
-                                    else:
-                                        print(f"保存发票失败，返回值为None: {info.get('invoice_no', '')}")
-                                except Exception as save_error:
-                                    print(f"保存发票到数据库时出错: {save_error}")
-                                    # 继续处理其他发票
-                    except Exception as e:
-                        print(f"处理发票时出错: {e}")
-                        # 继续处理其他发票
-                
-                # 只处理新发票
-                zip_filename = None
-                if new_invoices:
-                    processing_status['current_file'] = '正在重命名文件...'
-                    # 重命名文件并创建CSV
-                    renamed_dir, renamed_files = rename_invoice_files(new_invoices)
-                    
-                    processing_status['current_file'] = '正在创建ZIP文件...'
-                    # 创建ZIP文件
-                    zip_filename = create_invoice_zip(renamed_dir, user_id)
-                    
-                    # 更新处理历史
-                    if history_id:
-                        try:
-                            with app.app_context():
-                                # 使用Session.get()代替Query.get()
-                                history = db.session.get(InvoiceHistory, history_id)
-                                if history:
-                                    # 使用实际保存成功的发票数量
-                                    history.invoice_count = len(saved_invoices)
-                                    history.zip_filename = zip_filename
-                                    db.session.commit()
-                                    print(f"成功更新处理历史记录: ID={history_id}, 发票数量={len(saved_invoices)}")
-                        except Exception as e:
-                            print(f"更新处理历史时出错: {e}")
-                else:
-                    # 没有新发票，更新处理历史
-                    if history_id:
-                        try:
-                            with app.app_context():
-                                # 使用Session.get()代替Query.get()
-                                history = db.session.get(InvoiceHistory, history_id)
-                                if history:
-                                    history.invoice_count = 0
-                                    db.session.commit()
-                                    print(f"没有新发票，更新处理历史记录: ID={history_id}, 发票数量=0")
-                        except Exception as e:
-                            print(f"更新处理历史时出错: {e}")
+                # 提取信息并保存新发票
+                result = import_invoice_files(
+                    [os.path.join(downloads_dir, f) for f in files],
+                    user_id,
+                    email_account_id=email_account_id,
+                    search_date=date_since.date() if date_since else None,
+                    job=job
+                )
+                history_id = result['history_id']
+                invoice_info = result['invoice_info']
+                duplicate_invoices = result['duplicate_invoices']
+                saved_invoices = result['saved_invoices']
                 
                 # 计算处理时间
                 processing_time = time.time() - start_time
@@ -804,9 +1024,9 @@ def process_invoices_thread(email, password, search_date, user_id):
                 processing_status['status'] = 'complete'
                 
                 # 不使用url_for，直接构建URL路径
-                if saved_invoices and zip_filename:
-                    # 如果有新发票，跳转到结果页面
-                    processing_status['redirect_url'] = f"/invoice_results?new_count={len(saved_invoices)}&dup_count={len(duplicate_invoices)}&zip_file=/static/user_{user_id}/{zip_filename}"
+                if saved_invoices and history_id:
+                    # 如果有新发票，跳转到结果页面，新发票打包下载时流式生成ZIP
+                    processing_status['redirect_url'] = f"/invoice_results?new_count={len(saved_invoices)}&dup_count={len(duplicate_invoices)}&zip_file=/history/{history_id}/download&job_id={job.id}"
                 else:
                     # 没有新发票，跳转到下载页面
                     processing_status['redirect_url'] = "/download_invoices"
@@ -820,6 +1040,8 @@ def process_invoices_thread(email, password, search_date, user_id):
             except Exception as e:
                 print(f"关闭IMAP连接时出错: {e}")
             
+    except JobCancelled:
+        raise
     except Exception as e:
         processing_status['status'] = 'error'
         processing_status['error'] = str(e)
@@ -844,8 +1066,9 @@ def invoice_results():
     duplicate_info = []
     
     # 显示处理结果消息
-    if processing_status.get('message'):
-        flash(processing_status['message'])
+    job = job_manager.get(request.args.get('job_id', ''), current_user.id)
+    if job and job.status.get('message'):
+        flash(job.status['message'])
     
     return render_template('invoice_results.html', 
                           invoice_info=invoices,
@@ -867,8 +1090,10 @@ def history():
     # 检查是否有正在进行的处理
     current_processing = False
     processing_message = ""
-    if processing_status['status'] == 'processing':
+    active_jobs = job_manager.jobs_for_user(current_user.id, active_only=True)
+    if active_jobs:
         current_processing = True
+        processing_status = active_jobs[0].status
         if processing_status['total'] > 0:
             progress = f"{processing_status['current']}/{processing_status['total']}"
             processing_message = f"正在处理发票 ({progress})，当前文件: {processing_status['current_file']}"
@@ -888,17 +1113,39 @@ def download_file(user_id, filename):
         flash('无权限下载此文件')
         return redirect(url_for('dashboard'))
     
-    return send_file(os.path.join('static', f'user_{user_id}', filename), as_attachment=True)
+    path = safe_join(os.path.join('static', f'user_{user_id}'), filename)
+    if not path or not os.path.isfile(path):
+        abort(404)
+    return send_download(path, os.path.basename(filename))
+
+@app.route('/history/<int:history_id>/download')
+@login_required
+def download_history_zip(history_id):
+    """下载某次处理导入的发票（首次下载时流式生成ZIP并缓存）"""
+    history = InvoiceHistory.query.filter_by(id=history_id, user_id=current_user.id).first_or_404()
+    invoices = (Invoice.query.filter_by(user_id=current_user.id, history_id=history.id)
+                .order_by(Invoice.id).all())
+    if not invoices:
+        flash('该记录没有可下载的发票')
+        return redirect(url_for('history'))
+    download_name = f"invoices_{history.processed_at.strftime('%Y%m%d%H%M%S')}.zip"
+    cache_key = archive_cache.make_key('history', history.id, archive_fingerprint(invoices))
+    cached_path = archive_cache.get(cache_key)
+    if cached_path:
+        return send_download(cached_path, download_name, etag=cache_key, mimetype='application/zip')
+    return zip_response(invoice_zip_entries(invoices), download_name, cache_key=cache_key)
 
 # 新增发票管理相关路由
 @app.route('/invoices')
 @login_required
 def invoices():
     """发票管理页面"""
-    page = request.args.get('page', 1, type=int)
-    per_page = request.args.get('per_page', 10, type=int)
+    per_page = min(max(request.args.get('per_page', 10, type=int), 1), 100)
+    after = request.args.get('after', '')
+    before = request.args.get('before', '')
     
     # 获取筛选参数
+    q = request.args.get('q', '').strip()
     seller = request.args.get('seller', '')
     invoice_no = request.args.get('invoice_no', '')
     invoice_date_from = request.args.get('date_from', '')
@@ -910,52 +1157,34 @@ def invoices():
     sort_by = request.args.get('sort_by', '')
     sort_order = request.args.get('sort_order', 'asc')
     
-    # 打印筛选和排序参数，用于调试
-    print(f"筛选参数: seller={seller}, invoice_no={invoice_no}, date_from={invoice_date_from}, date_to={invoice_date_to}, amount_from={amount_from}, amount_to={amount_to}")
-    print(f"排序参数: sort_by={sort_by}, sort_order={sort_order}")
-    print(f"分页参数: page={page}, per_page={per_page}")
+    # 翻页链接需要保留的查询参数
+    filter_args = dict(q=q, seller=seller, invoice_no=invoice_no,
+                       date_from=invoice_date_from, date_to=invoice_date_to,
+                       amount_from=amount_from, amount_to=amount_to,
+                       sort_by=sort_by, sort_order=sort_order, per_page=per_page)
     
     try:
         # 构建查询
         query = Invoice.query.filter_by(user_id=current_user.id)
         
-        # 打印初始查询结果数量
-        initial_count = query.count()
-        print(f"初始查询结果: {initial_count} 条记录")
-        
-        # 检查数据库中是否有记录
-        if initial_count == 0:
-            print("警告: 数据库中没有发票记录")
-            # 检查用户ID是否正确
-            print(f"当前用户ID: {current_user.id}")
-            # 检查是否有任何发票记录
-            total_invoices = Invoice.query.count()
-            print(f"数据库中的总发票数: {total_invoices}")
-            if total_invoices > 0:
-                # 如果有发票但不属于当前用户，打印一些示例
-                sample_invoices = Invoice.query.limit(3).all()
-                for inv in sample_invoices:
-                    print(f"示例发票: ID={inv.id}, 用户ID={inv.user_id}, 发票号={inv.invoice_no}")
+        # 应用筛选条件，关键词筛选优先走全文索引，关键词过短时回退到LIKE
+        if q:
+            query = apply_search(query, Invoice, db.engine, q)
         
-        # 应用筛选条件
         if seller:
-            query = query.filter(Invoice.seller.like(f'%{seller}%'))
-            print(f"应用卖家筛选后的记录数: {query.count()}")
+            query = apply_search(query, Invoice, db.engine, seller, columns=['seller'])
         
         if invoice_no:
-            query = query.filter(Invoice.invoice_no.like(f'%{invoice_no}%'))
-            print(f"应用发票号筛选后的记录数: {query.count()}")
+            query = apply_search(query, Invoice, db.engine, invoice_no, columns=['invoice_no'])
         
         # 使用invoice_date字段进行日期筛选
         if invoice_date_from:
             try:
                 # 将输入日期转换为标准格式
                 date_from_obj = datetime.strptime(invoice_date_from, '%Y-%m-%d')
-                date_from_str = date_from_obj.strftime('%Y-%m-%d')
                 
-                # 简化日期筛选逻辑，使用简单的字符串比较
-                query = query.filter(Invoice.invoice_date >= date_from_str)
-                print(f"应用起始日期筛选后的记录数: {query.count()}")
+                # 使用标准日期字段筛选，可走 (user_id, invoice_date_std) 索引
+                query = query.filter(Invoice.invoice_date_std >= date_from_obj.date())
             except ValueError as e:
                 flash('起始日期格式无效，请使用YYYY-MM-DD格式')
                 print(f"日期解析错误: {str(e)}")
@@ -964,89 +1193,83 @@ def invoices():
             try:
                 # 将输入日期转换为标准格式
                 date_to_obj = datetime.strptime(invoice_date_to, '%Y-%m-%d')
-                date_to_str = date_to_obj.strftime('%Y-%m-%d')
                 
-                # 简化日期筛选逻辑，使用简单的字符串比较
-                query = query.filter(Invoice.invoice_date <= date_to_str)
-                print(f"应用结束日期筛选后的记录数: {query.count()}")
+                # 使用标准日期字段筛选，可走 (user_id, invoice_date_std) 索引
+                query = query.filter(Invoice.invoice_date_std <= date_to_obj.date())
             except ValueError as e:
                 flash('结束日期格式无效，请使用YYYY-MM-DD格式')
                 print(f"日期解析错误: {str(e)}")
         
         # 添加金额筛选
         if amount_from:
-            try:
-                # 尝试将金额转换为数字进行比较
-                amount_from_float = float(amount_from)
-                # 使用SQL函数将字符串转换为数字进行比较
-                from sqlalchemy import cast, Float
-                query = query.filter(cast(Invoice.amount, Float) >= amount_from_float)
-                print(f"应用最小金额筛选后的记录数: {query.count()}")
-            except ValueError:
+            # 使用以分为单位的整数金额比较，可走 (user_id, amount_cents) 索引
+            amount_from_cents = parse_amount_cents(amount_from)
+            if amount_from_cents is not None:
+                query = query.filter(Invoice.amount_cents >= amount_from_cents)
+            else:
                 flash('最小金额格式无效，请输入有效数字')
         
         if amount_to:
-            try:
-                amount_to_float = float(amount_to)
-                from sqlalchemy import cast, Float
-                query = query.filter(cast(Invoice.amount, Float) <= amount_to_float)
-                print(f"应用最大金额筛选后的记录数: {query.count()}")
-            except ValueError:
+            amount_to_cents = parse_amount_cents(amount_to)
+            if amount_to_cents is not None:
+                query = query.filter(Invoice.amount_cents <= amount_to_cents)
+            else:
                 flash('最大金额格式无效，请输入有效数字')
         
-        # 应用排序
-        if sort_by:
-            # 获取排序字段
-            if sort_by == 'invoice_no':
-                sort_column = Invoice.invoice_no
-            elif sort_by == 'invoice_date':
-                sort_column = Invoice.invoice_date
-            elif sort_by == 'seller':
-                sort_column = Invoice.seller
-            elif sort_by == 'amount':
-                # 对金额进行数值排序
-                from sqlalchemy import cast, Float
-                sort_column = cast(Invoice.amount, Float)
-            elif sort_by == 'project_name':
-                sort_column = Invoice.project_name
-            else:
-                # 默认按创建时间降序排序
-                sort_column = Invoice.created_at
-                sort_order = 'desc'
-            
-            # 根据排序顺序应用排序
-            if sort_order == 'desc':
-                query = query.order_by(sort_column.desc())
-            else:
-                query = query.order_by(sort_column.asc())
-            
-            print(f"应用排序: {sort_by} {sort_order}")
+        # 排序字段及其Python类型（用于解析翻页游标）
+        sort_columns = {
+            'invoice_no': (Invoice.invoice_no, str),
+            'invoice_date': (Invoice.invoice_date_std, date),
+            'seller': (Invoice.seller, str),
+            'amount': (Invoice.amount_cents, int),
+            'project_name': (Invoice.project_name, str),
+        }
+        if sort_by in sort_columns:
+            sort_column, value_type = sort_columns[sort_by]
+            descending = sort_order == 'desc'
         else:
             # 默认按创建时间降序排序
-            query = query.order_by(Invoice.created_at.desc())
-        
-        # 打印最终查询结果数量
-        final_count = query.count()
-        print(f"最终查询结果: {final_count} 条记录")
-        
-        # 分页获取发票
-        pagination = query.paginate(page=page, per_page=per_page)
-        invoices = pagination.items
-        
-        # 打印结果数量和日期格式，用于调试
-        print(f"分页后的查询结果: 共找到 {len(invoices)} 条记录")
-        if invoices:
-            print(f"第一条记录的日期: {invoices[0].invoice_date}")
+            sort_column, value_type = Invoice.created_at, datetime
+            descending = True
+        
+        # 同一筛选条件下来回翻页时直接使用缓存的发票ID列表和总数
+        cache_key = listing_cache.make_key(current_user.id, dict(filter_args, after=after, before=before))
+        cached = listing_cache.get(cache_key)
+        if cached is None:
+            # 只统计一次总数，结果集很大时只数到上限
+            total_count, total_capped = count_capped(query, app.config['INVOICE_COUNT_LIMIT'])
+            
+            # 按 (排序字段, id) 游标分页，翻到任意深度的代价都相同
+            pagination = paginate_keyset(query, sort_column, Invoice.id, descending, per_page,
+                                         after=after, before=before, value_type=value_type,
+                                         dialect_name=db.engine.dialect.name)
+            invoices = pagination.items
+            listing_cache.set(cache_key, {
+                'ids': [invoice.id for invoice in invoices],
+                'has_prev': pagination.has_prev,
+                'has_next': pagination.has_next,
+                'prev_cursor': pagination.prev_cursor,
+                'next_cursor': pagination.next_cursor,
+                'total_count': total_count,
+                'total_capped': total_capped
+            })
         else:
-            # 如果没有找到记录，尝试获取所有发票并打印前几条记录的信息
-            all_invoices = Invoice.query.filter_by(user_id=current_user.id).limit(5).all()
-            print(f"数据库中的发票记录示例:")
-            for inv in all_invoices:
-                print(f"发票ID: {inv.id}, 日期: '{inv.invoice_date}', 卖家: '{inv.seller}', 金额: '{inv.amount}'")
+            # 按主键取回发票并恢复缓存时的顺序
+            by_id = {invoice.id: invoice for invoice in Invoice.query.filter(
+                Invoice.user_id == current_user.id, Invoice.id.in_(cached['ids'])
+            ).all()} if cached['ids'] else {}
+            invoices = [by_id[invoice_id] for invoice_id in cached['ids'] if invoice_id in by_id]
+            pagination = KeysetPage(invoices, cached['has_prev'], cached['has_next'],
+                                    cached['prev_cursor'], cached['next_cursor'])
+            total_count, total_capped = cached['total_count'], cached['total_capped']
         
         return render_template('invoices.html', 
                               invoices=invoices, 
                               pagination=pagination,
+                              total_count=total_count,
+                              total_capped=total_capped,
+                              filter_args=filter_args,
+                              q=q,
                               seller=seller,
                               invoice_no=invoice_no,
                               date_from=invoice_date_from,
@@ -1059,6 +1282,10 @@ def invoices():
         return render_template('invoices.html', 
                               invoices=[], 
                               pagination=None,
+                              total_count=0,
+                              total_capped=False,
+                              filter_args=filter_args,
+                              q=q,
                               seller=seller,
                               invoice_no=invoice_no,
                               date_from=invoice_date_from,
@@ -1099,8 +1326,15 @@ def edit_invoice(id):
         return redirect(url_for('invoices'))
     
     if request.method == 'POST':
+        # 发票号不能与该用户的其他发票重复（由唯一索引 ux_invoice_user_invoice_no 保证）
+        invoice_no = request.form.get('invoice_no', '').strip()
+        if invoice_no and Invoice.query.filter(Invoice.user_id == current_user.id, Invoice.invoice_no == invoice_no,
+                                               Invoice.id != invoice.id).first():
+            flash(f'发票号 {invoice_no} 已存在，请检查后重新填写')
+            return redirect(url_for('edit_invoice', id=invoice.id))
+        
         # 更新发票信息
-        invoice.invoice_no = request.form.get('invoice_no', '')
+        invoice.invoice_no = invoice_no
         invoice.invoice_date = request.form.get('invoice_date', '')
         invoice.seller = request.form.get('seller', '')
         invoice.amount = request.form.get('amount', '')
@@ -1133,7 +1367,14 @@ def edit_invoice(id):
         new_filename = new_filename.replace(':', '_').replace('*', '_').replace('?', '_').replace('"', '_').replace('<', '_').replace('>', '_').replace('|', '_')
         invoice.current_filename = new_filename
         
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # 检查之后有并发写入了相同发票号的发票
+            db.session.rollback()
+            flash(f'发票号 {invoice_no} 已存在，请检查后重新填写')
+            return redirect(url_for('edit_invoice', id=id))
+        listing_cache.invalidate(current_user.id)
         flash('发票信息已更新')
         return redirect(url_for('invoice_detail', id=invoice.id))
     
@@ -1159,9 +1400,7 @@ def download_invoice(id):
         flash('发票文件不存在')
         return redirect(url_for('invoice_detail', id=invoice.id))
     
-    return send_file(invoice.file_path, 
-                    as_attachment=True, 
-                    download_name=invoice.current_filename)
+    return send_download(invoice.file_path, invoice.current_filename, etag=invoice.content_hash)
 
 @app.route('/invoice/<int:id>/delete', methods=['POST'])
 @login_required
@@ -1178,115 +1417,100 @@ def delete_invoice(id):
         flash('无权限删除此发票')
         return redirect(url_for('invoices'))
     
-    # 删除文件
-    try:
-        if os.path.exists(invoice.file_path):
-            os.remove(invoice.file_path)
-    except Exception as e:
-        flash(f'删除文件时出错: {str(e)}')
-    
-    # 删除数据库记录
+    # 删除数据库记录，文件不再被引用时由后台线程删除
+    record = {'file_path': invoice.file_path, 'content_hash': invoice.content_hash}
     db.session.delete(invoice)
     db.session.commit()
+    listing_cache.invalidate(current_user.id)
+    file_remover.remove(unreferenced_files([record]))
     
     flash('发票已删除')
     return redirect(url_for('invoices'))
 
+def selected_invoice_ids():
+    """读取表单中选中的发票ID（去重并忽略无效值）"""
+    ids = []
+    for value in request.form.getlist('invoice_ids'):
+        try:
+            ids.append(int(value))
+        except (TypeError, ValueError):
+            continue
+    return list(dict.fromkeys(ids))
+
+def load_user_invoices(invoice_ids, user_id):
+    """用 IN 查询一次取回当前用户选中的发票，按选择顺序返回"""
+    chunk_size = app.config['IMPORT_DB_CHUNK_SIZE']
+    by_id = {}
+    for i in range(0, len(invoice_ids), chunk_size):
+        for invoice in Invoice.query.filter(Invoice.user_id == user_id,
+                                            Invoice.id.in_(invoice_ids[i:i + chunk_size])).all():
+            by_id[invoice.id] = invoice
+    return [by_id[invoice_id] for invoice_id in invoice_ids if invoice_id in by_id]
+
 @app.route('/invoices/batch_download', methods=['POST'])
 @login_required
 def batch_download_invoices():
     """批量下载发票"""
-    invoice_ids = request.form.getlist('invoice_ids')
+    invoice_ids = selected_invoice_ids()
     
     if not invoice_ids:
         flash('请选择要下载的发票')
         return redirect(url_for('invoices'))
     
-    # 创建临时目录
-    temp_dir = f'temp_batch_{current_user.id}_{datetime.now().strftime("%Y%m%d%H%M%S")}'
-    os.makedirs(temp_dir, exist_ok=True)
-    
-    # 复制选中的发票到临时目录
-    for invoice_id in invoice_ids:
-        # 使用Session.get()代替Query.get()
-        invoice = db.session.get(Invoice, invoice_id)
-        if invoice and invoice.user_id == current_user.id and os.path.exists(invoice.file_path):
-            shutil.copy2(invoice.file_path, os.path.join(temp_dir, invoice.current_filename))
-    
-    # 创建CSV文件
-    csv_path = os.path.join(temp_dir, "发票信息汇总.csv")
-    with open(csv_path, 'w', newline='', encoding='utf-8-sig') as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=['发票号码', '开票日期', '开票方名称', '含税金额', '项目名称', '文件名'])
-        writer.writeheader()
-        
-        for invoice_id in invoice_ids:
-            # 使用Session.get()代替Query.get()
-            invoice = db.session.get(Invoice, invoice_id)
-            if invoice and invoice.user_id == current_user.id:
-                writer.writerow({
-                    '发票号码': invoice.invoice_no,
-                    '开票日期': invoice.invoice_date,
-                    '开票方名称': invoice.seller,
-                    '含税金额': invoice.amount,
-                    '项目名称': invoice.project_name,
-                    '文件名': invoice.current_filename
-                })
-    
-    # 创建ZIP文件
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    zip_filename = f"selected_invoices_{timestamp}.zip"
-    user_static_dir = os.path.join('static', f'user_{current_user.id}')
-    os.makedirs(user_static_dir, exist_ok=True)
-    zip_path = os.path.join(user_static_dir, zip_filename)
-    
-    with zipfile.ZipFile(zip_path, 'w') as zipf:
-        for root, dirs, files in os.walk(temp_dir):
-            for file in files:
-                file_path = os.path.join(root, file)
-                zipf.write(file_path, os.path.basename(file_path))
-    
-    # 清理临时目录
-    shutil.rmtree(temp_dir)
+    invoices = load_user_invoices(invoice_ids, current_user.id)
     
-    return redirect(url_for('download_file', user_id=current_user.id, filename=zip_filename))
+    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
+    return zip_response(invoice_zip_entries(invoices), f"selected_invoices_{timestamp}.zip")
 
 @app.route('/invoices/batch_delete', methods=['POST'])
 @login_required
 def batch_delete_invoices():
     """批量删除发票"""
-    invoice_ids = request.form.getlist('invoice_ids')
+    invoice_ids = selected_invoice_ids()
     
     if not invoice_ids:
         flash('请选择要删除的发票')
         return redirect(url_for('invoices'))
     
+    invoice_table = Invoice.__table__
+    chunk_size = app.config['IMPORT_DB_CHUNK_SIZE']
     deleted_count = 0
-    error_count = 0
+    file_records = []
     
-    for invoice_id in invoice_ids:
-        try:
-            # 使用Session.get()代替Query.get()
-            invoice = db.session.get(Invoice, invoice_id)
-            if invoice and invoice.user_id == current_user.id:
-                # 尝试删除文件
-                try:
-                    if os.path.exists(invoice.file_path):
-                        os.remove(invoice.file_path)
-                except Exception as e:
-                    print(f"删除文件时出错: {str(e)}")
-                
-                # 删除数据库记录
-                db.session.delete(invoice)
-                deleted_count += 1
-        except Exception as e:
-            error_count += 1
-            print(f"删除发票 {invoice_id} 时出错: {str(e)}")
+    try:
+        conn = db.session.connection()
+        for i in range(0, len(invoice_ids), chunk_size):
+            in_selection = and_(invoice_table.c.user_id == current_user.id,
+                                invoice_table.c.id.in_(invoice_ids[i:i + chunk_size]))
+            # 先取出文件路径和汇总字段，再一条 DELETE 删除
+            rows = conn.execute(
+                select(invoice_table.c.file_path, invoice_table.c.content_hash,
+                       *[invoice_table.c[name] for name in TRACKED_FIELDS])
+                .where(in_selection)
+            ).mappings().all()
+            if not rows:
+                continue
+            conn.execute(delete(invoice_table).where(in_selection))
+            # 批量删除不经过ORM事件，需要手动从汇总表中扣除
+            apply_invoice_records(conn, rows, sign=-1)
+            file_records.extend(rows)
+            deleted_count += len(rows)
+        
+        # 提交数据库更改
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"批量删除发票时出错: {str(e)}")
+        flash(f'删除发票时出错: {str(e)}')
+        return redirect(url_for('invoices'))
     
-    # 提交数据库更改
-    db.session.commit()
+    listing_cache.invalidate(current_user.id)
+    # 不再被引用的文件由后台线程删除
+    file_remover.remove(unreferenced_files(file_records))
     
-    if error_count > 0:
-        flash(f'成功删除 {deleted_count} 张发票，{error_count} 张发票删除失败')
+    skipped_count = len(invoice_ids) - deleted_count
+    if skipped_count > 0:
+        flash(f'成功删除 {deleted_count} 张发票，{skipped_count} 张发票不存在或无权删除')
     else:
         flash(f'成功删除 {deleted_count} 张发票')
     
@@ -1298,108 +1522,36 @@ def clear_invoice_filters():
     """清除发票筛选条件"""
     return redirect(url_for('invoices'))
 
+def run_maintenance_job(task_name, user_id, redirect_url, job):
+    """在后台任务中运行数据维护任务（分块提交，可中断续跑）"""
+    with app.app_context():
+        run = run_task(task_name, user_id=user_id, job=job)
+        job.status['redirect_url'] = redirect_url
+        print(f"维护任务 {task_name} 完成: 处理 {run.processed} 条记录，更新 {run.updated} 条记录")
+        return {'processed': run.processed, 'updated': run.updated}
+
 @app.route('/normalize_dates')
 @login_required
 def normalize_dates():
-    """将所有发票的日期格式标准化为YYYY-MM-DD"""
-    import re
-    
-    # 获取当前用户的所有发票
-    invoices = Invoice.query.filter_by(user_id=current_user.id).all()
-    updated_count = 0
-    
-    for invoice in invoices:
-        original_date = invoice.invoice_date
-        
-        # 如果日期为空，跳过
-        if not original_date:
-            continue
-        
-        # 检查是否已经是标准格式
-        if re.match(r'^\d{4}-\d{2}-\d{2}$', original_date):
-            continue
-        
-        # 尝试转换中文日期格式 (YYYY年MM月DD日)
-        chinese_pattern = r'(\d{4})年(\d{1,2})月(\d{1,2})日'
-        match = re.search(chinese_pattern, original_date)
-        if match:
-            year, month, day = match.groups()
-            invoice.invoice_date = f"{year}-{int(month):02d}-{int(day):02d}"
-            updated_count += 1
-            continue
-        
-        # 尝试其他常见格式
-        try:
-            for fmt in ['%Y/%m/%d', '%Y.%m.%d', '%Y-%m-%d']:
-                try:
-                    dt = datetime.strptime(original_date, fmt)
-                    invoice.invoice_date = dt.strftime('%Y-%m-%d')
-                    updated_count += 1
-                    break
-                except ValueError:
-                    continue
-        except Exception as e:
-            print(f"日期格式化失败: {str(e)} - 发票ID: {invoice.id}, 日期: {original_date}")
-    
-    # 提交更改
-    db.session.commit()
-    
-    flash(f'成功更新 {updated_count} 张发票的日期格式为标准格式 (YYYY-MM-DD)')
-    return redirect(url_for('invoices'))
+    """将当前用户所有发票的日期格式标准化为YYYY-MM-DD（后台分块执行）"""
+    job = job_manager.submit(current_user.id, 'normalize_dates', run_maintenance_job,
+                             args=('normalize_dates', current_user.id, '/invoices'),
+                             priority=PRIORITY_BACKFILL)
+    return render_template('processing.html', job_id=job.id, title='正在标准化发票日期', message='任务排队中，请稍候...')
 
 @app.route('/repair_database')
 @login_required
 def repair_database():
-    """检查并修复数据库中的发票记录"""
+    """检查并修复数据库中的发票记录（后台分块执行）"""
     # 只允许管理员执行此操作
     if not current_user.is_admin:
         flash('您没有权限执行此操作')
         return redirect(url_for('dashboard'))
     
-    try:
-        # 获取所有发票记录
-        invoices = Invoice.query.all()
-        total_count = len(invoices)
-        updated_count = 0
-        error_count = 0
-        
-        for invoice in invoices:
-            try:
-                # 检查发票日期格式
-                if invoice.invoice_date:
-                    # 尝试标准化日期格式
-                    try:
-                        for fmt in ['%Y年%m月%d日', '%Y/%m/%d', '%Y-%m-%d', '%Y.%m.%d']:
-                            try:
-                                dt = datetime.strptime(invoice.invoice_date, fmt)
-                                invoice.invoice_date = dt.strftime('%Y-%m-%d')
-                                break
-                            except ValueError:
-                                continue
-                    except Exception as e:
-                        print(f"日期格式化失败: {str(e)}")
-                
-                # 更新文件名格式
-                if invoice.seller:
-                    seller_clean = invoice.seller[:20].replace('/', '_').replace('\\', '_')
-                    new_filename = f"{invoice.invoice_date}-{seller_clean}-{invoice.amount}-{invoice.invoice_no}.pdf"
-                    new_filename = new_filename.replace(':', '_').replace('*', '_').replace('?', '_').replace('"', '_').replace('<', '_').replace('>', '_').replace('|', '_')
-                    
-                    if invoice.current_filename != new_filename:
-                        invoice.current_filename = new_filename
-                        updated_count += 1
-            except Exception as e:
-                print(f"修复发票记录时出错 (ID: {invoice.id}): {str(e)}")
-                error_count += 1
-        
-        # 提交更改
-        db.session.commit()
-        
-        flash(f'数据库修复完成: 共检查 {total_count} 条记录，更新 {updated_count} 条记录，{error_count} 条记录出错')
-    except Exception as e:
-        flash(f'数据库修复过程中出错: {str(e)}')
-    
-    return redirect(url_for('dashboard'))
+    job = job_manager.submit(current_user.id, 'repair_database', run_maintenance_job,
+                             args=('repair_database', None, '/dashboard'),
+                             priority=PRIORITY_BACKFILL)
+    return render_template('processing.html', job_id=job.id, title='正在修复发票数据', message='任务排队中，请稍候...')
 
 # 添加一个简单的管理员检查属性
 @property
@@ -1414,6 +1566,7 @@ def create_tables():
     """创建数据库表"""
     with app.app_context():
         db.create_all()
+        ensure_fts(db.engine)
 
 def check_duplicate_invoice(invoice_info, user_id=None):
     """检查发票是否已存在"""
@@ -1510,6 +1663,7 @@ def create_test_invoice():
         # 添加到数据库
         db.session.add(test_invoice)
         db.session.commit()
+        listing_cache.invalidate(current_user.id)
         
         flash(f'成功创建测试发票记录: ID={test_invoice.id}')
     except Exception as e:
@@ -1518,10 +1672,67 @@ def create_test_invoice():
     
     return redirect(url_for('invoices'))
 
+def process_uploaded_invoice(file_path, content_hash, filename, user_id, job):
+    """提取并保存手动上传的单张发票（在后台任务中执行）"""
+    # 上传页面等待超时后改为显示进度页面，完成后回到上传页面显示结果
+    job.status['redirect_url'] = f"/upload_invoice?job_id={job.id}"
+    with app.app_context():
+        if content_hash in invoices_by_content_hash(user_id, [content_hash]):
+            return {'extracted': True, 'duplicate': True}
+    
+    with job_manager.llm_slot(user_id):
+        info = extract_invoice_info(file_path)
+    if not info:
+        return {'extracted': False}
+    info['filename'] = filename
+    info['content_hash'] = content_hash
+    
+    job.check_cancelled()
+    with app.app_context():
+        # 不事先查询发票号，由插入结果判断是否重复
+        record = invoice_record(info, None, user_id)
+        try:
+            invoice_id = insert_invoice(record)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"保存发票到数据库时出错: {str(e)}")
+            return {'extracted': True}
+        if invoice_id is None:
+            return {'extracted': True, 'duplicate': True}
+        listing_cache.invalidate(user_id)
+        return {'extracted': True, 'invoice_id': invoice_id, 'invoice_no': record['invoice_no']}
+
+def upload_outcome(job):
+    """用提示信息告知上传任务的结果，导入成功时返回跳转到发票详情页的响应"""
+    result = job.result or {}
+    if job.status['status'] == 'error':
+        flash(f"发票导入失败: {job.status['error']}")
+    elif job.status['status'] == 'cancelled':
+        flash('发票导入已取消')
+    elif result.get('duplicate'):
+        flash('发票已存在，无需重复导入')
+    elif result.get('invoice_id'):
+        flash(f"发票导入成功: {result['invoice_no']}")
+        return redirect(url_for('invoice_detail', id=result['invoice_id']))
+    elif result.get('extracted'):
+        flash('发票导入失败，请重试')
+    else:
+        flash('无法从PDF中提取发票信息，请确保上传的是有效的发票文件')
+    return None
+
 @app.route('/upload_invoice', methods=['GET', 'POST'])
 @login_required
 def upload_invoice():
     """手动上传发票"""
+    if request.method == 'GET' and request.args.get('job_id'):
+        # 从进度页面返回，显示已完成的上传任务的结果
+        job = job_manager.get(request.args['job_id'], current_user.id)
+        if job and job.done:
+            response = upload_outcome(job)
+            if response:
+                return response
+    
     if request.method == 'POST':
         # 检查是否有文件上传
         if 'invoice_file' not in request.files:
@@ -1536,40 +1747,182 @@ def upload_invoice():
             return redirect(request.url)
         
         if file and file.filename.lower().endswith('.pdf'):
-            # 确保目录存在
-            os.makedirs('uploads', exist_ok=True)
-            
-            # 保存文件
+            # 保存文件到内容存储
             timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
             filename = f"manual_upload_{timestamp}.pdf"
-            file_path = os.path.join('uploads', filename)
-            file.save(file_path)
+            content_hash, file_path = blob_store.put_stream(file.stream)
             
-            # 提取发票信息
-            info = extract_invoice_info(file_path)
-            
-            if info:
-                # 检查是否为重复发票
-                is_duplicate = check_duplicate_invoice(info, current_user.id)
-                
-                if is_duplicate:
-                    flash('发票已存在，无需重复导入')
-                else:
-                    # 保存到数据库
-                    invoice = save_invoice_to_db(info, None, current_user.id)
-                    
-                    if invoice:
-                        flash(f'发票导入成功: {invoice.invoice_no}')
-                        return redirect(url_for('invoice_detail', id=invoice.id))
-                    else:
-                        flash('发票导入失败，请重试')
-            else:
-                flash('无法从PDF中提取发票信息，请确保上传的是有效的发票文件')
+            # 以最高优先级提交任务并等待结果，与其他任务共享大模型调用配额
+            job = job_manager.submit(current_user.id, 'upload', process_uploaded_invoice,
+                                     args=(file_path, content_hash, filename, current_user.id),
+                                     priority=PRIORITY_INTERACTIVE)
+            if not job.wait(app.config['UPLOAD_WAIT_SECONDS']):
+                # 等待过久时不再占用请求线程，改为显示处理进度
+                return redirect(url_for('job_progress', job_id=job.id))
+            response = upload_outcome(job)
+            if response:
+                return response
         else:
             flash('只支持上传PDF格式的发票文件')
     
     return render_template('upload_invoice.html')
 
+def zip_member_name(member):
+    """ZIP成员的文件名；没有UTF-8标记的文件名（Windows中文系统生成的压缩包）按GBK解码"""
+    name = member.filename
+    if not member.flag_bits & 0x800:
+        try:
+            name = name.encode('cp437').decode('gbk')
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            pass
+    return os.path.basename(name)
+
+def store_uploaded_files(uploads):
+    """把上传的PDF及ZIP压缩包中的PDF逐个流式存入内容存储
+    
+    uploads 为 [(文件流, 文件名)]，返回 [(存储路径, 原始文件名)]。
+    """
+    max_files = app.config['UPLOAD_MAX_FILES']
+    stored = []
+    
+    def add(stream, filename):
+        if len(stored) >= max_files:
+            raise ValueError(f'一次最多上传 {max_files} 个发票文件')
+        stored.append((blob_store.put_stream(stream)[1], filename))
+    
+    for stream, filename in uploads:
+        filename = os.path.basename(filename or '')
+        if filename.lower().endswith('.pdf'):
+            add(stream, filename)
+        elif filename.lower().endswith('.zip'):
+            with zipfile.ZipFile(stream) as archive:
+                for member in archive.infolist():
+                    name = zip_member_name(member)
+                    # 跳过目录和 macOS 压缩时附带的资源文件
+                    if member.is_dir() or not name.lower().endswith('.pdf') or name.startswith('._') \
+                            or member.filename.startswith('__MACOSX/'):
+                        continue
+                    with archive.open(member) as stream:
+                        add(stream, name)
+    return stored
+
+def process_uploaded_files(files, user_id, job):
+    """提取并保存批量上传的发票（在后台任务中执行）"""
+    job.status['status'] = 'processing'
+    start_time = time.time()
+    result = import_invoice_files([path for path, _ in files], user_id, job=job, filenames=dict(files))
+    saved_count = len(result['saved_invoices'])
+    duplicate_count = len(result['duplicate_invoices'])
+    failed_count = len(files) - saved_count - duplicate_count
+    job.status['message'] = (f"上传 {len(files)} 个文件，成功导入 {saved_count} 张新发票，"
+                             f"{duplicate_count} 张为重复发票，{failed_count} 个文件未能识别\n"
+                             f"处理时间: {time.time() - start_time:.2f} 秒")
+    if saved_count:
+        job.status['redirect_url'] = (f"/invoice_results?new_count={saved_count}&dup_count={duplicate_count}"
+                                      f"&zip_file=/history/{result['history_id']}/download&job_id={job.id}")
+    else:
+        job.status['redirect_url'] = '/invoices'
+    return {'saved': saved_count, 'duplicates': duplicate_count, 'failed': failed_count,
+            'history_id': result['history_id']}
+
+@app.route('/upload_multiple', methods=['GET', 'POST'])
+@login_required
+def upload_multiple():
+    """批量上传发票（多个PDF或ZIP压缩包），文件存储后立即返回，在后台任务中并行提取"""
+    if request.method == 'POST':
+        uploads = [upload for upload in request.files.getlist('file[]') if upload and upload.filename]
+        if not uploads:
+            flash('没有选择文件')
+            return redirect(request.url)
+        
+        try:
+            files = store_uploaded_files([(upload.stream, upload.filename) for upload in uploads])
+        except zipfile.BadZipFile:
+            flash('无法读取ZIP压缩包，请检查文件是否完整')
+            return redirect(request.url)
+        except ValueError as e:
+            flash(str(e))
+            return redirect(request.url)
+        if not files:
+            flash('没有找到PDF格式的发票文件')
+            return redirect(request.url)
+        
+        job = job_manager.submit(current_user.id, 'upload', process_uploaded_files,
+                                 args=(files, current_user.id), priority=PRIORITY_IMPORT)
+        if request.accept_mimetypes.best == 'application/json':
+            return jsonify({'job_id': job.id, 'files': len(files)}), 202
+        return render_template('processing.html', job_id=job.id, title='正在处理上传的发票',
+                               message=f'已上传 {len(files)} 个文件，任务排队中，请稍候...')
+    
+    return render_template('upload_multiple.html', max_files=app.config['UPLOAD_MAX_FILES'],
+                           chunk_size=app.config['UPLOAD_CHUNK_SIZE'])
+
+@app.errorhandler(UploadError)
+def handle_upload_error(e):
+    return jsonify({'error': str(e)}), e.status
+
+@app.route('/uploads', methods=['POST'])
+@login_required
+def create_upload():
+    """创建分块上传"""
+    data = request.get_json(silent=True) or {}
+    state = chunked_uploads.create(current_user.id, data.get('filename'), data.get('size'), data.get('sha256'))
+    return jsonify({'upload_id': state['upload_id'], 'offset': state['offset'],
+                    'chunk_size': app.config['UPLOAD_CHUNK_SIZE']}), 201
+
+@app.route('/uploads/<upload_id>', methods=['GET'])
+@login_required
+def upload_status(upload_id):
+    """查询分块上传已接收的字节数"""
+    state = chunked_uploads.get(upload_id, current_user.id)
+    return jsonify({'upload_id': upload_id, 'offset': state['offset'], 'size': state['size'],
+                    'complete': state['complete']})
+
+@app.route('/uploads/<upload_id>', methods=['PUT'])
+@login_required
+def upload_chunk(upload_id):
+    """接收一个分块，直接从请求流写入暂存文件"""
+    offset = chunked_uploads.write_chunk(upload_id, current_user.id, request.args.get('offset', type=int),
+                                         request.stream, request.content_length,
+                                         request.headers.get('X-Chunk-SHA256'))
+    return jsonify({'upload_id': upload_id, 'offset': offset})
+
+@app.route('/uploads/<upload_id>/complete', methods=['POST'])
+@login_required
+def complete_upload(upload_id):
+    """校验上传完成的文件并存入内容存储"""
+    try:
+        state = chunked_uploads.finish(upload_id, current_user.id,
+                                       lambda f, filename: store_uploaded_files([(f, filename)]))
+    except zipfile.BadZipFile:
+        raise UploadError('无法读取ZIP压缩包，请检查文件是否完整')
+    except ValueError as e:
+        raise UploadError(str(e))
+    return jsonify({'upload_id': upload_id, 'files': len(state['files'])})
+
+@app.route('/uploads/import', methods=['POST'])
+@login_required
+def import_uploads():
+    """把已完成的分块上传作为一个后台任务导入"""
+    upload_ids = (request.get_json(silent=True) or {}).get('upload_ids') or []
+    files = chunked_uploads.take([str(upload_id) for upload_id in upload_ids], current_user.id,
+                                 max_files=app.config['UPLOAD_MAX_FILES'])
+    if not files:
+        raise UploadError('没有找到PDF格式的发票文件')
+    job = job_manager.submit(current_user.id, 'upload', process_uploaded_files,
+                             args=(files, current_user.id), priority=PRIORITY_IMPORT)
+    return jsonify({'job_id': job.id, 'files': len(files),
+                    'status_url': url_for('job_progress', job_id=job.id)}), 202
+
+@app.route('/jobs/<job_id>')
+@login_required
+def job_progress(job_id):
+    """后台任务的处理进度页面"""
+    if not job_manager.get(job_id, current_user.id):
+        flash('任务不存在或已结束')
+        return redirect(url_for('dashboard'))
+    return render_template('processing.html', job_id=job_id, title='正在处理发票', message='任务排队中，请稍候...')
+
 @app.route('/import_test_data')
 @login_required
 def import_test_data():
@@ -1685,6 +2038,12 @@ if __name__ == '__main__':
     # 创建数据库表
     create_tables()
     
+    # 启动定时同步（debug模式下只在重载后的子进程中启动，避免重复调度）
+    if app.config['SYNC_ENABLED'] and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        sync_scheduler.start()
+    if app.config['STORAGE_GC_ENABLED'] and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        storage_gc.start()
+    
     # 获取端口和主机配置
     port = Config.get_port()
     host = Config.get_host()
@@ -1694,6 +2053,8 @@ if __name__ == '__main__':
     print(f"模型: {Config.get_model()}")
     print(f"API基础URL: {Config.get_api_base()}")
     print(f"监听地址: {host}:{port}")
+    print(f"定时同步: {'开启' if app.config['SYNC_ENABLED'] else '关闭'}")
+    print(f"孤儿文件清理: {'开启' if app.config['STORAGE_GC_ENABLED'] else '关闭'}")
     print("===================\n")
     
     app.run(host=host, port=port, debug=True)
\ No newline at end of file
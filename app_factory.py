@@ -0,0 +1,159 @@
+"""
+应用工厂
+
+create_app() 创建Flask应用、从环境变量读取配置并初始化数据库和各扩展，不注册页面路由，
+也不加载表单、PDF解析、大模型和IMAP相关的模块。Web服务由 app.py 在此基础上注册路由；
+只需要数据库上下文的脚本（migrate_dates.py、reset_database.py）直接调用 create_app()。
+
+- 各扩展对象是模块级单例，一个进程中只创建一个应用
+- Flask-Migrate（及 alembic）只在通过 flask 命令运行时加载，供 `flask db upgrade` 等迁移命令使用
+"""
+
+import os
+
+from dotenv import load_dotenv
+from flask import Flask
+
+from models import db
+from db_engine import load_engine_config, engine_options, init_engine
+from jobs import JobManager
+from listing_cache import ListingCache
+from file_cleanup import FileRemover
+from blob_store import BlobStore
+from archive_cache import ArchiveCache
+from storage_gc import StorageGC
+from file_serving import SERVE_MODES
+from chunked_upload import ChunkedUploads
+from metrics import Metrics
+from rollups import init_rollups
+
+job_manager = JobManager()
+listing_cache = ListingCache()
+file_remover = FileRemover()
+blob_store = BlobStore()
+archive_cache = ArchiveCache()
+storage_gc = StorageGC()
+chunked_uploads = ChunkedUploads()
+metrics = Metrics()
+
+def load_env():
+    """加载 .env 中的环境变量（覆盖已有的值）
+
+    设置 DOTENV_PATH 时改为加载该文件；设为空字符串时不加载（例如基准测试使用独立的配置）。
+    """
+    path = os.getenv('DOTENV_PATH')
+    if path is None:
+        load_dotenv(override=True)
+    elif path:
+        load_dotenv(path, override=True)
+
+def load_config(app):
+    """从环境变量读取应用配置"""
+    app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev-key-please-change-in-production')
+    app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URI', 'sqlite:///app.db')
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+    # 定时同步配置
+    app.config['SYNC_ENABLED'] = os.getenv('SYNC_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    app.config['SYNC_INTERVAL_MINUTES'] = int(os.getenv('SYNC_INTERVAL_MINUTES') or 60)
+    app.config['SYNC_JITTER_RATIO'] = float(os.getenv('SYNC_JITTER_RATIO') or 0.1)
+    app.config['SYNC_MAX_BACKOFF_MINUTES'] = int(os.getenv('SYNC_MAX_BACKOFF_MINUTES') or 24 * 60)
+    app.config['SYNC_WORKERS'] = int(os.getenv('SYNC_WORKERS') or 2)
+    app.config['SYNC_INITIAL_DAYS'] = int(os.getenv('SYNC_INITIAL_DAYS') or 30)
+    # 邮箱账号同步锁文件所在目录，定时同步、imap_idle.py 和 cli.py 需使用同一目录
+    app.config['SYNC_LOCK_DIR'] = os.getenv('SYNC_LOCK_DIR') or 'locks'
+    app.config['IDLE_MAX_CONNECTIONS'] = int(os.getenv('IDLE_MAX_CONNECTIONS') or 20)
+
+    # 监控目录导入（watch_folder.py）：目录=用户名，以逗号分隔
+    app.config['WATCH_DIRS'] = os.getenv('WATCH_DIRS') or ''
+    app.config['WATCH_MODE'] = (os.getenv('WATCH_MODE') or 'auto').lower()
+    app.config['WATCH_SETTLE_SECONDS'] = int(os.getenv('WATCH_SETTLE_SECONDS') or 5)
+    app.config['WATCH_POLL_SECONDS'] = int(os.getenv('WATCH_POLL_SECONDS') or 2)
+    app.config['WATCH_RESCAN_SECONDS'] = int(os.getenv('WATCH_RESCAN_SECONDS') or 60)
+    app.config['WATCH_QUEUE_SIZE'] = int(os.getenv('WATCH_QUEUE_SIZE') or 200)
+    app.config['WATCH_BATCH_SIZE'] = int(os.getenv('WATCH_BATCH_SIZE') or 50)
+    app.config['WATCH_BATCH_WAIT_SECONDS'] = int(os.getenv('WATCH_BATCH_WAIT_SECONDS') or 10)
+    app.config['WATCH_WORKERS'] = int(os.getenv('WATCH_WORKERS') or 1)
+
+    # 后台任务配置
+    app.config['JOB_WORKERS'] = int(os.getenv('JOB_WORKERS') or 4)
+    app.config['JOB_USER_MAX_CONCURRENT'] = int(os.getenv('JOB_USER_MAX_CONCURRENT') or 1)
+    # 只执行手动上传等交互任务的工作线程数；上传页面最多等待 UPLOAD_WAIT_SECONDS 秒，超时后转到进度页面
+    app.config['JOB_INTERACTIVE_WORKERS'] = int(os.getenv('JOB_INTERACTIVE_WORKERS') or 1)
+    app.config['UPLOAD_WAIT_SECONDS'] = int(os.getenv('UPLOAD_WAIT_SECONDS') or 30)
+    app.config['JOB_USER_MAX_LLM_CALLS'] = int(os.getenv('JOB_USER_MAX_LLM_CALLS') or 2)
+    app.config['JOB_BACKFILL_DAYS'] = int(os.getenv('JOB_BACKFILL_DAYS') or 90)
+    app.config['IMPORT_DB_CHUNK_SIZE'] = int(os.getenv('IMPORT_DB_CHUNK_SIZE') or 500)
+    app.config['MAINTENANCE_CHUNK_SIZE'] = int(os.getenv('MAINTENANCE_CHUNK_SIZE') or 1000)
+    # 批量上传时一次最多接收的PDF文件数（含ZIP压缩包中的文件）
+    app.config['UPLOAD_MAX_FILES'] = int(os.getenv('UPLOAD_MAX_FILES') or 500)
+    # 分块上传：每个分块的最大字节数、单个文件的最大字节数
+    app.config['UPLOAD_CHUNK_SIZE'] = int(os.getenv('UPLOAD_CHUNK_SIZE') or 8 * 1024 * 1024)
+    app.config['UPLOAD_MAX_BYTES'] = int(os.getenv('UPLOAD_MAX_BYTES') or 1024 * 1024 * 1024)
+    # 超过该时间没有新分块的未完成上传会被删除
+    app.config['UPLOAD_EXPIRE_HOURS'] = int(os.getenv('UPLOAD_EXPIRE_HOURS') or 72)
+
+    # 发票列表最多统计到的记录数，超过后显示“超过N条”；设为0时统计精确总数
+    app.config['INVOICE_COUNT_LIMIT'] = int(os.getenv('INVOICE_COUNT_LIMIT') or 10000)
+    app.config['LISTING_CACHE_SIZE'] = int(os.getenv('LISTING_CACHE_SIZE') or 512)
+    app.config['LISTING_CACHE_TTL'] = int(os.getenv('LISTING_CACHE_TTL') or 300)
+
+    # 发票PDF按内容寻址存放的目录
+    app.config['BLOB_STORE_DIR'] = os.getenv('BLOB_STORE_DIR') or 'store'
+    # 导入记录的ZIP在首次下载时生成并缓存，缓存总大小上限（MB，设为0时不缓存）
+    app.config['ARCHIVE_CACHE_DIR'] = os.getenv('ARCHIVE_CACHE_DIR') or 'archives'
+    app.config['ARCHIVE_CACHE_MAX_MB'] = int(os.getenv('ARCHIVE_CACHE_MAX_MB') or 512)
+
+    # 文件下载方式：direct 由应用发送；x-sendfile / x-accel 在权限检查后交给前端服务器发送
+    app.config['FILE_SERVE_MODE'] = (os.getenv('FILE_SERVE_MODE') or 'direct').lower()
+    if app.config['FILE_SERVE_MODE'] not in SERVE_MODES:
+        print(f"未知的 FILE_SERVE_MODE: {app.config['FILE_SERVE_MODE']}，改用 direct")
+        app.config['FILE_SERVE_MODE'] = 'direct'
+    # x-accel 时 nginx 中分别指向 BLOB_STORE_DIR 和 ARCHIVE_CACHE_DIR 的内部地址
+    app.config['FILE_SERVE_ACCEL_PREFIX'] = os.getenv('FILE_SERVE_ACCEL_PREFIX') or '/protected-files/'
+    app.config['FILE_SERVE_ACCEL_ARCHIVE_PREFIX'] = (os.getenv('FILE_SERVE_ACCEL_ARCHIVE_PREFIX')
+                                                     or '/protected-archives/')
+
+    # 孤儿文件清理：超过保留期且没有被引用的文件才会删除，每次最多检查 STORAGE_GC_BATCH 个文件
+    app.config['STORAGE_GC_ENABLED'] = os.getenv('STORAGE_GC_ENABLED', 'false').lower() in ('1', 'true', 'yes')
+    app.config['STORAGE_GC_DIRS'] = os.getenv('STORAGE_GC_DIRS') or 'downloads,uploads,store,static'
+    app.config['STORAGE_GC_GRACE_HOURS'] = int(os.getenv('STORAGE_GC_GRACE_HOURS') or 24)
+    app.config['STORAGE_GC_BATCH'] = int(os.getenv('STORAGE_GC_BATCH') or 2000)
+    app.config['STORAGE_GC_INTERVAL_MINUTES'] = int(os.getenv('STORAGE_GC_INTERVAL_MINUTES') or 60)
+
+    # 运行指标：/metrics 以 Prometheus 文本格式输出导入各阶段耗时和各路由的请求耗时，须设置令牌并带 Bearer 令牌访问
+    app.config['METRICS_ENABLED'] = os.getenv('METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+    app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN') or ''
+
+def create_app(config=None):
+    """创建并初始化应用；config 中的配置项覆盖从环境变量读取的值"""
+    # 加载环境变量
+    load_env()
+
+    app = Flask(__name__)
+    load_config(app)
+    if config:
+        app.config.update(config)
+
+    # 数据库引擎配置：SQLite 使用 WAL、忙等待超时等设置，连接池按多线程并发设置
+    load_engine_config(app.config, os.environ)
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config)
+
+    # 初始化数据库
+    db.init_app(app)
+    init_engine(app, db)
+    if os.environ.get('FLASK_RUN_FROM_CLI') == 'true':
+        from flask_migrate import Migrate
+        Migrate(app, db)
+
+    # 初始化后台任务调度与文件存储
+    job_manager.init_app(app)
+    listing_cache.init_app(app)
+    file_remover.init_app(app)
+    blob_store.init_app(app)
+    archive_cache.init_app(app)
+    storage_gc.init_app(app)
+    chunked_uploads.init_app(app)
+    metrics.init_app(app)
+    init_rollups(app)
+    return app
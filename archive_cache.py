@@ -0,0 +1,87 @@
+import hashlib
+import os
+import tempfile
+import threading
+
+class ArchiveCache:
+    """按需生成的导入记录ZIP的磁盘缓存
+
+    - 第一次下载时边生成边发送，同时写入缓存目录；再次下载同一内容时直接发送缓存文件
+    - 缓存键由压缩包内容（成员发票及其字段）计算，发票有修改时自然生成新的压缩包
+    - 缓存总大小超过 ARCHIVE_CACHE_MAX_MB 时按最近使用时间淘汰，命中时更新文件的修改时间
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ARCHIVE_CACHE_DIR', 'archives')
+        app.config.setdefault('ARCHIVE_CACHE_MAX_MB', 512)
+        app.extensions['archive_cache'] = self
+        self.app = app
+
+    @property
+    def directory(self):
+        return self.app.config['ARCHIVE_CACHE_DIR']
+
+    @property
+    def max_bytes(self):
+        return self.app.config['ARCHIVE_CACHE_MAX_MB'] * 1024 * 1024
+
+    @staticmethod
+    def make_key(*parts):
+        """由压缩包的内容描述计算缓存键"""
+        return hashlib.sha256(repr(parts).encode('utf-8')).hexdigest()
+
+    def path_for(self, key):
+        return os.path.join(self.directory, f'{key}.zip')
+
+    def get(self, key):
+        """返回缓存文件路径并标记为最近使用，未缓存时返回 None"""
+        if not self.max_bytes:
+            return None
+        path = self.path_for(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def stream_and_store(self, key, chunks):
+        """原样转发生成的数据，完整生成后保存到缓存；下载中断时丢弃临时文件"""
+        if not self.max_bytes:
+            yield from chunks
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(prefix='.tmp-', suffix='.zip', dir=self.directory)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in chunks:
+                    out.write(chunk)
+                    yield chunk
+            os.replace(temp_path, self.path_for(key))
+            self.evict()
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def evict(self):
+        """淘汰最久未使用的缓存文件，直到总大小不超过上限"""
+        with self._lock:
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and entry.name.endswith('.zip') and not entry.name.startswith('.'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
@@ -0,0 +1,10 @@
+"""离线基准测试
+
+不访问真实邮箱和大模型服务，测量发票导入各环节和发票列表查询的吞吐量与延迟：
+
+- synthetic：合成的电子发票PDF与发票邮件
+- fake_imap：预置 N 封发票邮件的本地IMAP服务器
+- llm_stub：可配置响应时间和失败率的本地 OpenAI 兼容接口
+- run：运行各场景并输出JSON结果（python -m benchmarks.run）
+- compare：比较两次运行的结果（python -m benchmarks.compare）
+"""
@@ -0,0 +1,62 @@
+"""比较两次基准测试的结果
+
+用法:
+    python -m benchmarks.compare base.json new.json [--threshold 10]
+
+按 (场景, 变体) 对齐两次结果，列出吞吐量和 p50/p95 延迟的变化；p95 延迟变慢超过 --threshold 百分比
+的项目标记为回退，存在回退时退出码为1，可以在CI中使用。
+"""
+
+import argparse
+import json
+import sys
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    return data['meta'], {(entry['scenario'], entry['variant']): entry for entry in data['results']}
+
+def change(old, new):
+    if not old or new is None:
+        return None
+    return (new - old) / old * 100
+
+def fmt_change(value):
+    return '      -' if value is None else f'{value:+7.1f}%'
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='比较两次基准测试的结果')
+    parser.add_argument('base', help='作为基准的结果文件')
+    parser.add_argument('new', help='新的结果文件')
+    parser.add_argument('--threshold', type=float, default=10, help='p95延迟变慢超过该百分比视为回退')
+    args = parser.parse_args(argv)
+
+    base_meta, base = load(args.base)
+    new_meta, new = load(args.new)
+    print(f"基准: {(base_meta.get('commit') or '?')[:10]}  {base_meta.get('started_at')}")
+    print(f"对比: {(new_meta.get('commit') or '?')[:10]}  {new_meta.get('started_at')}")
+    print(f"{'场景':<30} {'变体':<46} {'吞吐量':>8} {'p50':>8} {'p95':>8}")
+
+    regressions = []
+    for key in sorted(base.keys() & new.keys()):
+        old, cur = base[key], new[key]
+        throughput = change(old['throughput_per_second'], cur['throughput_per_second'])
+        p50 = change(old['latency_ms'].get('p50'), cur['latency_ms'].get('p50'))
+        p95 = change(old['latency_ms'].get('p95'), cur['latency_ms'].get('p95'))
+        regressed = p95 is not None and p95 > args.threshold
+        if regressed:
+            regressions.append(key)
+        print(f"{key[0]:<32} {key[1]:<48} {fmt_change(throughput)} {fmt_change(p50)} {fmt_change(p95)}"
+              f"{'  <- 回退' if regressed else ''}")
+
+    for key in sorted(base.keys() - new.keys()):
+        print(f"{key[0]:<32} {key[1]:<48} 只在基准结果中")
+    for key in sorted(new.keys() - base.keys()):
+        print(f"{key[0]:<32} {key[1]:<48} 只在新结果中")
+
+    if regressions:
+        print(f"{len(regressions)} 项 p95 延迟变慢超过 {args.threshold}%")
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
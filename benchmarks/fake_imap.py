@@ -0,0 +1,167 @@
+"""本地IMAP服务器
+
+只实现导入流程用到的命令：CAPABILITY、LOGIN、SELECT/EXAMINE、SEARCH、FETCH、UID SEARCH、UID FETCH、
+NOOP、LOGOUT。SEARCH 支持 SUBJECT、SINCE、UID 区间与 ALL 条件。任何用户名和密码都可以登录，
+所有连接共用同一个只读的收件箱。
+"""
+
+import re
+import socketserver
+import threading
+from datetime import datetime
+from email import message_from_bytes
+from email.header import decode_header, make_header
+from email.utils import parsedate_to_datetime
+
+from benchmarks.synthetic import invoice_email, invoice_fields, invoice_pdf
+
+UIDVALIDITY = 1
+
+class Mailbox:
+    """按UID排列的邮件，每封邮件记录主题和日期用于搜索"""
+
+    def __init__(self, raw_messages):
+        self.messages = []
+        for uid, raw in enumerate(raw_messages, 1):
+            message = message_from_bytes(raw)
+            subject = str(make_header(decode_header(message['Subject'] or '')))
+            self.messages.append({'uid': uid, 'raw': raw, 'subject': subject,
+                                  'date': parsedate_to_datetime(message['Date']).date()})
+
+    @classmethod
+    def seeded(cls, count, seed=0):
+        """包含 count 封发票邮件的收件箱"""
+        raw = []
+        for index in range(count):
+            fields = invoice_fields(index, seed)
+            raw.append(invoice_email(fields, invoice_pdf(fields)))
+        return cls(raw)
+
+    def search(self, criteria):
+        """按条件返回匹配邮件的 (序号, UID) 列表"""
+        matched = []
+        for number, message in enumerate(self.messages, 1):
+            if all(match(message) for match in criteria):
+                matched.append((number, message['uid']))
+        return matched
+
+def parse_search(text):
+    """把SEARCH条件解析为判断函数列表"""
+    criteria = []
+    tokens = re.findall(r'"[^"]*"|\S+', text.strip().strip('()'))
+    i = 0
+    while i < len(tokens):
+        key = tokens[i].upper()
+        if key == 'SUBJECT':
+            needle = tokens[i + 1].strip('"')
+            criteria.append(lambda message, needle=needle: needle in message['subject'])
+            i += 2
+        elif key == 'SINCE':
+            since = datetime.strptime(tokens[i + 1].strip('"'), '%d-%b-%Y').date()
+            criteria.append(lambda message, since=since: message['date'] >= since)
+            i += 2
+        elif key == 'UID':
+            low, _, high = tokens[i + 1].partition(':')
+            low = int(low)
+            high = None if high == '*' else int(high or low)
+            criteria.append(lambda message, low=low, high=high:
+                            message['uid'] >= low and (high is None or message['uid'] <= high))
+            i += 2
+        else:
+            # ALL、CHARSET UTF-8 等不影响结果的条件
+            i += 2 if key == 'CHARSET' else 1
+    return criteria
+
+def parse_sequence(text, limit):
+    """解析 1,3:5,7:* 形式的序号集合"""
+    numbers = set()
+    for part in text.split(','):
+        low, _, high = part.partition(':')
+        low = limit if low == '*' else int(low)
+        high = low if not high else (limit if high == '*' else int(high))
+        numbers.update(range(min(low, high), max(low, high) + 1))
+    return sorted(numbers)
+
+class ImapHandler(socketserver.StreamRequestHandler):
+    # 每条命令的响应攒齐后一次写出，避免小包等待延迟确认，测得的是客户端而不是本服务器的耗时
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def send(self, data):
+        self.wfile.write(data if isinstance(data, bytes) else data.encode('utf-8'))
+
+    def handle(self):
+        mailbox = self.server.mailbox
+        self.send('* OK [CAPABILITY IMAP4rev1 IDLE] fake IMAP ready\r\n')
+        while True:
+            self.wfile.flush()
+            line = self.rfile.readline()
+            if not line:
+                return
+            line = line.decode('utf-8', errors='replace').rstrip('\r\n')
+            tag, _, rest = line.partition(' ')
+            command, _, args = rest.partition(' ')
+            command = command.upper()
+            use_uid = command == 'UID'
+            if use_uid:
+                command, _, args = args.partition(' ')
+                command = command.upper()
+
+            if command == 'CAPABILITY':
+                self.send('* CAPABILITY IMAP4rev1 IDLE\r\n')
+            elif command == 'LOGIN':
+                pass
+            elif command in ('SELECT', 'EXAMINE'):
+                self.send(f'* {len(mailbox.messages)} EXISTS\r\n* 0 RECENT\r\n'
+                          f'* OK [UIDVALIDITY {UIDVALIDITY}] UIDs valid\r\n'
+                          f'* OK [UIDNEXT {len(mailbox.messages) + 1}] Predicted next UID\r\n')
+            elif command == 'SEARCH':
+                matched = mailbox.search(parse_search(args))
+                ids = [uid if use_uid else number for number, uid in matched]
+                self.send('* SEARCH' + ''.join(f' {i}' for i in ids) + '\r\n')
+            elif command == 'FETCH':
+                sequence, _, _ = args.partition(' ')
+                if use_uid:
+                    by_uid = {message['uid']: number for number, message in enumerate(mailbox.messages, 1)}
+                    numbers = [by_uid[uid] for uid in parse_sequence(sequence, len(mailbox.messages)) if uid in by_uid]
+                else:
+                    numbers = [n for n in parse_sequence(sequence, len(mailbox.messages)) if n <= len(mailbox.messages)]
+                for number in numbers:
+                    message = mailbox.messages[number - 1]
+                    self.send(f"* {number} FETCH (UID {message['uid']} RFC822 {{{len(message['raw'])}}}\r\n")
+                    self.send(message['raw'])
+                    self.send(')\r\n')
+            elif command == 'LOGOUT':
+                self.send('* BYE logging out\r\n')
+                self.send(f'{tag} OK LOGOUT completed\r\n')
+                self.wfile.flush()
+                return
+            elif command not in ('NOOP', 'CLOSE'):
+                self.send(f'{tag} BAD unsupported command\r\n')
+                continue
+            self.send(f'{tag} OK {command} completed\r\n')
+
+class FakeImapServer(socketserver.ThreadingTCPServer):
+    """在本机随机端口上运行的IMAP服务器，用法：
+
+        with FakeImapServer(Mailbox.seeded(200)) as server:
+            imaplib.IMAP4('127.0.0.1', server.port)
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, mailbox, host='127.0.0.1', port=0):
+        super().__init__((host, port), ImapHandler)
+        self.mailbox = mailbox
+        self.port = self.server_address[1]
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='fake-imap', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
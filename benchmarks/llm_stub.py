@@ -0,0 +1,114 @@
+"""本地 OpenAI 兼容接口
+
+POST /v1/chat/completions 从提示词中的发票文本解析出字段，按 OpenAI 的响应格式返回JSON，
+并模拟大模型的响应时间和失败率：
+
+- latency_ms / jitter_ms：每次请求的延迟为 latency_ms ± jitter_ms（均匀分布）
+- error_rate：按此概率返回 HTTP 500
+- usage 中的 token 数按字符数估算，便于统计调用成本
+"""
+
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FIELD_PATTERNS = {
+    'invoice_no': r'发票号码[：:]\s*(\d+)',
+    'invoice_date': r'开票日期[：:]\s*(\d{4})年(\d{1,2})月(\d{1,2})日',
+    'seller': r'销售方信息\s*名称[：:]\s*(\S+)',
+    'amount': r'（小写）\s*¥?\s*([\d.]+)',
+    'project_name': r'(\*[^*\s]+\*\S+)',
+}
+
+def extract_fields(text):
+    """从发票文本中解析字段，缺失的字段返回空字符串"""
+    fields = {}
+    for name, pattern in FIELD_PATTERNS.items():
+        match = re.search(pattern, text)
+        if not match:
+            fields[name] = ''
+        elif name == 'invoice_date':
+            year, month, day = match.groups()
+            fields[name] = f"{year}-{int(month):02d}-{int(day):02d}"
+        else:
+            fields[name] = match.group(1)
+    return fields
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, format, *args):
+        pass
+
+    def reply(self, status, body):
+        data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        stub = self.server
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        prompt = ''.join(message.get('content', '') for message in body.get('messages', []))
+        with stub.lock:
+            stub.requests += 1
+            delay = max(0.0, stub.latency_ms + stub.rng.uniform(-stub.jitter_ms, stub.jitter_ms)) / 1000
+            failed = stub.rng.random() < stub.error_rate
+        time.sleep(delay)
+
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self.reply(404, {'error': {'message': 'not found'}})
+            return
+        if failed:
+            with stub.lock:
+                stub.errors += 1
+            self.reply(500, {'error': {'message': 'simulated upstream error', 'type': 'server_error'}})
+            return
+
+        content = json.dumps(extract_fields(prompt), ensure_ascii=False)
+        prompt_tokens = len(prompt) // 2
+        completion_tokens = len(content) // 2
+        self.reply(200, {
+            'id': f'chatcmpl-stub-{stub.requests}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': body.get('model', 'stub'),
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': content}}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': completion_tokens,
+                      'total_tokens': prompt_tokens + completion_tokens},
+        })
+
+class LLMStub(ThreadingHTTPServer):
+    """在本机随机端口上运行的大模型接口，用法：
+
+        with LLMStub(latency_ms=300, error_rate=0.01) as stub:
+            os.environ['OPENAI_API_BASE'] = stub.url
+    """
+
+    daemon_threads = True
+
+    def __init__(self, latency_ms=0, jitter_ms=0, error_rate=0.0, seed=0, host='127.0.0.1', port=0):
+        super().__init__((host, port), StubHandler)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.url = f'http://{host}:{self.server_address[1]}'
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self.serve_forever, name='llm-stub', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,331 @@
+"""离线基准测试
+
+在临时目录中启动本地IMAP服务器和大模型接口，用合成发票跑完整的导入流程和发票列表查询，
+把吞吐量和延迟分位数写成JSON，便于在不同版本之间比较（见 benchmarks/compare.py）。
+
+用法:
+    python -m benchmarks.run [--scenarios extract,download,process,invoices] [--messages 200]
+                             [--rows 10000,100000] [--llm-latency-ms 300] [--llm-error-rate 0.01]
+                             [--workers 8] [--output results.json]
+
+应用的日志默认丢弃，加 --verbose 输出到标准错误。
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack, redirect_stdout
+from datetime import datetime
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+from benchmarks.fake_imap import FakeImapServer, Mailbox
+from benchmarks.llm_stub import LLMStub
+from benchmarks.synthetic import invoice_fields, invoice_filename, invoice_pdf
+
+SCENARIOS = ('extract', 'download', 'process', 'invoices')
+
+# /invoices 的查询组合：(名称, 查询参数)
+INVOICE_QUERIES = [
+    ('first_page', {}),
+    ('keyword', {'q': '餐饮'}),
+    ('seller', {'seller': '滴滴出行'}),
+    ('date_range', {'date_from': '2024-03-01', 'date_to': '2024-05-31'}),
+    ('sort_amount_desc', {'sort_by': 'amount', 'sort_order': 'desc'}),
+    ('per_page_100', {'per_page': 100}),
+]
+
+def percentiles(samples):
+    """延迟分位数（毫秒），samples 为秒"""
+    if not samples:
+        return {}
+    ordered = sorted(samples)
+
+    def rank(p):
+        return ordered[min(len(ordered) - 1, max(0, round(p / 100 * len(ordered) + 0.5) - 1))] * 1000
+
+    return {'p50': round(rank(50), 3), 'p90': round(rank(90), 3), 'p95': round(rank(95), 3),
+            'p99': round(rank(99), 3), 'max': round(ordered[-1] * 1000, 3),
+            'mean': round(statistics.fmean(ordered) * 1000, 3)}
+
+def result(scenario, variant, count, elapsed, samples, **extra):
+    entry = {'scenario': scenario, 'variant': variant, 'count': count,
+             'elapsed_seconds': round(elapsed, 4),
+             'throughput_per_second': round(count / elapsed, 3) if elapsed else None,
+             'latency_ms': percentiles(samples)}
+    entry.update(extra)
+    return entry
+
+def git_revision():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=REPO_DIR,
+                                    capture_output=True, text=True).stdout.strip())
+        return {'commit': commit, 'dirty': dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {'commit': None, 'dirty': None}
+
+def write_pdfs(directory, count, seed):
+    """生成 count 张合成发票PDF，返回 [(路径, 字段)]"""
+    os.makedirs(directory, exist_ok=True)
+    files = []
+    for index in range(count):
+        fields = invoice_fields(index, seed)
+        path = os.path.join(directory, invoice_filename(fields))
+        with open(path, 'wb') as f:
+            f.write(invoice_pdf(fields))
+        files.append((path, fields))
+    return files
+
+def bench_extract(args, workdir):
+    """extract_invoice_info：PDF解析加一次大模型调用，按 --workers 并发"""
+    from app import extract_invoice_info
+
+    files = write_pdfs(os.path.join(workdir, 'pdfs'), args.messages, args.seed)
+
+    def timed(item):
+        path, fields = item
+        started = time.perf_counter()
+        info = extract_invoice_info(path)
+        elapsed = time.perf_counter() - started
+        correct = bool(info) and info.get('invoice_no') == fields['invoice_no'] \
+            and info.get('amount') == str(fields['total'])
+        return elapsed, info is not None, correct
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        outcomes = list(executor.map(timed, files))
+    elapsed = time.perf_counter() - started
+    return [result('extract_invoice_info', f'workers={args.workers}', len(files), elapsed,
+                   [sample for sample, _, _ in outcomes],
+                   errors=sum(1 for _, ok, _ in outcomes if not ok),
+                   mismatches=sum(1 for _, ok, correct in outcomes if ok and not correct))]
+
+def bench_download(args, workdir):
+    """download_invoice_attachments（按序号全量下载）与 download_attachments_by_uid（按UID逐封下载）"""
+    from app import connect_to_email
+    from email_invoice_downloader import (download_attachments_by_uid, download_invoice_attachments,
+                                          search_invoice_uids)
+
+    results = []
+    samples = []
+    files = 0
+    for i in range(args.repeat):
+        imap = connect_to_email('bench@example.com', 'bench')
+        try:
+            started = time.perf_counter()
+            files = download_invoice_attachments(imap, download_dir=os.path.join(workdir, 'download', str(i)))
+            samples.append(time.perf_counter() - started)
+        finally:
+            imap.logout()
+    results.append(result('download_invoice_attachments', 'full', args.messages * args.repeat, sum(samples), samples,
+                          files=files, runs=args.repeat))
+
+    imap = connect_to_email('bench@example.com', 'bench')
+    try:
+        imap.select('INBOX')
+        started = time.perf_counter()
+        uids = search_invoice_uids(imap)
+        search_elapsed = time.perf_counter() - started
+        samples = []
+        directory = os.path.join(workdir, 'download', 'by_uid')
+        for uid in uids:
+            started = time.perf_counter()
+            download_attachments_by_uid(imap, [uid], directory)
+            samples.append(time.perf_counter() - started)
+    finally:
+        imap.logout()
+    results.append(result('download_attachments_by_uid', 'per_message', len(uids), sum(samples), samples,
+                          search_ms=round(search_elapsed * 1000, 3)))
+    return results
+
+def bench_process(args, workdir):
+    """完整的 process_invoices_thread：首次导入全部为新发票，再次导入全部为重复发票"""
+    from app import app, db, job_manager, process_invoices_thread
+    from models import Invoice, User
+
+    with app.app_context():
+        user = User(username='bench_process', email='bench_process@example.com')
+        user.set_password('bench')
+        db.session.add(user)
+        db.session.commit()
+        user_id = user.id
+
+    results = []
+    for variant in ('cold', 'duplicates'):
+        started = time.perf_counter()
+        job = job_manager.submit(user_id, 'import', process_invoices_thread,
+                                 args=('bench@example.com', 'bench', None, user_id))
+        job.wait()
+        elapsed = time.perf_counter() - started
+        with app.app_context():
+            saved = Invoice.query.filter_by(user_id=user_id).count()
+        results.append(result('process_invoices_thread', variant, args.messages, elapsed, [elapsed],
+                              status=job.status['status'], error=job.status.get('error'), invoices=saved))
+    return results
+
+def seed_invoices(user_id, rows, seed):
+    """批量写入 rows 张发票并重建汇总表"""
+    from sqlalchemy import insert
+
+    from app import db, invoice_record
+    from models import Invoice
+    from rollups import rebuild_rollups
+
+    chunk = 5000
+    for start in range(0, rows, chunk):
+        records = []
+        for index in range(start, min(rows, start + chunk)):
+            fields = invoice_fields(index, seed)
+            info = {'invoice_no': fields['invoice_no'], 'invoice_date': fields['invoice_date'],
+                    'seller': fields['seller'], 'amount': str(fields['total']),
+                    'project_name': fields['project_name'], 'filename': invoice_filename(fields)}
+            records.append(invoice_record(info, None, user_id))
+        db.session.execute(insert(Invoice), records)
+        db.session.commit()
+    rebuild_rollups(user_id)
+
+def bench_invoices(args, workdir):
+    """/invoices 列表页：每种查询分别测量不使用缓存和命中缓存的延迟，以及每次请求的SQL数"""
+    from sqlalchemy import event
+
+    from app import app, db, listing_cache
+    from models import User
+
+    app.config['WTF_CSRF_ENABLED'] = False
+    statements = [0]
+
+    def count_statement(*_):
+        statements[0] += 1
+
+    results = []
+    for rows in args.rows:
+        username = f'bench_rows_{rows}'
+        with app.app_context():
+            user = User(username=username, email=f'{username}@example.com')
+            user.set_password('bench')
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.id
+            started = time.perf_counter()
+            seed_invoices(user_id, rows, args.seed)
+            seed_seconds = time.perf_counter() - started
+            event.listen(db.engine, 'before_cursor_execute', count_statement)
+
+        client = app.test_client()
+        client.post('/login', data={'username': username, 'password': 'bench'})
+        try:
+            for name, params in INVOICE_QUERIES:
+                for cached in (False, True):
+                    samples = []
+                    queries = []
+                    errors = 0
+                    if cached:
+                        client.get('/invoices', query_string=params)
+                    for _ in range(args.requests):
+                        if not cached:
+                            listing_cache.invalidate(user_id)
+                        statements[0] = 0
+                        started = time.perf_counter()
+                        response = client.get('/invoices', query_string=params)
+                        samples.append(time.perf_counter() - started)
+                        queries.append(statements[0])
+                        errors += response.status_code != 200
+                    results.append(result('invoices', f"rows={rows},query={name},cache={'hit' if cached else 'off'}",
+                                          len(samples), sum(samples), samples, errors=errors,
+                                          queries_per_request=round(statistics.fmean(queries), 2),
+                                          seed_seconds=round(seed_seconds, 2)))
+        finally:
+            with app.app_context():
+                event.remove(db.engine, 'before_cursor_execute', count_statement)
+    return results
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='发票导入与查询的离线基准测试')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"逗号分隔的场景，可选 {', '.join(SCENARIOS)}")
+    parser.add_argument('--messages', type=int, default=200, help='邮箱中的发票邮件数，也是提取场景的PDF数')
+    parser.add_argument('--rows', default='10000,100000', help='/invoices 场景的发票行数，逗号分隔')
+    parser.add_argument('--requests', type=int, default=20, help='/invoices 每种查询的请求次数')
+    parser.add_argument('--repeat', type=int, default=3, help='全量下载的重复次数')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 4, help='同时进行的大模型调用数')
+    parser.add_argument('--llm-latency-ms', type=float, default=300, help='大模型接口的平均响应时间')
+    parser.add_argument('--llm-jitter-ms', type=float, default=100, help='响应时间的随机波动范围')
+    parser.add_argument('--llm-error-rate', type=float, default=0.0, help='大模型接口返回错误的概率')
+    parser.add_argument('--seed', type=int, default=0, help='合成数据的随机种子')
+    parser.add_argument('--output', help='结果JSON文件，默认为 benchmarks/results/<时间>.json')
+    parser.add_argument('--keep', action='store_true', help='保留临时目录')
+    parser.add_argument('--verbose', action='store_true', help='把应用日志输出到标准错误')
+    args = parser.parse_args(argv)
+    args.scenarios = [s.strip() for s in args.scenarios.split(',') if s.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"未知场景: {', '.join(sorted(unknown))}")
+    args.rows = [int(r) for r in args.rows.split(',') if r.strip()]
+    args.workers = max(1, args.workers)
+    return args
+
+def main(argv=None):
+    args = parse_args(argv)
+    output = os.path.abspath(args.output or os.path.join(
+        REPO_DIR, 'benchmarks', 'results', f"{datetime.now().strftime('%Y%m%d%H%M%S')}.json"))
+    workdir = tempfile.mkdtemp(prefix='invoice_bench_')
+    meta = {'started_at': datetime.now().isoformat(timespec='seconds'), **git_revision(),
+            'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+            'params': {key: value for key, value in vars(args).items() if key not in ('output', 'keep', 'verbose')},
+            'workdir': workdir}
+
+    print(f"生成 {args.messages} 封发票邮件...", file=sys.stderr)
+    mailbox = Mailbox.seeded(args.messages, args.seed)
+    results = []
+    with ExitStack() as stack:
+        imap_server = stack.enter_context(FakeImapServer(mailbox))
+        stub = stack.enter_context(LLMStub(args.llm_latency_ms, args.llm_jitter_ms, args.llm_error_rate, args.seed))
+
+        # 应用在导入时读取配置，必须先设置好环境变量；相对路径（下载目录、内容存储等）都落在临时目录中
+        os.environ.update({
+            'DOTENV_PATH': '', 'DATABASE_URI': f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+            'OPENAI_API_BASE': stub.url, 'OPENAI_API_KEY': 'bench', 'OPENAI_MODEL': 'bench-stub',
+            'IMAP_HOST': '127.0.0.1', 'IMAP_PORT': str(imap_server.port), 'IMAP_SSL': 'false',
+            'JOB_USER_MAX_LLM_CALLS': str(args.workers), 'SYNC_ENABLED': 'false', 'STORAGE_GC_ENABLED': 'false',
+        })
+        os.chdir(workdir)
+        log = sys.stderr if args.verbose else stack.enter_context(open(os.devnull, 'w'))
+        with redirect_stdout(log):
+            from app import create_tables, file_remover
+            create_tables()
+            for scenario in args.scenarios:
+                print(f"运行场景 {scenario}...", file=sys.stderr)
+                results.extend(globals()[f'bench_{scenario}'](args, workdir))
+            file_remover.join()
+        meta['llm_requests'] = stub.requests
+        meta['llm_errors'] = stub.errors
+
+    meta['finished_at'] = datetime.now().isoformat(timespec='seconds')
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump({'meta': meta, 'results': results}, f, ensure_ascii=False, indent=2)
+
+    for entry in results:
+        latency = entry['latency_ms']
+        print(f"{entry['scenario']:<32} {entry['variant']:<48} n={entry['count']:<6} "
+              f"{entry['throughput_per_second'] or 0:>9.2f}/s  p50={latency.get('p50', 0):>9.2f}ms  "
+              f"p95={latency.get('p95', 0):>9.2f}ms")
+    print(f"结果已写入 {output}")
+    if not args.keep:
+        import shutil
+        os.chdir(REPO_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+"""合成发票PDF与发票邮件
+
+生成的PDF使用PDF阅读器内置的 STSong-Light 中文字体（UniGB-UCS2-H 编码），不依赖任何字体文件或PDF库，
+版式仿照电子发票（普通发票）：发票号码、开票日期、购买方/销售方信息、明细表格、价税合计和备注。
+同一个 seed 生成的内容完全相同，便于在不同版本之间比较。
+"""
+
+import random
+import zlib
+from datetime import date, datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
+from email.header import Header
+from email.mime.application import MIMEApplication
+from email.mime.multipart import MIMEMultipart
+from email.mime.text import MIMEText
+from email.utils import format_datetime
+
+SELLERS = [
+    '上海汇鑫餐饮管理有限公司', '北京京东世纪信息技术有限公司', '杭州滴滴出行科技有限公司',
+    '深圳市腾讯计算机系统有限公司', '中国石化销售股份有限公司广东石油分公司', '广州如家酒店管理有限公司',
+    '中国东方航空股份有限公司', '南京苏宁易购电子商务有限公司', '成都星巴克咖啡有限公司',
+    '武汉顺丰速运有限公司', '中国移动通信集团江苏有限公司', '西安华润万家生活超市有限公司',
+]
+BUYERS = ['上海某某科技有限公司', '北京某某咨询有限公司', '个人']
+ITEMS = [
+    ('*餐饮服务*餐费', '次', Decimal('0.06')), ('*运输服务*客运服务费', '次', Decimal('0.03')),
+    ('*住宿服务*住宿费', '晚', Decimal('0.06')), ('*信息技术服务*云服务器', '月', Decimal('0.06')),
+    ('*汽油*92号车用汽油(VIB)', '升', Decimal('0.13')), ('*计算机外部设备*无线鼠标', '个', Decimal('0.13')),
+    ('*物流辅助服务*收派服务费', '件', Decimal('0.06')), ('*电信服务*通信费', '月', Decimal('0.09')),
+]
+DIGITS = '零壹贰叁肆伍陆柒捌玖'
+
+def amount_in_words(amount):
+    """金额的中文大写，例如 123.45 -> 壹佰贰拾叁圆肆角伍分"""
+    cents = int((amount * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+    yuan, jiao, fen = cents // 100, cents // 10 % 10, cents % 10
+    units = ['', '拾', '佰', '仟']
+    sections = ['', '万', '亿']
+    words = ''
+    section = 0
+    while yuan:
+        part, yuan = yuan % 10000, yuan // 10000
+        text = ''
+        zero = False
+        for i in range(4):
+            digit = part // 10 ** (3 - i) % 10
+            if digit:
+                if zero:
+                    text += '零'
+                text += DIGITS[digit] + units[3 - i]
+                zero = False
+            elif text:
+                zero = True
+        if text:
+            words = text + sections[section] + words
+        elif words and not words.startswith('零'):
+            words = '零' + words
+        section += 1
+    words = (words or '零') + '圆'
+    if not jiao and not fen:
+        return words + '整'
+    if jiao:
+        words += DIGITS[jiao] + '角'
+    elif fen:
+        words += '零'
+    if fen:
+        words += DIGITS[fen] + '分'
+    return words
+
+def invoice_fields(index, seed=0, start=date(2024, 1, 1)):
+    """第 index 张合成发票的字段"""
+    rng = random.Random(seed * 1000003 + index)
+    name, unit, rate = rng.choice(ITEMS)
+    quantity = rng.randint(1, 5)
+    price = Decimal(rng.randint(500, 200000)) / 100
+    amount = (price * quantity).quantize(Decimal('0.01'))
+    tax = (amount * rate).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    return {
+        'invoice_no': f"24{rng.randint(10, 99)}{seed % 100:02d}{index:014d}",  # 数电发票号码为20位
+        'invoice_date': (start + timedelta(days=rng.randint(0, 364))).isoformat(),
+        'seller': rng.choice(SELLERS),
+        'seller_tax_id': ''.join(rng.choice('0123456789ABCDEFGHJKLMNPQRTUWXY') for _ in range(18)),
+        'buyer': rng.choice(BUYERS),
+        'project_name': name,
+        'unit': unit,
+        'quantity': quantity,
+        'price': price,
+        'amount': amount,
+        'tax_rate': rate,
+        'tax': tax,
+        'total': amount + tax,
+    }
+
+def _text(x, y, size, text):
+    return f"BT /F1 {size} Tf {x} {y} Td <{text.encode('utf-16-be').hex().upper()}> Tj ET"
+
+def invoice_pdf(fields):
+    """按发票字段生成单页PDF，返回字节串"""
+    year, month, day = fields['invoice_date'].split('-')
+    ops = [
+        '0.6 0.3 0.1 RG 0.8 w 20 40 555 300 re S',
+        '20 290 m 575 290 l S 20 150 m 575 150 l S 20 110 m 575 110 l S 300 290 m 300 340 l S',
+        _text(210, 385, 18, '电子发票（普通发票）'),
+        _text(420, 365, 9, f"发票号码：{fields['invoice_no']}"),
+        _text(420, 350, 9, f"开票日期：{year}年{month}月{day}日"),
+        _text(28, 325, 9, f"购买方信息  名称：{fields['buyer']}"),
+        _text(28, 305, 9, '统一社会信用代码/纳税人识别号：'),
+        _text(308, 325, 9, f"销售方信息  名称：{fields['seller']}"),
+        _text(308, 305, 9, f"统一社会信用代码/纳税人识别号：{fields['seller_tax_id']}"),
+        _text(28, 275, 9, '项目名称            规格型号  单位  数量  单价        金额        税率/征收率  税额'),
+        _text(28, 255, 9, f"{fields['project_name']}          {fields['unit']}    {fields['quantity']}     "
+                          f"{fields['price']}    {fields['amount']}    {int(fields['tax_rate'] * 100)}%    {fields['tax']}"),
+        _text(28, 160, 9, f"合计                                                      ¥{fields['amount']}                ¥{fields['tax']}"),
+        _text(28, 130, 9, f"价税合计（大写）  {amount_in_words(fields['total'])}        （小写）¥{fields['total']}"),
+        _text(28, 90, 9, '备注：'),
+        _text(28, 25, 9, '开票人：系统'),
+    ]
+    content = zlib.compress('\n'.join(ops).encode('ascii'))
+    objects = [
+        b'<< /Type /Catalog /Pages 2 0 R >>',
+        b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+        b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 420] /Resources << /Font << /F1 5 0 R >> >> /Contents 4 0 R >>',
+        b'<< /Length %d /Filter /FlateDecode >>\nstream\n' % len(content) + content + b'\nendstream',
+        b'<< /Type /Font /Subtype /Type0 /BaseFont /STSong-Light /Encoding /UniGB-UCS2-H /DescendantFonts [6 0 R] >>',
+        b'<< /Type /Font /Subtype /CIDFontType0 /BaseFont /STSong-Light '
+        b'/CIDSystemInfo << /Registry (Adobe) /Ordering (GB1) /Supplement 2 >> /FontDescriptor 7 0 R /DW 1000 >>',
+        b'<< /Type /FontDescriptor /FontName /STSong-Light /Flags 6 /FontBBox [-25 -254 1000 880] '
+        b'/ItalicAngle 0 /Ascent 880 /Descent -120 /CapHeight 880 /StemV 93 >>',
+    ]
+    out = bytearray(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b'%d 0 obj\n' % number + body + b'\nendobj\n'
+    xref = len(out)
+    out += b'xref\n0 %d\n0000000000 65535 f \n' % (len(objects) + 1)
+    out += b''.join(b'%010d 00000 n \n' % offset for offset in offsets)
+    out += b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (len(objects) + 1, xref)
+    return bytes(out)
+
+def invoice_filename(fields):
+    return f"dzfp_{fields['invoice_no']}_{fields['seller'][:6]}.pdf"
+
+def invoice_email(fields, pdf_bytes, sent_at=None):
+    """带发票PDF附件的邮件，返回RFC822字节串"""
+    sent_at = sent_at or datetime.strptime(fields['invoice_date'], '%Y-%m-%d').replace(hour=10)
+    message = MIMEMultipart()
+    message['Subject'] = Header(f"您收到一张【{fields['seller']}】开具的发票【发票号码：{fields['invoice_no']}】", 'utf-8')
+    message['From'] = 'invoice@example.com'
+    message['To'] = 'bench@example.com'
+    message['Date'] = format_datetime(sent_at.astimezone())
+    message.attach(MIMEText(f"尊敬的客户：\n  {fields['seller']}为您开具了电子发票，金额 ¥{fields['total']}。", 'plain', 'utf-8'))
+    attachment = MIMEApplication(pdf_bytes, 'pdf')
+    attachment.add_header('Content-Disposition', 'attachment', filename=('utf-8', '', invoice_filename(fields)))
+    message.attach(attachment)
+    return message.as_bytes()
@@ -0,0 +1,114 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+CHUNK_SIZE = 1024 * 1024
+
+class BlobStore:
+    """按内容寻址的发票文件存储
+
+    - 文件按 SHA-256 存放在 `<BLOB_STORE_DIR>/ab/cd/<sha256>.pdf`，内容相同的文件只保存一份
+    - 先写入同目录下的临时文件再重命名，读到的文件要么不存在、要么完整
+    - 发票的 file_path 指向存储中的文件，content_hash 记录内容摘要；下载时的文件名由发票信息生成
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('BLOB_STORE_DIR', 'store')
+        app.extensions['blob_store'] = self
+        self.app = app
+
+    @property
+    def root(self):
+        return self.app.config['BLOB_STORE_DIR']
+
+    def path_for(self, digest):
+        """内容摘要对应的存储路径"""
+        return os.path.join(self.root, digest[:2], digest[2:4], f'{digest}.pdf')
+
+    def is_blob_path(self, path):
+        """路径是否位于内容存储中"""
+        if not path:
+            return False
+        root = os.path.abspath(self.root)
+        return os.path.abspath(path).startswith(root + os.sep)
+
+    def digest_of(self, path):
+        """存储中的文件返回其内容摘要，其他文件返回 None"""
+        if not self.is_blob_path(path):
+            return None
+        name = os.path.basename(path)
+        return name[:-len('.pdf')] if name.endswith('.pdf') else None
+
+    @staticmethod
+    def hash_file(path):
+        """计算文件的 SHA-256"""
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def put_file(self, source, digest=None, move=False):
+        """把文件存入存储，返回 (摘要, 存储路径)
+
+        move 为 True 时源文件在存入后删除（同一文件系统上直接重命名，不复制）。
+        内容已存在时不再写入。
+        """
+        digest = digest or self.hash_file(source)
+        path = self.path_for(digest)
+        if os.path.exists(path):
+            # 更新修改时间，孤儿文件清理在保留期内不会删除刚被复用的文件
+            os.utime(path)
+            if move:
+                os.remove(source)
+            return digest, path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if move:
+            try:
+                os.replace(source, path)
+                return digest, path
+            except OSError:
+                # 跨文件系统时无法重命名，改为复制后删除
+                pass
+        with open(source, 'rb') as f:
+            self._write_atomic(path, f)
+        if move:
+            os.remove(source)
+        return digest, path
+
+    def put_stream(self, stream):
+        """把上传的文件流存入存储，边写边计算摘要，返回 (摘要, 存储路径)"""
+        os.makedirs(self.root, exist_ok=True)
+        digest = hashlib.sha256()
+        fd, temp_path = tempfile.mkstemp(prefix='.upload-', dir=self.root)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    out.write(chunk)
+                out.flush()
+                os.fsync(out.fileno())
+            return self.put_file(temp_path, digest.hexdigest(), move=True)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _write_atomic(self, path, stream):
+        directory = os.path.dirname(path)
+        fd, temp_path = tempfile.mkstemp(prefix='.tmp-', dir=directory)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                shutil.copyfileobj(stream, out, CHUNK_SIZE)
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(temp_path, path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
@@ -0,0 +1,220 @@
+"""可续传的分块上传
+
+协议（均为JSON接口，需登录）：
+1. POST /uploads                    {"filename", "size", "sha256"(可选)} -> {"upload_id", "offset", "chunk_size"}
+2. PUT  /uploads/<id>?offset=N      请求体为分块的原始字节，X-Chunk-SHA256 头为该分块的SHA-256（可选）-> {"offset"}
+3. GET  /uploads/<id>               查询已接收的字节数，断线重连后从该位置继续上传
+4. POST /uploads/<id>/complete      校验大小（及整个文件的SHA-256）后把文件存入内容存储
+5. POST /uploads/import             {"upload_ids": [...]} 把已完成的上传作为一个任务导入 -> {"job_id"}
+
+超过 UPLOAD_EXPIRE_HOURS 没有新分块的上传在创建新上传时删除；暂存目录不在孤儿文件清理的范围内。
+
+每个分块先读入内存（不超过 UPLOAD_CHUNK_SIZE），长度和校验和通过后才写入暂存文件的对应位置
+（os.pwrite），内存占用与文件大小无关；上传状态保存在暂存目录的JSON文件中，应用重启后仍可续传。
+只有校验通过的分块才会推进 offset，重试时只需重新上传缺失的部分；重传已接收的部分时内容必须与
+已接收的数据一致，不会覆盖已接收的数据。
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+CHUNK_READ_SIZE = 64 * 1024
+
+class UploadError(Exception):
+    """上传请求无效，status 为对应的HTTP状态码"""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+class ChunkedUploads:
+    """分块上传的暂存与状态管理"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('UPLOAD_STAGING_DIR', os.path.join('uploads', 'staging'))
+        app.config.setdefault('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024)
+        app.config.setdefault('UPLOAD_MAX_BYTES', 1024 * 1024 * 1024)
+        app.config.setdefault('UPLOAD_EXPIRE_HOURS', 72)
+        app.extensions['chunked_uploads'] = self
+        self.app = app
+
+    @property
+    def directory(self):
+        return self.app.config['UPLOAD_STAGING_DIR']
+
+    def _lock(self, upload_id):
+        with self._locks_guard:
+            return self._locks.setdefault(upload_id, threading.Lock())
+
+    def _state_path(self, upload_id):
+        return os.path.join(self.directory, f'{upload_id}.json')
+
+    def data_path(self, upload_id):
+        return os.path.join(self.directory, f'{upload_id}.part')
+
+    def _save(self, state):
+        temp_path = self._state_path(state['upload_id']) + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(temp_path, self._state_path(state['upload_id']))
+
+    def create(self, user_id, filename, size, sha256=None):
+        """创建上传，返回上传状态"""
+        filename = os.path.basename(filename or '')
+        if not filename.lower().endswith(('.pdf', '.zip')):
+            raise UploadError('只支持上传PDF或ZIP文件')
+        if not isinstance(size, int) or size <= 0:
+            raise UploadError('文件大小无效')
+        if size > self.app.config['UPLOAD_MAX_BYTES']:
+            raise UploadError('文件过大', status=413)
+        os.makedirs(self.directory, exist_ok=True)
+        self.purge_expired()
+        state = {
+            'upload_id': uuid.uuid4().hex,
+            'user_id': user_id,
+            'filename': filename,
+            'size': size,
+            'sha256': (sha256 or '').lower() or None,
+            'offset': 0,
+            'complete': False,
+            'files': [],
+            'created_at': time.time(),
+        }
+        open(self.data_path(state['upload_id']), 'wb').close()
+        self._save(state)
+        return state
+
+    def purge_expired(self):
+        """删除超过 UPLOAD_EXPIRE_HOURS 没有更新的上传（状态文件在每个分块后更新）"""
+        cutoff = time.time() - self.app.config['UPLOAD_EXPIRE_HOURS'] * 3600
+        try:
+            entries = list(os.scandir(self.directory))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            upload_id, ext = os.path.splitext(entry.name)
+            if ext != '.json':
+                continue
+            try:
+                if entry.stat().st_mtime > cutoff:
+                    continue
+            except FileNotFoundError:
+                continue
+            with self._lock(upload_id):
+                for path in (self._state_path(upload_id), self.data_path(upload_id)):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+            with self._locks_guard:
+                self._locks.pop(upload_id, None)
+
+    def get(self, upload_id, user_id):
+        """读取上传状态，不存在或不属于该用户时抛出 UploadError"""
+        if not upload_id.isalnum():
+            raise UploadError('上传不存在', status=404)
+        try:
+            with open(self._state_path(upload_id), encoding='utf-8') as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            raise UploadError('上传不存在或已过期', status=404)
+        if state['user_id'] != user_id:
+            raise UploadError('上传不存在', status=404)
+        return state
+
+    def write_chunk(self, upload_id, user_id, offset, stream, length, checksum=None):
+        """校验请求流中的分块后写入暂存文件的 offset 处，返回新的 offset"""
+        with self._lock(upload_id):
+            state = self.get(upload_id, user_id)
+            if state['complete']:
+                raise UploadError('上传已完成', status=409)
+            if offset is None or offset < 0 or offset > state['offset']:
+                # 不允许跳过尚未接收的部分，客户端应先查询 offset
+                raise UploadError(f"分块位置无效，应从 {state['offset']} 继续", status=409)
+            if length is None or length <= 0 or length > self.app.config['UPLOAD_CHUNK_SIZE']:
+                raise UploadError('分块大小无效')
+            if offset + length > state['size']:
+                raise UploadError('分块超出文件大小')
+
+            digest = hashlib.sha256()
+            chunk = bytearray()
+            while len(chunk) < length:
+                data = stream.read(min(CHUNK_READ_SIZE, length - len(chunk)))
+                if not data:
+                    break
+                digest.update(data)
+                chunk += data
+            if len(chunk) != length:
+                raise UploadError('分块数据不完整，请重试')
+            if checksum and digest.hexdigest() != checksum.lower():
+                raise UploadError('分块校验失败，请重试', status=422)
+
+            # 与已接收部分重叠时（重试已确认的分块）只允许内容相同，只写入新的部分
+            overlap = max(0, min(state['offset'], offset + length) - offset)
+            fd = os.open(self.data_path(upload_id), os.O_RDWR)
+            try:
+                if overlap and os.pread(fd, overlap, offset) != chunk[:overlap]:
+                    raise UploadError(f"分块与已接收的数据不一致，应从 {state['offset']} 继续", status=409)
+                if overlap < length:
+                    os.pwrite(fd, memoryview(chunk)[overlap:], offset + overlap)
+            finally:
+                os.close(fd)
+
+            state['offset'] = max(state['offset'], offset + length)
+            self._save(state)
+            return state['offset']
+
+    def finish(self, upload_id, user_id, ingest):
+        """校验完整文件并交给 ingest(文件对象, 文件名) 处理，ingest 返回存储后的文件列表"""
+        with self._lock(upload_id):
+            state = self.get(upload_id, user_id)
+            if state['complete']:
+                return state
+            if state['offset'] != state['size']:
+                raise UploadError(f"文件尚未上传完整（{state['offset']}/{state['size']}）", status=409)
+            path = self.data_path(upload_id)
+            if state['sha256']:
+                digest = hashlib.sha256()
+                with open(path, 'rb') as f:
+                    for chunk in iter(lambda: f.read(CHUNK_READ_SIZE * 16), b''):
+                        digest.update(chunk)
+                if digest.hexdigest() != state['sha256']:
+                    # 内容与声明不符，丢弃已接收的数据，客户端需从头上传
+                    state['offset'] = 0
+                    self._save(state)
+                    raise UploadError('文件校验失败，请重新上传', status=422)
+            with open(path, 'rb') as f:
+                state['files'] = ingest(f, state['filename'])
+            state['complete'] = True
+            self._save(state)
+            os.remove(path)
+            return state
+
+    def take(self, upload_ids, user_id, max_files=None):
+        """取出已完成上传中存储的文件并删除上传状态，返回 [(存储路径, 原始文件名)]"""
+        states = [self.get(upload_id, user_id) for upload_id in dict.fromkeys(upload_ids)]
+        incomplete = [state['filename'] for state in states if not state['complete']]
+        if incomplete:
+            raise UploadError(f"以下文件尚未上传完成: {'、'.join(incomplete)}", status=409)
+        files = [(path, filename) for state in states for path, filename in state['files']]
+        if max_files and len(files) > max_files:
+            raise UploadError(f'一次最多导入 {max_files} 个发票文件')
+        for state in states:
+            try:
+                os.remove(self._state_path(state['upload_id']))
+            except FileNotFoundError:
+                pass
+            with self._locks_guard:
+                self._locks.pop(state['upload_id'], None)
+        return files
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+发票批量处理命令行工具
+不启动Web服务，直接使用与Web应用相同的提取、去重和保存流程，适合在cron中定时运行或在空闲机器上做大批量回溯。
+
+用法:
+    python cli.py sync [--account ID] [--user 用户名] [--since 2024-01-01] [--workers 8]
+    python cli.py extract ./scans --user 用户名 [--recursive] [--move] [--workers 8]
+    python cli.py reprocess --user 用户名 [--since 2024-01-01] [--invoice-id ID] [--workers 8] [--dry-run]
+    python cli.py export --user 用户名 [--output 发票.zip] [--format zip|csv] [--since ...] [--until ...]
+
+处理日志输出到标准错误，命令结束时在标准输出打印JSON格式的结果摘要；有失败项时退出码为1。
+--workers 为同时进行的大模型调用数（默认CPU核数）。
+"""
+
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from datetime import datetime
+
+import click
+from sqlalchemy import select
+
+from app import (app, db, extract_invoice_info, file_remover, import_invoice_files, invoice_record,
+                 invoice_zip_entries, listing_cache, sync_email_account, sync_scheduler)
+from models import EmailAccount, Invoice, User
+from zip_stream import stream_zip
+
+def emit(summary):
+    """在标准输出打印结果摘要，有失败项时以退出码1结束"""
+    click.echo(json.dumps(summary, ensure_ascii=False, indent=2, default=str))
+    if summary.get('errors') or summary.get('failed'):
+        sys.exit(1)
+
+def resolve_user(username):
+    user = User.query.filter_by(username=username).first()
+    if not user:
+        raise click.BadParameter(f'用户 {username} 不存在', param_hint='--user')
+    return user.id
+
+def parse_date(value, option):
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        raise click.BadParameter('日期格式应为YYYY-MM-DD', param_hint=option)
+
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+@click.group()
+@click.option('--workers', type=int, default=os.cpu_count() or 4, show_default=True, help='同时进行的大模型调用数')
+def cli(workers):
+    """发票批量处理命令行工具"""
+    app.config['JOB_USER_MAX_LLM_CALLS'] = max(1, workers)
+
+@cli.command()
+@click.option('--account', 'account_ids', type=int, multiple=True, help='邮箱账号ID，可重复指定；默认同步所有开启同步的账号')
+@click.option('--user', 'username', help='只同步该用户的账号')
+@click.option('--since', help='检索该日期之后的全部邮件（YYYY-MM-DD），用于回溯导入；默认增量同步')
+def sync(account_ids, username, since):
+    """同步邮箱中的发票"""
+    date_since = parse_date(since, '--since')
+    with app.app_context():
+        query = EmailAccount.query
+        if account_ids:
+            query = query.filter(EmailAccount.id.in_(account_ids))
+        else:
+            query = query.filter_by(sync_enabled=True)
+        if username:
+            query = query.filter_by(user_id=resolve_user(username))
+        accounts = [account.id for account in query.order_by(EmailAccount.id)]
+
+    started = time.time()
+    summary = {'command': 'sync', 'accounts': [], 'saved': 0, 'duplicates': 0, 'errors': []}
+    with redirect_stdout(sys.stderr):
+        for account_id in accounts:
+            try:
+                # 与定时同步和 imap_idle.py 共用账号锁，等待正在进行的同步结束
+                with sync_scheduler.account_lock(account_id):
+                    result = sync_email_account(account_id, date_since=date_since)
+            except Exception as e:
+                print(f"同步邮箱账号 {account_id} 时出错: {e}")
+                summary['errors'].append({'account_id': account_id, 'error': str(e)})
+                continue
+            summary['accounts'].append(result)
+            summary['saved'] += result['saved']
+            summary['duplicates'] += result['duplicates']
+        file_remover.join()
+    summary['elapsed_seconds'] = round(time.time() - started, 2)
+    emit(summary)
+
+@cli.command()
+@click.argument('directory', type=click.Path(exists=True, file_okay=False))
+@click.option('--user', 'username', required=True, help='发票所属用户')
+@click.option('--recursive', is_flag=True, help='包含子目录中的PDF')
+@click.option('--move', is_flag=True, help='导入后把文件移入内容存储（默认复制，保留原文件）')
+@click.option('--batch-size', type=int, default=500, show_default=True, help='每批导入的文件数，每批生成一条处理历史')
+def extract(directory, username, recursive, move, batch_size):
+    """提取目录中PDF发票的信息并导入"""
+    with app.app_context():
+        user_id = resolve_user(username)
+    if recursive:
+        files = [os.path.join(root, name) for root, _, names in os.walk(directory) for name in names]
+    else:
+        files = [os.path.join(directory, name) for name in os.listdir(directory)]
+    files = sorted(path for path in files if path.lower().endswith('.pdf') and os.path.isfile(path))
+
+    started = time.time()
+    summary = {'command': 'extract', 'directory': directory, 'files': len(files), 'saved': 0,
+               'duplicates': 0, 'failed': 0, 'failed_files': [], 'history_ids': []}
+    with redirect_stdout(sys.stderr):
+        for batch in chunks(files, max(1, batch_size)):
+            result = import_invoice_files(batch, user_id, move_files=move)
+            summary['saved'] += len(result['saved_invoices'])
+            summary['duplicates'] += len(result['duplicate_invoices'])
+            summary['failed'] += len(result['failed_files'])
+            summary['failed_files'].extend(result['failed_files'])
+            summary['history_ids'].append(result['history_id'])
+        file_remover.join()
+    elapsed = time.time() - started
+    summary['elapsed_seconds'] = round(elapsed, 2)
+    summary['files_per_second'] = round(len(files) / elapsed, 2) if elapsed else None
+    emit(summary)
+
+REPROCESS_FIELDS = ('invoice_no', 'invoice_date', 'seller', 'amount', 'project_name', 'current_filename')
+
+@cli.command()
+@click.option('--user', 'username', help='只重新提取该用户的发票')
+@click.option('--invoice-id', 'invoice_ids', type=int, multiple=True, help='发票ID，可重复指定')
+@click.option('--since', help='只处理开票日期在该日期之后的发票（YYYY-MM-DD）')
+@click.option('--dry-run', is_flag=True, help='只统计会变化的发票，不写入数据库')
+def reprocess(username, invoice_ids, since, dry_run):
+    """用当前的大模型和提示词重新提取已导入发票的信息"""
+    if not username and not invoice_ids:
+        raise click.UsageError('请指定 --user 或 --invoice-id')
+    date_since = parse_date(since, '--since')
+    with app.app_context():
+        query = select(Invoice.id, Invoice.file_path).order_by(Invoice.id)
+        if username:
+            query = query.where(Invoice.user_id == resolve_user(username))
+        if invoice_ids:
+            query = query.where(Invoice.id.in_(invoice_ids))
+        if date_since:
+            query = query.where(Invoice.invoice_date_std >= date_since.date())
+        targets = db.session.execute(query).all()
+
+    started = time.time()
+    summary = {'command': 'reprocess', 'invoices': len(targets), 'updated': 0, 'unchanged': 0, 'failed': 0,
+               'missing_files': [], 'conflicts': [], 'changes': [], 'dry_run': dry_run}
+    workers = app.config['JOB_USER_MAX_LLM_CALLS']
+    with redirect_stdout(sys.stderr), ThreadPoolExecutor(max_workers=workers) as executor:
+        for chunk in chunks(targets, app.config['IMPORT_DB_CHUNK_SIZE']):
+            present = []
+            for invoice_id, path in chunk:
+                if path and os.path.exists(path):
+                    present.append((invoice_id, path))
+                else:
+                    summary['missing_files'].append(invoice_id)
+            extracted = dict(zip((invoice_id for invoice_id, _ in present),
+                                 executor.map(extract_invoice_info, (path for _, path in present))))
+            with app.app_context():
+                users = set()
+                for invoice_id, info in extracted.items():
+                    if not info:
+                        summary['failed'] += 1
+                        continue
+                    invoice = db.session.get(Invoice, invoice_id)
+                    record = invoice_record(info, invoice.history_id, invoice.user_id)
+                    changes = {field: record[field] for field in REPROCESS_FIELDS
+                               if record[field] != getattr(invoice, field)}
+                    if not changes:
+                        summary['unchanged'] += 1
+                        continue
+                    if 'invoice_no' in changes and Invoice.query.filter(
+                            Invoice.user_id == invoice.user_id, Invoice.invoice_no == changes['invoice_no'],
+                            Invoice.id != invoice.id).first():
+                        # 与已有发票号重复，保留原记录
+                        summary['conflicts'].append({'invoice_id': invoice_id, 'invoice_no': changes['invoice_no']})
+                        continue
+                    summary['updated'] += 1
+                    summary['changes'].append({'invoice_id': invoice_id, 'fields': sorted(changes)})
+                    if not dry_run:
+                        for field, value in changes.items():
+                            setattr(invoice, field, value)
+                        users.add(invoice.user_id)
+                db.session.commit()
+                for user_id in users:
+                    listing_cache.invalidate(user_id)
+    summary['elapsed_seconds'] = round(time.time() - started, 2)
+    emit(summary)
+
+@cli.command()
+@click.option('--user', 'username', required=True, help='发票所属用户')
+@click.option('--output', type=click.Path(dir_okay=False), help='输出文件，默认为当前目录下的 发票导出_日期.zip/.csv')
+@click.option('--format', 'fmt', type=click.Choice(['zip', 'csv']), default='zip', show_default=True,
+              help='zip 包含发票PDF和汇总表，csv 只导出汇总表')
+@click.option('--since', help='开票日期不早于该日期（YYYY-MM-DD）')
+@click.option('--until', help='开票日期不晚于该日期（YYYY-MM-DD）')
+def export(username, output, fmt, since, until):
+    """导出用户的发票"""
+    date_since = parse_date(since, '--since')
+    date_until = parse_date(until, '--until')
+    output = output or f"发票导出_{datetime.now().strftime('%Y%m%d')}.{fmt}"
+    started = time.time()
+    with app.app_context():
+        query = Invoice.query.filter_by(user_id=resolve_user(username))
+        if date_since:
+            query = query.filter(Invoice.invoice_date_std >= date_since.date())
+        if date_until:
+            query = query.filter(Invoice.invoice_date_std <= date_until.date())
+        invoices = query.order_by(Invoice.invoice_date_std, Invoice.id).all()
+        missing = [invoice.id for invoice in invoices if not invoice.file_path or not os.path.exists(invoice.file_path)]
+        entries = list(invoice_zip_entries(invoices))
+        if fmt == 'zip':
+            chunks_out = stream_zip(entries)
+        else:
+            chunks_out = entries[-1][1]  # 汇总表
+        temp_path = output + '.tmp'
+        with open(temp_path, 'wb') as f:
+            for chunk in chunks_out:
+                f.write(chunk)
+        os.replace(temp_path, output)
+    emit({'command': 'export', 'output': output, 'format': fmt, 'invoices': len(invoices),
+          'missing_files': missing, 'bytes': os.path.getsize(output),
+          'elapsed_seconds': round(time.time() - started, 2)})
+
+if __name__ == '__main__':
+    cli()
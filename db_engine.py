@@ -0,0 +1,83 @@
+"""数据库引擎配置
+
+DB_ENGINE_PROFILE=production（默认）时：
+- SQLite 每个新连接都设置 WAL 日志模式、synchronous=NORMAL、忙等待超时和 cache_size/mmap_size，
+  使网页请求的读操作与后台导入的写操作可以同时进行，不再出现 "database is locked"
+- 连接池大小按多线程（网页请求、后台任务、定时同步）的并发量设置
+
+DB_ENGINE_PROFILE=default 时保持 SQLAlchemy 的默认设置。
+"""
+
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+def load_engine_config(config, environ):
+    """从环境变量读取数据库引擎配置"""
+    config['DB_ENGINE_PROFILE'] = environ.get('DB_ENGINE_PROFILE') or 'production'
+    config['DB_POOL_SIZE'] = int(environ.get('DB_POOL_SIZE') or 10)
+    config['DB_MAX_OVERFLOW'] = int(environ.get('DB_MAX_OVERFLOW') or 20)
+    config['DB_POOL_TIMEOUT'] = int(environ.get('DB_POOL_TIMEOUT') or 30)
+    config['DB_POOL_RECYCLE'] = int(environ.get('DB_POOL_RECYCLE') or 1800)
+    config['SQLITE_JOURNAL_MODE'] = environ.get('SQLITE_JOURNAL_MODE') or 'WAL'
+    config['SQLITE_SYNCHRONOUS'] = environ.get('SQLITE_SYNCHRONOUS') or 'NORMAL'
+    config['SQLITE_BUSY_TIMEOUT_MS'] = int(environ.get('SQLITE_BUSY_TIMEOUT_MS') or 30000)
+    config['SQLITE_CACHE_SIZE_KB'] = int(environ.get('SQLITE_CACHE_SIZE_KB') or 64 * 1024)
+    config['SQLITE_MMAP_SIZE_MB'] = int(environ.get('SQLITE_MMAP_SIZE_MB') or 256)
+
+def is_file_sqlite(uri):
+    """是否为基于文件的SQLite数据库（内存数据库不支持WAL，也不能使用连接池）"""
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:') \
+        and 'mode=memory' not in str(url)
+
+def engine_options(config):
+    """根据配置生成 SQLALCHEMY_ENGINE_OPTIONS"""
+    if config['DB_ENGINE_PROFILE'] != 'production':
+        return {}
+    uri = config['SQLALCHEMY_DATABASE_URI']
+    if make_url(uri).get_backend_name() == 'sqlite':
+        if not is_file_sqlite(uri):
+            return {}
+        return {
+            'pool_size': config['DB_POOL_SIZE'],
+            'max_overflow': config['DB_MAX_OVERFLOW'],
+            'pool_timeout': config['DB_POOL_TIMEOUT'],
+            # sqlite3 模块自身的锁等待（秒），与 busy_timeout 保持一致
+            'connect_args': {'timeout': config['SQLITE_BUSY_TIMEOUT_MS'] / 1000},
+        }
+    return {
+        'pool_size': config['DB_POOL_SIZE'],
+        'max_overflow': config['DB_MAX_OVERFLOW'],
+        'pool_timeout': config['DB_POOL_TIMEOUT'],
+        'pool_recycle': config['DB_POOL_RECYCLE'],
+        'pool_pre_ping': True,
+    }
+
+def sqlite_pragmas(config):
+    """新连接上要执行的 PRAGMA 语句"""
+    return [
+        f"PRAGMA journal_mode={config['SQLITE_JOURNAL_MODE']}",
+        f"PRAGMA synchronous={config['SQLITE_SYNCHRONOUS']}",
+        f"PRAGMA busy_timeout={config['SQLITE_BUSY_TIMEOUT_MS']}",
+        # 负数表示以KiB为单位
+        f"PRAGMA cache_size=-{config['SQLITE_CACHE_SIZE_KB']}",
+        f"PRAGMA mmap_size={config['SQLITE_MMAP_SIZE_MB'] * 1024 * 1024}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+
+def init_engine(app, db):
+    """为SQLite引擎注册连接时执行的PRAGMA（需在 db.init_app 之后调用）"""
+    if app.config['DB_ENGINE_PROFILE'] != 'production' or not is_file_sqlite(app.config['SQLALCHEMY_DATABASE_URI']):
+        return
+    pragmas = sqlite_pragmas(app.config)
+
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma in pragmas:
+                cursor.execute(pragma)
+        finally:
+            cursor.close()
+
+    with app.app_context():
+        event.listen(db.engine, 'connect', set_sqlite_pragmas)
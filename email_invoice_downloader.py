@@ -6,19 +6,25 @@ from datetime import datetime
 import email.utils
 import re
 
+from metrics import IMAP_BYTES, IMAP_MESSAGES, stage_timer
+
 def connect_to_email(email_address, password):
-    """连接到邮箱服务器"""
+    """连接到邮箱服务器（默认为QQ邮箱，可通过 IMAP_HOST、IMAP_PORT、IMAP_SSL 环境变量指定其他服务器）"""
     try:
-        # 连接到 QQ 邮箱的 IMAP 服务器
-        imap_server = "imap.qq.com"
-        imap = imaplib.IMAP4_SSL(imap_server)
-        imap.login(email_address, password)
+        imap_server = os.getenv('IMAP_HOST') or "imap.qq.com"
+        use_ssl = os.getenv('IMAP_SSL', 'true').lower() in ('1', 'true', 'yes')
+        with stage_timer('imap_connect'):
+            if use_ssl:
+                imap = imaplib.IMAP4_SSL(imap_server, int(os.getenv('IMAP_PORT') or 993))
+            else:
+                imap = imaplib.IMAP4(imap_server, int(os.getenv('IMAP_PORT') or 143))
+            imap.login(email_address, password)
         return imap
     except Exception as e:
         print(f"连接邮箱失败: {str(e)}")
         return None
 
-def download_invoice_attachments(imap, date_since=None):
+def download_invoice_attachments(imap, date_since=None, download_dir='downloads'):
     """下载包含'发票'的邮件中的PDF附件"""
     try:
         # 选择收件箱
@@ -34,14 +40,15 @@ def download_invoice_attachments(imap, date_since=None):
         else:
             search_criteria = 'SUBJECT "发票"'.encode('utf-8')
             
-        _, messages = imap.search(None, search_criteria)
+        with stage_timer('imap_search'):
+            _, messages = imap.search(None, search_criteria)
         
-        if not os.path.exists('downloads'):
-            os.makedirs('downloads')
+        if not os.path.exists(download_dir):
+            os.makedirs(download_dir)
             
         # 清空下载目录，避免重复文件
-        for file in os.listdir('downloads'):
-            file_path = os.path.join('downloads', file)
+        for file in os.listdir(download_dir):
+            file_path = os.path.join(download_dir, file)
             if os.path.isfile(file_path):
                 os.remove(file_path)
                 
@@ -52,8 +59,11 @@ def download_invoice_attachments(imap, date_since=None):
         
         for msg_num in messages[0].split():
             # 获取邮件内容
-            _, msg_data = imap.fetch(msg_num, '(RFC822)')
+            with stage_timer('imap_fetch'):
+                _, msg_data = imap.fetch(msg_num, '(RFC822)')
             email_body = msg_data[0][1]
+            IMAP_MESSAGES.inc()
+            IMAP_BYTES.inc(len(email_body))
             email_message = email.message_from_bytes(email_body)
             
             # 获取邮件主题
@@ -88,44 +98,9 @@ def download_invoice_attachments(imap, date_since=None):
             print(f"处理邮件: {subject}")
             
             # 处理附件
-            has_pdf = False
-            for part in email_message.walk():
-                if part.get_content_maintype() == 'multipart':
-                    continue
-                if part.get('Content-Disposition') is None:
-                    continue
-                    
-                filename = part.get_filename()
-                if filename:
-                    # 解码文件名
-                    filename_tuple = decode_header(filename)[0]
-                    if isinstance(filename_tuple[0], bytes):
-                        try:
-                            # 尝试使用指定的编码
-                            filename = filename_tuple[0].decode(filename_tuple[1] or 'utf-8')
-                        except:
-                            # 如果失败，尝试其他编码
-                            filename = filename_tuple[0].decode('gbk', errors='ignore')
-                    
-                    # 确保文件名是合法的
-                    filename = "".join(c for c in filename if c.isprintable())
-                    
-                    # 只下载PDF文件
-                    if filename.lower().endswith('.pdf'):
-                        has_pdf = True
-                        filepath = os.path.join('downloads', filename)
-                        
-                        # 如果文件已存在，添加序号
-                        counter = 1
-                        base_name, ext = os.path.splitext(filename)
-                        while os.path.exists(filepath):
-                            filepath = os.path.join('downloads', f"{base_name}_{counter}{ext}")
-                            counter += 1
-                            
-                        with open(filepath, 'wb') as f:
-                            f.write(part.get_payload(decode=True))
-                        print(f"已下载: {os.path.basename(filepath)}")
-                        downloaded_count += 1
+            saved_files = save_pdf_attachments(email_message, download_dir)
+            has_pdf = bool(saved_files)
+            downloaded_count += len(saved_files)
             
             if not has_pdf:
                 print(f"邮件没有PDF附件: {subject}")
@@ -136,19 +111,120 @@ def download_invoice_attachments(imap, date_since=None):
         print(f"下载附件时出错: {str(e)}")
         raise  # 重新抛出异常，让上层函数处理
 
+def save_pdf_attachments(email_message, download_dir):
+    """保存邮件中的PDF附件，返回保存的文件路径列表"""
+    saved_files = []
+    for part in email_message.walk():
+        if part.get_content_maintype() == 'multipart':
+            continue
+        if part.get('Content-Disposition') is None:
+            continue
+            
+        filename = part.get_filename()
+        if filename:
+            # 解码文件名
+            filename_tuple = decode_header(filename)[0]
+            if isinstance(filename_tuple[0], bytes):
+                try:
+                    # 尝试使用指定的编码
+                    filename = filename_tuple[0].decode(filename_tuple[1] or 'utf-8')
+                except:
+                    # 如果失败，尝试其他编码
+                    filename = filename_tuple[0].decode('gbk', errors='ignore')
+            
+            # 确保文件名是合法的
+            filename = "".join(c for c in filename if c.isprintable())
+            
+            # 只下载PDF文件
+            if filename.lower().endswith('.pdf'):
+                filepath = os.path.join(download_dir, filename)
+                
+                # 如果文件已存在，添加序号
+                counter = 1
+                base_name, ext = os.path.splitext(filename)
+                while os.path.exists(filepath):
+                    filepath = os.path.join(download_dir, f"{base_name}_{counter}{ext}")
+                    counter += 1
+                    
+                with open(filepath, 'wb') as f:
+                    f.write(part.get_payload(decode=True))
+                print(f"已下载: {os.path.basename(filepath)}")
+                saved_files.append(filepath)
+    return saved_files
+
+def get_uidvalidity(imap):
+    """获取当前选中邮箱的UIDVALIDITY（需先执行select）"""
+    _, data = imap.response('UIDVALIDITY')
+    if data and data[0]:
+        try:
+            return int(data[0])
+        except (TypeError, ValueError):
+            return None
+    return None
+
+def search_invoice_uids(imap, since_uid=None, date_since=None):
+    """搜索标题包含"发票"的邮件，返回按升序排列的UID列表
+    
+    since_uid: 只返回UID大于该值的邮件，用于增量同步
+    date_since: 只返回该日期之后的邮件
+    """
+    criteria = ['SUBJECT "发票"']
+    if since_uid:
+        criteria.append(f'UID {int(since_uid) + 1}:*')
+    if date_since:
+        criteria.append(f'SINCE "{date_since.strftime("%d-%b-%Y")}"')
+    search_criteria = f'({" ".join(criteria)})'.encode('utf-8')
+    
+    with stage_timer('imap_search'):
+        _, data = imap.uid('search', None, search_criteria)
+    uids = sorted(int(uid) for uid in (data[0] or b'').split())
+    
+    # "n:*" 在没有新邮件时也会返回最后一封邮件，需要在客户端再次过滤
+    if since_uid:
+        uids = [uid for uid in uids if uid > since_uid]
+    return uids
+
+def download_attachments_by_uid(imap, uids, download_dir):
+    """按UID下载邮件中的PDF附件（需先执行select），返回下载的文件路径列表"""
+    os.makedirs(download_dir, exist_ok=True)
+    
+    downloaded_files = []
+    for uid in uids:
+        with stage_timer('imap_fetch'):
+            _, msg_data = imap.uid('fetch', str(uid), '(RFC822)')
+        if not msg_data or not isinstance(msg_data[0], tuple):
+            print(f"邮件 UID {uid} 不存在或已被删除")
+            continue
+        IMAP_MESSAGES.inc()
+        IMAP_BYTES.inc(len(msg_data[0][1]))
+        email_message = email.message_from_bytes(msg_data[0][1])
+        downloaded_files.extend(save_pdf_attachments(email_message, download_dir))
+    
+    print(f"按UID下载了 {len(downloaded_files)} 个PDF附件，共 {len(uids)} 封邮件")
+    return downloaded_files
+
 def main():
-    """主函数"""
+    """只下载邮箱中的发票附件（不提取、不入库）；完整的导入请使用 `python cli.py sync`"""
+    import argparse
+    import getpass
+    
+    parser = argparse.ArgumentParser(description='下载邮箱中的发票PDF附件')
+    parser.add_argument('--email', default=os.getenv('INVOICE_EMAIL'), help='邮箱地址（默认读取 INVOICE_EMAIL）')
+    parser.add_argument('--since', help='只检索该日期之后的邮件（YYYY-MM-DD）')
+    parser.add_argument('--output', default='downloads', help='附件保存目录')
+    args = parser.parse_args()
+    
     print("欢迎使用发票邮件下载器")
-    email_address = "vmxmy@qq.com" 
-    password = "jwbcaaedignsbjfb"
+    email_address = args.email or input('邮箱地址: ')
+    # 授权码不通过命令行参数传入，避免出现在进程列表和shell历史中
+    password = os.getenv('INVOICE_EMAIL_PASSWORD') or getpass.getpass('授权码: ')
+    date_since = datetime.strptime(args.since, "%Y-%m-%d") if args.since else None
     
     # 连接到邮箱
     imap = connect_to_email(email_address, password)
     if imap:
         try:
-            # 测试日期过滤
-            test_date = datetime.strptime("2023-01-01", "%Y-%m-%d")
-            download_invoice_attachments(imap, date_since=test_date)
+            download_invoice_attachments(imap, date_since=date_since, download_dir=args.output)
             print("处理完成！")
         except Exception as e:
             print(f"处理过程中出现错误: {str(e)}")
@@ -156,4 +232,4 @@ def main():
             imap.logout()
     
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
@@ -0,0 +1,54 @@
+import os
+import queue
+import threading
+
+class FileRemover:
+    """后台删除文件
+
+    删除发票记录后，把对应文件路径加入队列，由后台线程删除，
+    请求不必等待大量文件的删除完成。
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['file_remover'] = self
+        self.app = app
+
+    def remove(self, paths):
+        """把要删除的文件加入队列"""
+        paths = [path for path in paths if path]
+        if not paths:
+            return
+        self._ensure_worker()
+        for path in paths:
+            self._queue.put(path)
+
+    def join(self):
+        """等待队列中的文件全部删除"""
+        self._queue.join()
+
+    def _ensure_worker(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._worker_loop, name='file-remover', daemon=True)
+            self._thread.start()
+
+    def _worker_loop(self):
+        while True:
+            path = self._queue.get()
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"删除文件 {path} 时出错: {e}")
+            finally:
+                self._queue.task_done()
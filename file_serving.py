@@ -0,0 +1,57 @@
+"""发票PDF与ZIP的下载响应
+
+FILE_SERVE_MODE 决定文件由谁发送：
+- direct（默认）：由Flask发送，支持条件请求（ETag/If-None-Match 返回304）和 Range 分段下载
+- x-sendfile：返回 X-Sendfile 头（Apache mod_xsendfile、lighttpd），由前端服务器读取并发送文件
+- x-accel：返回 X-Accel-Redirect 头（nginx）。内容存储中的发票的地址为 FILE_SERVE_ACCEL_PREFIX + 相对于
+  BLOB_STORE_DIR 的路径，ZIP缓存中的文件为 FILE_SERVE_ACCEL_ARCHIVE_PREFIX + 相对于 ARCHIVE_CACHE_DIR 的路径，
+  其他文件（旧版本导入的发票、static 中的ZIP）仍由Flask发送。nginx 中需配置对应的 internal location，例如：
+
+      location /protected-files/ {
+          internal;
+          alias /path/to/invoice_assist/store/;
+      }
+      location /protected-archives/ {
+          internal;
+          alias /path/to/invoice_assist/archives/;
+      }
+
+权限检查仍在视图函数中完成，前端服务器只负责读取文件，不占用应用的工作线程。
+"""
+
+import os
+from urllib.parse import quote
+
+from flask import current_app, request
+from werkzeug.utils import send_file
+
+SERVE_MODES = ('direct', 'x-sendfile', 'x-accel')
+
+def accel_redirect_uri(path):
+    """文件在 nginx internal location 中的地址，不在内容存储或ZIP缓存中的文件返回 None"""
+    config = current_app.config
+    path = os.path.abspath(path)
+    for root, prefix in ((config['BLOB_STORE_DIR'], config['FILE_SERVE_ACCEL_PREFIX']),
+                         (config['ARCHIVE_CACHE_DIR'], config['FILE_SERVE_ACCEL_ARCHIVE_PREFIX'])):
+        root = os.path.abspath(root)
+        if path.startswith(root + os.sep):
+            relative = os.path.relpath(path, root).replace(os.sep, '/')
+            return f"{prefix.rstrip('/')}/{quote(relative)}"
+    return None
+
+def send_download(path, download_name, etag=None, mimetype=None):
+    """发送文件附件；etag 为内容摘要等稳定标识，未指定时按文件修改时间和大小生成"""
+    mode = current_app.config['FILE_SERVE_MODE']
+    accel_uri = accel_redirect_uri(path) if mode == 'x-accel' else None
+    # 与 flask.send_file 相同，只是按文件决定是否交给前端服务器发送（静态文件始终由Flask发送）
+    response = send_file(os.path.abspath(path), request.environ, mimetype=mimetype, as_attachment=True,
+                         download_name=download_name, conditional=True, etag=etag or True,
+                         use_x_sendfile=mode == 'x-sendfile' or accel_uri is not None,
+                         response_class=current_app.response_class,
+                         max_age=current_app.get_send_file_max_age)
+    # 文件属于登录用户，只允许浏览器缓存，每次使用前用ETag验证
+    response.cache_control.private = True
+    if accel_uri and 'X-Sendfile' in response.headers:
+        del response.headers['X-Sendfile']
+        response.headers['X-Accel-Redirect'] = accel_uri
+    return response
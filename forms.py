@@ -1,6 +1,6 @@
 from flask_wtf import FlaskForm
-from wtforms import StringField, PasswordField, BooleanField, SubmitField, TextAreaField, DateField
-from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError, Optional
+from wtforms import StringField, PasswordField, BooleanField, SubmitField, TextAreaField, DateField, IntegerField
+from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationError, Optional, NumberRange
 from models import User
 
 class LoginForm(FlaskForm):
@@ -35,6 +35,8 @@ class EmailAccountForm(FlaskForm):
     email_address = StringField('邮箱地址', validators=[DataRequired(), Email()])
     password = PasswordField('授权码', validators=[DataRequired()])
     description = StringField('描述', validators=[Length(max=64)])
+    sync_enabled = BooleanField('定时自动同步')
+    sync_interval = IntegerField('同步间隔（分钟，可选）', validators=[Optional(), NumberRange(min=5, max=7 * 24 * 60)])
     submit = SubmitField('保存')
 
 class InvoiceDownloadForm(FlaskForm):
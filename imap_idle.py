@@ -0,0 +1,262 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+IMAP IDLE 推送导入守护进程
+为每个开启同步的邮箱账号保持一个 IDLE 长连接，服务器通知有新邮件时
+只把新邮件的UID加入导入队列，使发票在到达后几秒内入库。
+
+用法:
+    python imap_idle.py
+"""
+
+import queue
+import random
+import select
+import ssl
+import threading
+import time
+
+from models import db, EmailAccount
+
+class IdleNotSupported(Exception):
+    """邮箱服务器不支持 IDLE 扩展"""
+
+class IdleListener:
+    """按邮箱账号维护 IMAP IDLE 连接，并把新邮件UID交给导入函数处理
+
+    - 连接总数受 IDLE_MAX_CONNECTIONS 限制，超出的账号排队等待空闲连接（期间仍由定时同步兜底）
+    - 连接断开后按指数退避重连，重连后先做一次增量同步补齐断线期间的邮件
+    - 同一账号的导入通过 lock_func 返回的锁串行化，与定时同步共用同一把跨进程的文件锁
+    - 不支持 IDLE 的账号记录下来不再重连，由定时同步处理；关闭后重新开启同步时再尝试
+    """
+
+    def __init__(self, app=None, connect_func=None, ingest_func=None, lock_func=None):
+        self.app = None
+        self.connect_func = connect_func
+        self.ingest_func = ingest_func
+        self.lock_func = lock_func
+        self._queue = None
+        self._slots = None
+        self._workers = {}
+        self._unsupported = set()
+        self._stop_event = threading.Event()
+        if app is not None:
+            self.init_app(app, connect_func, ingest_func, lock_func)
+
+    def init_app(self, app, connect_func=None, ingest_func=None, lock_func=None):
+        """绑定Flask应用、邮箱连接函数和导入函数"""
+        self.app = app
+        if connect_func is not None:
+            self.connect_func = connect_func
+        if ingest_func is not None:
+            self.ingest_func = ingest_func
+        if lock_func is not None:
+            self.lock_func = lock_func
+        app.config.setdefault('IDLE_MAX_CONNECTIONS', 20)
+        app.config.setdefault('IDLE_RENEW_SECONDS', 25 * 60)  # RFC 2177 建议29分钟内重新发起IDLE
+        app.config.setdefault('IDLE_MAX_BACKOFF_SECONDS', 15 * 60)
+        app.config.setdefault('IDLE_INGEST_WORKERS', 2)
+        app.config.setdefault('IDLE_QUEUE_SIZE', 1000)
+        app.config.setdefault('IDLE_REFRESH_SECONDS', 60)
+        app.extensions['imap_idle'] = self
+
+    def run_forever(self):
+        """启动导入线程，并定期根据数据库中的账号设置增减IDLE连接"""
+        self._stop_event.clear()
+        self._queue = queue.Queue(maxsize=self.app.config['IDLE_QUEUE_SIZE'])
+        self._slots = threading.BoundedSemaphore(self.app.config['IDLE_MAX_CONNECTIONS'])
+        for i in range(self.app.config['IDLE_INGEST_WORKERS']):
+            threading.Thread(target=self._ingest_loop, name=f'idle-ingest-{i}', daemon=True).start()
+
+        print(f"IMAP IDLE 监听已启动，最大连接数 {self.app.config['IDLE_MAX_CONNECTIONS']}")
+        try:
+            while not self._stop_event.is_set():
+                try:
+                    self.refresh_accounts()
+                except Exception as e:
+                    print(f"刷新邮箱账号列表时出错: {e}")
+                self._stop_event.wait(self.app.config['IDLE_REFRESH_SECONDS'])
+        except KeyboardInterrupt:
+            print("收到中断信号，正在停止...")
+        finally:
+            self.stop()
+
+    def stop(self):
+        """停止所有IDLE连接"""
+        self._stop_event.set()
+        for stop_event, _ in self._workers.values():
+            stop_event.set()
+
+    def refresh_accounts(self):
+        """为新开启同步的账号启动监听线程，停止已关闭同步的账号"""
+        with self.app.app_context():
+            account_ids = {account.id for account in EmailAccount.query.filter_by(sync_enabled=True).all()}
+
+        for account_id in list(self._workers):
+            stop_event, thread = self._workers[account_id]
+            if account_id not in account_ids or not thread.is_alive():
+                stop_event.set()
+                del self._workers[account_id]
+
+        # 关闭同步的账号不再记为不支持IDLE，重新开启后再尝试
+        self._unsupported &= account_ids
+        for account_id in account_ids - set(self._workers) - self._unsupported:
+            stop_event = threading.Event()
+            thread = threading.Thread(
+                target=self._account_loop, args=(account_id, stop_event),
+                name=f'idle-account-{account_id}', daemon=True
+            )
+            self._workers[account_id] = (stop_event, thread)
+            thread.start()
+
+    def _account_loop(self, account_id, stop_event):
+        """单个账号的连接循环：占用连接名额、IDLE、断线后退避重连"""
+        failures = 0
+        while not stop_event.is_set():
+            if not self._slots.acquire(timeout=5):
+                continue
+            try:
+                self._listen(account_id, stop_event)
+                failures = 0
+            except IdleNotSupported as e:
+                print(f"邮箱账号 {account_id} 不支持IDLE，改由定时同步处理: {e}")
+                self._unsupported.add(account_id)
+                return
+            except Exception as e:
+                failures += 1
+                print(f"邮箱账号 {account_id} 的IDLE连接出错（连续 {failures} 次）: {e}")
+            finally:
+                self._slots.release()
+
+            if failures and not stop_event.is_set():
+                delay = min(5 * (2 ** failures), self.app.config['IDLE_MAX_BACKOFF_SECONDS'])
+                stop_event.wait(delay + random.uniform(0, delay * 0.1))
+
+    def _listen(self, account_id, stop_event):
+        """建立连接并持续IDLE，有新邮件时把新UID加入导入队列"""
+        from email_invoice_downloader import search_invoice_uids
+
+        with self.app.app_context():
+            account = db.session.get(EmailAccount, account_id)
+            if not account or not account.sync_enabled:
+                stop_event.set()
+                return
+            email_address, password = account.email_address, account.password
+
+        imap = self.connect_func(email_address, password)
+        if not imap:
+            raise ConnectionError('邮箱连接失败')
+
+        try:
+            if 'IDLE' not in imap.capabilities:
+                raise IdleNotSupported(email_address)
+            imap.select('INBOX')
+
+            # 重连后先补齐断线期间的邮件，之后只关注UIDNEXT之后的新邮件
+            last_seen = self._uidnext(imap) - 1
+            self._enqueue(account_id, None)
+            print(f"邮箱 {email_address} 已进入IDLE监听")
+
+            while not stop_event.is_set():
+                if self._idle(imap, stop_event):
+                    uids = search_invoice_uids(imap, since_uid=last_seen)
+                    if uids:
+                        last_seen = max(uids)
+                        self._enqueue(account_id, uids)
+                        print(f"邮箱 {email_address} 收到 {len(uids)} 封新邮件: {uids}")
+        finally:
+            try:
+                imap.logout()
+            except Exception:
+                pass
+
+    def _idle(self, imap, stop_event):
+        """发起一次IDLE，直到收到新邮件通知、到达续期时间或被要求停止
+
+        返回是否收到了 EXISTS 通知。
+        """
+        tag = imap._new_tag().decode()
+        imap.send(f'{tag} IDLE\r\n'.encode())
+        line = imap.readline()
+        if not line.startswith(b'+'):
+            raise IdleNotSupported(line.decode(errors='ignore').strip())
+
+        has_new = False
+        deadline = time.time() + self.app.config['IDLE_RENEW_SECONDS']
+        while not has_new and not stop_event.is_set() and time.time() < deadline:
+            # 用select等待数据，避免对socket设置超时导致文件对象不可再读；已读入缓冲区的数据select看不到，需先检查
+            if not self._data_ready(imap):
+                readable, _, _ = select.select([imap.sock], [], [], min(30, max(0.1, deadline - time.time())))
+                if not readable:
+                    continue
+            line = imap.readline()
+            if not line:
+                raise ConnectionError('IMAP连接已被服务器关闭')
+            if line.startswith(b'* BYE'):
+                raise ConnectionError(line.decode(errors='ignore').strip())
+            if line.startswith(b'*') and line.rstrip().endswith(b'EXISTS'):
+                has_new = True
+
+        imap.send(b'DONE\r\n')
+        while True:
+            line = imap.readline()
+            if not line:
+                raise ConnectionError('IMAP连接已被服务器关闭')
+            if line.startswith(tag.encode()):
+                break
+        imap.tagged_commands.pop(tag, None)
+        return has_new
+
+    @staticmethod
+    def _data_ready(imap):
+        """是否有可以立即读取的数据：imaplib 文件对象的缓冲区、SSL层的缓冲区或socket中的数据
+
+        与 "+ idling" 在同一个包中到达的通知已被读入文件对象的缓冲区，只靠 select 会一直等到续期。
+        这里把socket临时设为非阻塞再 peek，缓冲区为空且没有新数据时立即返回。
+        """
+        sock = imap.sock
+        if getattr(sock, 'pending', lambda: 0)():
+            return True
+        timeout = sock.gettimeout()
+        sock.settimeout(0)
+        try:
+            return bool(imap.file.peek(1))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        finally:
+            sock.settimeout(timeout)
+
+    def _uidnext(self, imap):
+        """读取select返回的UIDNEXT"""
+        _, data = imap.response('UIDNEXT')
+        try:
+            return int(data[0])
+        except (TypeError, ValueError, IndexError):
+            return 1
+
+    def _enqueue(self, account_id, uids):
+        """把待导入的UID加入队列（uids为None表示执行一次增量同步）"""
+        try:
+            self._queue.put((account_id, uids), timeout=30)
+        except queue.Full:
+            # 队列积压时丢弃本次通知，遗漏的邮件会由下一次增量同步补齐
+            print(f"导入队列已满，丢弃邮箱账号 {account_id} 的新邮件通知")
+
+    def _ingest_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                account_id, uids = self._queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            try:
+                with self.lock_func(account_id):
+                    self.ingest_func(account_id, uids)
+            except Exception as e:
+                print(f"导入邮箱账号 {account_id} 的新邮件时出错: {e}")
+            finally:
+                self._queue.task_done()
+
+if __name__ == '__main__':
+    from app import idle_listener
+    idle_listener.run_forever()
@@ -0,0 +1,132 @@
+"""发票全文检索
+
+在 SQLite 上为 invoice 表维护一张 FTS5 外部内容表 invoice_fts（trigram 分词），
+覆盖 seller、project_name、invoice_no、notes 四个字段，由触发器与 invoice 表保持同步。
+trigram 分词按三个字符切分，对中文同样适用，可以用索引完成任意子串匹配，
+替代全表扫描的 LIKE '%x%'。
+
+少于三个字符的关键词无法用 trigram 索引匹配，非 SQLite 数据库也没有 FTS5，
+这两种情况下 build_match_query 返回 None，调用方回退到 LIKE 查询。
+"""
+
+from sqlalchemy import column, or_, select, table, text
+
+FTS_TABLE = 'invoice_fts'
+FTS_COLUMNS = ('seller', 'project_name', 'invoice_no', 'notes')
+MIN_TERM_LENGTH = 3
+
+_COLUMN_LIST = ', '.join(FTS_COLUMNS)
+_NEW_VALUES = ', '.join(f'new.{name}' for name in FTS_COLUMNS)
+_OLD_VALUES = ', '.join(f'old.{name}' for name in FTS_COLUMNS)
+
+# 外部内容表的标准同步方式：删除时写入 'delete' 命令，更新时先删后插
+FTS_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        {_COLUMN_LIST}, content='invoice', content_rowid='id', tokenize='trigram'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS invoice_fts_ai AFTER INSERT ON invoice BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, {_COLUMN_LIST}) VALUES (new.id, {_NEW_VALUES});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS invoice_fts_ad AFTER DELETE ON invoice BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_COLUMN_LIST}) VALUES ('delete', old.id, {_OLD_VALUES});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS invoice_fts_au AFTER UPDATE OF {_COLUMN_LIST} ON invoice BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_COLUMN_LIST}) VALUES ('delete', old.id, {_OLD_VALUES});
+        INSERT INTO {FTS_TABLE}(rowid, {_COLUMN_LIST}) VALUES (new.id, {_NEW_VALUES});
+    END""",
+]
+
+FTS_DROP_DDL = [
+    'DROP TRIGGER IF EXISTS invoice_fts_au',
+    'DROP TRIGGER IF EXISTS invoice_fts_ad',
+    'DROP TRIGGER IF EXISTS invoice_fts_ai',
+    f'DROP TABLE IF EXISTS {FTS_TABLE}',
+]
+
+_fts_available = {}
+
+def create_fts(conn):
+    """在给定连接上创建全文索引表与同步触发器，并从 invoice 表重建索引"""
+    for statement in FTS_DDL:
+        conn.execute(text(statement))
+    conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+
+def drop_fts(conn):
+    """删除全文索引表与同步触发器"""
+    for statement in FTS_DROP_DDL:
+        conn.execute(text(statement))
+
+def ensure_fts(engine):
+    """确保全文索引存在，仅在索引表首次创建时重建索引
+
+    返回全文检索是否可用。
+    """
+    if engine.dialect.name != 'sqlite':
+        _fts_available[engine.url] = False
+        return False
+    try:
+        with engine.begin() as conn:
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {'name': FTS_TABLE}
+            ).first()
+            if exists:
+                # 表可能被重建过（如批量迁移），触发器需要补齐
+                for statement in FTS_DDL[1:]:
+                    conn.execute(text(statement))
+            else:
+                create_fts(conn)
+                print("已创建发票全文索引")
+        _fts_available[engine.url] = True
+    except Exception as e:
+        # SQLite 版本过低（trigram 需要 3.34+）或未编译 FTS5 时回退到 LIKE
+        print(f"创建发票全文索引失败，搜索将使用LIKE: {e}")
+        _fts_available[engine.url] = False
+    return _fts_available[engine.url]
+
+def fts_available(engine):
+    """全文检索是否可用（结果按数据库缓存）"""
+    if engine.url not in _fts_available:
+        if engine.dialect.name != 'sqlite':
+            _fts_available[engine.url] = False
+        else:
+            with engine.connect() as conn:
+                exists = conn.execute(
+                    text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                    {'name': FTS_TABLE}
+                ).first()
+            _fts_available[engine.url] = bool(exists)
+    return _fts_available[engine.url]
+
+def build_match_query(keywords, columns=None):
+    """把用户输入的关键词转换为 FTS5 MATCH 表达式
+
+    以空白分隔的多个关键词之间是“且”的关系，每个关键词按子串匹配。
+    columns 指定只在哪些字段中匹配。任一关键词不足三个字符时返回 None。
+    """
+    terms = (keywords or '').split()
+    if not terms or any(len(term) < MIN_TERM_LENGTH for term in terms):
+        return None
+    # 用双引号把关键词作为短语，避免其中的 - * : 等字符被当作查询语法
+    expression = ' AND '.join('"{}"'.format(term.replace('"', '""')) for term in terms)
+    if columns:
+        expression = '{%s} : (%s)' % (' '.join(columns), expression)
+    return expression
+
+def apply_search(query, model, engine, keywords, columns=None):
+    """为查询添加关键词筛选，优先使用全文索引，否则回退到 LIKE
+
+    columns 为要搜索的字段名，默认搜索全部索引字段。
+    """
+    columns = tuple(columns or FTS_COLUMNS)
+    match = build_match_query(keywords, columns) if fts_available(engine) else None
+    if match is not None:
+        matched_ids = (select(column('rowid'))
+                       .select_from(table(FTS_TABLE))
+                       .where(text(f'{FTS_TABLE} MATCH :fts_match').bindparams(fts_match=match)))
+        return query.filter(model.id.in_(matched_ids))
+
+    for term in (keywords or '').split():
+        pattern = f'%{term}%'
+        query = query.filter(or_(*[getattr(model, name).like(pattern) for name in columns]))
+    return query
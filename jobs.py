@@ -0,0 +1,220 @@
+import itertools
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# 任务优先级，数值越小越先执行
+PRIORITY_INTERACTIVE = 0   # 手动上传，用户在页面上等待结果
+PRIORITY_IMPORT = 10       # 手动发起的邮箱导入
+PRIORITY_SYNC = 20         # 定时同步 / IDLE推送 / 监控目录的增量导入
+PRIORITY_BACKFILL = 30     # 大范围历史回溯导入
+
+class JobCancelled(Exception):
+    """任务已被用户取消"""
+
+class Job:
+    """后台任务，status 字典的结构与原先的全局 processing_status 一致"""
+
+    def __init__(self, user_id, kind, target, args, priority, seq):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.kind = kind
+        self.target = target
+        self.args = args
+        self.priority = priority
+        self.seq = seq
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.status = {
+            'job_id': self.id,
+            'kind': kind,
+            'status': 'queued',  # 状态：queued, processing, complete, error, cancelled
+            'current': 0,
+            'total': 0,
+            'current_file': '',
+            'redirect_url': '',
+            'error': ''
+        }
+        self.result = None
+        self._cancel_event = threading.Event()
+        self._done_event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    @property
+    def done(self):
+        return self._done_event.is_set()
+
+    def check_cancelled(self):
+        """在阶段之间和文件之间调用，任务被取消时抛出 JobCancelled"""
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+
+    def wait(self, timeout=None):
+        """等待任务结束，返回是否已结束"""
+        return self._done_event.wait(timeout)
+
+    def to_dict(self):
+        return dict(self.status)
+
+class JobManager:
+    """后台任务调度器
+
+    - 固定数量的工作线程共享执行所有任务，按优先级出队
+    - 每个用户同时运行的任务数和进行中的大模型调用数都有上限；交互任务（PRIORITY_INTERACTIVE）不受任务数上限限制，
+      另有 JOB_INTERACTIVE_WORKERS 个只执行交互任务的工作线程，用户在页面上等待的上传不必排在批量任务之后
+    - 同一优先级下优先调度当前运行任务最少、最久未被调度的用户，避免单个用户独占
+    - 任务通过 check_cancelled() 协作式取消
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._cond = threading.Condition()
+        self._queued = []
+        self._jobs = OrderedDict()
+        self._running_by_user = {}
+        self._last_served = {}
+        self._llm_slots = {}
+        self._seq = itertools.count()
+        self._workers = []
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('JOB_WORKERS', 4)
+        app.config.setdefault('JOB_INTERACTIVE_WORKERS', 1)
+        app.config.setdefault('JOB_USER_MAX_CONCURRENT', 1)
+        app.config.setdefault('JOB_USER_MAX_LLM_CALLS', 2)
+        app.config.setdefault('JOB_HISTORY_LIMIT', 200)
+        app.extensions['job_manager'] = self
+        self.app = app
+
+    def submit(self, user_id, kind, target, args=(), priority=PRIORITY_IMPORT):
+        """提交任务，target 以 target(*args, job=job) 的形式调用"""
+        self._ensure_workers()
+        with self._cond:
+            job = Job(user_id, kind, target, args, priority, next(self._seq))
+            self._jobs[job.id] = job
+            self._queued.append(job)
+            self._prune()
+            self._cond.notify_all()
+        return job
+
+    def get(self, job_id, user_id=None):
+        """按ID获取任务，指定user_id时只返回该用户的任务"""
+        job = self._jobs.get(job_id)
+        if job and user_id is not None and job.user_id != user_id:
+            return None
+        return job
+
+    def jobs_for_user(self, user_id, active_only=False):
+        """获取用户的任务，按提交时间倒序"""
+        jobs = [job for job in reversed(self._jobs.values()) if job.user_id == user_id]
+        if active_only:
+            jobs = [job for job in jobs if not job.done]
+        return jobs
+
+    def cancel(self, job_id, user_id=None):
+        """取消任务：排队中的任务直接移出队列，运行中的任务在下一个检查点停止"""
+        with self._cond:
+            job = self.get(job_id, user_id)
+            if not job or job.done:
+                return False
+            job._cancel_event.set()
+            if job in self._queued:
+                self._queued.remove(job)
+                self._finish(job, 'cancelled')
+            return True
+
+    @contextmanager
+    def llm_slot(self, user_id):
+        """限制单个用户同时进行的大模型调用数"""
+        with self._cond:
+            slot = self._llm_slots.get(user_id)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self.app.config['JOB_USER_MAX_LLM_CALLS'])
+                self._llm_slots[user_id] = slot
+        with slot:
+            yield
+
+    def _ensure_workers(self):
+        with self._cond:
+            if self._workers:
+                return
+            for i in range(self.app.config['JOB_WORKERS']):
+                thread = threading.Thread(target=self._worker_loop, name=f'job-worker-{i}', daemon=True)
+                thread.start()
+                self._workers.append(thread)
+            for i in range(self.app.config['JOB_INTERACTIVE_WORKERS']):
+                thread = threading.Thread(target=self._worker_loop, args=(True,), name=f'job-interactive-{i}',
+                                          daemon=True)
+                thread.start()
+                self._workers.append(thread)
+
+    def _pick_next(self, interactive_only=False):
+        """选出下一个可运行的任务（调用方需持有锁）"""
+        limit = self.app.config['JOB_USER_MAX_CONCURRENT']
+        candidates = [job for job in self._queued
+                      if job.priority <= PRIORITY_INTERACTIVE
+                      or (not interactive_only and self._running_by_user.get(job.user_id, 0) < limit)]
+        if not candidates:
+            return None
+        return min(candidates, key=lambda job: (
+            job.priority,
+            self._running_by_user.get(job.user_id, 0),
+            self._last_served.get(job.user_id, 0),
+            job.seq
+        ))
+
+    def _worker_loop(self, interactive_only=False):
+        while True:
+            with self._cond:
+                job = self._pick_next(interactive_only)
+                while job is None:
+                    self._cond.wait()
+                    job = self._pick_next(interactive_only)
+                self._queued.remove(job)
+                self._running_by_user[job.user_id] = self._running_by_user.get(job.user_id, 0) + 1
+                self._last_served[job.user_id] = time.monotonic()
+                job.started_at = time.time()
+                job.status['status'] = 'processing'
+            self._run(job)
+
+    def _run(self, job):
+        final_status = 'complete'
+        try:
+            job.check_cancelled()
+            job.result = job.target(*job.args, job=job)
+            if job.status['status'] in ('error', 'cancelled'):
+                final_status = job.status['status']
+        except JobCancelled:
+            final_status = 'cancelled'
+            print(f"任务 {job.id} 已取消")
+        except Exception as e:
+            final_status = 'error'
+            job.status['error'] = str(e)
+            print(f"任务 {job.id} 执行出错: {e}")
+        finally:
+            with self._cond:
+                self._running_by_user[job.user_id] -= 1
+                self._finish(job, final_status)
+                self._cond.notify_all()
+
+    def _finish(self, job, final_status):
+        """标记任务结束（调用方需持有锁）"""
+        job.status['status'] = final_status
+        if final_status == 'cancelled':
+            job.status['error'] = job.status.get('error') or '任务已取消'
+        job.finished_at = time.time()
+        job._done_event.set()
+
+    def _prune(self):
+        """只保留最近的已结束任务（调用方需持有锁）"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.done]
+        for job_id in finished[:max(0, len(finished) - self.app.config['JOB_HISTORY_LIMIT'])]:
+            del self._jobs[job_id]
@@ -0,0 +1,120 @@
+"""基于游标的分页（keyset pagination）
+
+按 (排序字段, id) 记录当前页首尾两行的位置，翻页时用 WHERE 条件直接定位到游标之后，
+代替 OFFSET 跳过前面所有行，因此无论翻到第几页，查询代价都只与每页条数有关。
+
+排序字段为 NULL 的行统一视为最小值（升序排在最前，降序排在最后），
+与 SQLite、MySQL 的默认行为一致，PostgreSQL 上会显式加上 NULLS FIRST/LAST。
+"""
+
+import base64
+import json
+from datetime import date, datetime
+
+from sqlalchemy import and_, or_
+
+class KeysetPage:
+    """一页查询结果及前后翻页的游标"""
+
+    def __init__(self, items, has_prev, has_next, prev_cursor=None, next_cursor=None):
+        self.items = items
+        self.has_prev = has_prev
+        self.has_next = has_next
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+
+def encode_cursor(value, row_id):
+    """把排序字段值和id编码为URL安全的游标字符串"""
+    if isinstance(value, (datetime, date)):
+        value = value.isoformat()
+    payload = json.dumps([value, row_id], ensure_ascii=False, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_cursor(token, value_type=None):
+    """解析游标，value_type 为排序字段的Python类型，格式无效时返回 None"""
+    if not token:
+        return None
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        if value is not None:
+            if value_type is datetime:
+                value = datetime.fromisoformat(value)
+            elif value_type is date:
+                value = date.fromisoformat(value)
+            elif value_type is int:
+                value = int(value)
+            else:
+                value = str(value)
+        return value, int(row_id)
+    except (ValueError, TypeError):
+        return None
+
+def _order_by(column, id_column, descending, dialect_name):
+    if descending:
+        orders = [column.desc(), id_column.desc()]
+        if dialect_name == 'postgresql':
+            orders[0] = orders[0].nulls_last()
+    else:
+        orders = [column.asc(), id_column.asc()]
+        if dialect_name == 'postgresql':
+            orders[0] = orders[0].nulls_first()
+    return orders
+
+def _after(column, id_column, descending, value, row_id):
+    """按给定排序方向，位于 (value, row_id) 之后的行的条件"""
+    if not descending:
+        if value is None:
+            return or_(column.isnot(None), and_(column.is_(None), id_column > row_id))
+        # 先用 column >= value 限定范围，便于使用 (user_id, 排序字段) 索引
+        return and_(column >= value, or_(column > value, id_column > row_id))
+    if value is None:
+        return and_(column.is_(None), id_column < row_id)
+    return or_(and_(column <= value, or_(column < value, id_column < row_id)), column.is_(None))
+
+def paginate_keyset(query, column, id_column, descending=False, per_page=10,
+                    after=None, before=None, value_type=None, dialect_name=None):
+    """按游标取一页数据
+
+    after/before 为上一次返回的 next_cursor/prev_cursor，二者都为空时返回第一页。
+    每次只多取一行用于判断是否还有下一页，不执行 COUNT。
+    """
+    before_key = decode_cursor(before, value_type)
+    after_key = None if before_key else decode_cursor(after, value_type)
+
+    if before_key:
+        # 向前翻页：反向排序取游标之前的行，再把结果翻转回来
+        rows = (query.filter(_after(column, id_column, not descending, *before_key))
+                .order_by(*_order_by(column, id_column, not descending, dialect_name))
+                .limit(per_page + 1).all())
+        has_prev = len(rows) > per_page
+        items = list(reversed(rows[:per_page]))
+        has_next = True
+    else:
+        if after_key:
+            query = query.filter(_after(column, id_column, descending, *after_key))
+        rows = (query.order_by(*_order_by(column, id_column, descending, dialect_name))
+                .limit(per_page + 1).all())
+        has_next = len(rows) > per_page
+        items = rows[:per_page]
+        has_prev = after_key is not None
+
+    prev_cursor = next_cursor = None
+    if items:
+        key = column.key
+        if has_prev:
+            prev_cursor = encode_cursor(getattr(items[0], key), items[0].id)
+        if has_next:
+            next_cursor = encode_cursor(getattr(items[-1], key), items[-1].id)
+    return KeysetPage(items, has_prev and prev_cursor is not None, has_next and next_cursor is not None,
+                      prev_cursor, next_cursor)
+
+def count_capped(query, limit):
+    """统计结果数量，最多数到 limit 条
+
+    返回 (数量, 是否超过上限)。结果集很大时只扫描 limit+1 行，避免完整的 COUNT。
+    """
+    if not limit:
+        return query.order_by(None).count(), False
+    total = query.order_by(None).limit(limit + 1).count()
+    return min(total, limit), total > limit
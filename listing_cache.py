@@ -0,0 +1,74 @@
+import threading
+import time
+from collections import OrderedDict
+
+class ListingCache:
+    """发票列表查询结果缓存
+
+    - 按 (用户, 规范化的筛选条件, 排序, 游标) 缓存一页结果的发票ID列表和总数
+    - 条目数超过 LISTING_CACHE_SIZE 时淘汰最久未使用的条目，超过 LISTING_CACHE_TTL 秒的条目视为过期
+    - 每个用户有一个版本号，发票有写入时递增版本号，旧版本的条目不再命中，随后被LRU淘汰
+
+    缓存只在当前进程内有效；其他进程（如 imap_idle.py）写入的发票最迟在TTL到期后可见。
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._versions = {}
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LISTING_CACHE_SIZE', 512)
+        app.config.setdefault('LISTING_CACHE_TTL', 300)
+        app.extensions['listing_cache'] = self
+        self.app = app
+
+    def make_key(self, user_id, params):
+        """由用户和查询参数生成缓存键，空参数不参与，参数顺序不影响结果"""
+        normalized = tuple(sorted((name, str(value).strip()) for name, value in params.items()
+                                  if value not in (None, '')))
+        return (user_id, self._epoch, self._versions.get(user_id, 0), normalized)
+
+    def get(self, key):
+        """读取缓存，未命中或已过期时返回 None"""
+        if not self.app.config['LISTING_CACHE_SIZE']:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def set(self, key, value):
+        """写入缓存，版本号已过期的键不写入"""
+        max_size = self.app.config['LISTING_CACHE_SIZE']
+        if not max_size:
+            return
+        with self._lock:
+            # 查询期间发生了写入，结果可能已经过时
+            if key[1:3] != (self._epoch, self._versions.get(key[0], 0)):
+                return
+            self._entries[key] = (time.monotonic() + self.app.config['LISTING_CACHE_TTL'], value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id=None):
+        """使用户的缓存失效，user_id 为 None 时清空所有缓存"""
+        with self._lock:
+            if user_id is None:
+                self._entries.clear()
+                self._epoch += 1
+                return
+            self._versions[user_id] = self._versions.get(user_id, 0) + 1
@@ -0,0 +1,236 @@
+"""发票数据维护任务（日期标准化、数据库修复）
+
+按主键范围分块处理发票表：
+- 每块先执行复制文件等耗时的准备工作（此时还没有开始写事务，不会长时间占用SQLite的写锁），
+  再执行能用一条 SQL UPDATE 完成的简单转换，然后只读取仍需处理的行，在Python中计算修改，
+  用一条批量 UPDATE 写回
+- 每块一个事务并立即提交，内存占用与块大小成正比，其他写入只需等待当前块完成
+- 处理进度记录在 maintenance_run 表中，任务中断或出错后再次运行会从上次处理到的ID继续
+- 标准日期、金额字段变化时在同一事务中更新发票汇总表
+- 数据库修复会把尚未存入内容存储的发票文件复制到存储中（原文件保留）
+"""
+
+import os
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import and_, bindparam, func, or_, select, true, update
+
+from jobs import JobCancelled
+from models import db, Invoice, MaintenanceRun, parse_amount_cents, parse_invoice_date
+from rollups import TRACKED_FIELDS, add_delta, apply_deltas
+
+class MaintenanceTask:
+    """维护任务：SQL 批量转换 + 逐行转换"""
+
+    name = None
+    description = ''
+    columns = ()  # transform 需要读取的字段
+
+    def prepare(self, conn, table, in_chunk):
+        """在每块的写事务开始前执行的耗时操作，返回 {发票ID: 需要修改的字段}（只用于 candidates 选出的行）"""
+        return {}
+
+    def sql_updates(self, table):
+        """返回 [(条件, 更新值)]，在每个主键范围内直接执行"""
+        return []
+
+    def candidates(self, table):
+        """需要逐行处理的行的筛选条件，None 表示全部"""
+        return None
+
+    def transform(self, row):
+        """返回需要修改的字段字典，无需修改时返回空字典"""
+        raise NotImplementedError
+
+def normalized_date(date_str):
+    """把可解析的日期字符串转换为 YYYY-MM-DD，无法解析时返回 None"""
+    date_value = parse_invoice_date(date_str)
+    return date_value.strftime('%Y-%m-%d') if date_value else None
+
+def invoice_filename(invoice_date, seller, amount, invoice_no):
+    """按 日期-开票方-金额-发票号.pdf 生成文件名（与编辑发票时的规则一致）"""
+    seller_clean = (seller or '')[:20].replace('/', '_').replace('\\', '_')
+    filename = f"{invoice_date}-{seller_clean}-{amount}-{invoice_no}.pdf"
+    for char in ':*?"<>|':
+        filename = filename.replace(char, '_')
+    return filename
+
+class NormalizeDatesTask(MaintenanceTask):
+    """把开票日期统一为 YYYY-MM-DD，并同步标准日期字段"""
+
+    name = 'normalize_dates'
+    description = '标准化发票日期'
+    columns = ('invoice_date', 'invoice_date_std')
+
+    def sql_updates(self, table):
+        # 最常见的 "YYYY年MM月DD日" 直接在数据库中替换，不需要读出
+        chinese = table.c.invoice_date.like('____年__月__日')
+        value = func.replace(func.replace(func.replace(table.c.invoice_date, '年', '-'), '月', '-'), '日', '')
+        return [(chinese, {'invoice_date': value})]
+
+    def candidates(self, table):
+        return and_(
+            table.c.invoice_date.isnot(None),
+            table.c.invoice_date != '',
+            or_(~table.c.invoice_date.like('____-__-__'), table.c.invoice_date_std.is_(None))
+        )
+
+    def transform(self, row):
+        changes = {}
+        new_date = normalized_date(row['invoice_date'])
+        if new_date and new_date != row['invoice_date']:
+            changes['invoice_date'] = new_date
+        date_std = parse_invoice_date(new_date or row['invoice_date'])
+        if date_std != row['invoice_date_std']:
+            changes['invoice_date_std'] = date_std
+        return changes
+
+class RepairDatabaseTask(NormalizeDatesTask):
+    """标准化日期、同步类型化字段、按统一规则重新生成文件名，并把旧文件存入内容存储"""
+
+    name = 'repair_database'
+    description = '修复发票数据'
+    columns = ('invoice_date', 'invoice_date_std', 'amount', 'amount_cents',
+               'seller', 'invoice_no', 'current_filename', 'file_path', 'content_hash')
+
+    def candidates(self, table):
+        return None
+
+    def transform(self, row):
+        changes = super().transform(row)
+        amount_cents = parse_amount_cents(row['amount'])
+        if amount_cents != row['amount_cents']:
+            changes['amount_cents'] = amount_cents
+        if row['seller']:
+            filename = invoice_filename(changes.get('invoice_date', row['invoice_date']),
+                                        row['seller'], row['amount'], row['invoice_no'])
+            if filename != row['current_filename']:
+                changes['current_filename'] = filename
+        return changes
+
+    def prepare(self, conn, table, in_chunk):
+        # 尚未存入内容存储的文件在写事务之外复制
+        rows = conn.execute(
+            select(table.c.id, table.c.file_path)
+            .where(in_chunk, table.c.content_hash.is_(None), table.c.file_path.isnot(None))
+        ).all()
+        blob_store = current_app.extensions['blob_store']
+        prepared = {}
+        for invoice_id, file_path in rows:
+            if os.path.exists(file_path):
+                content_hash, blob_path = blob_store.put_file(file_path)
+                prepared[invoice_id] = {'content_hash': content_hash, 'file_path': blob_path}
+        return prepared
+
+TASKS = {task.name: task for task in (NormalizeDatesTask(), RepairDatabaseTask())}
+
+def resumable_run(task_name, user_id=None):
+    """查找可以续跑的运行记录"""
+    return (MaintenanceRun.query
+            .filter(MaintenanceRun.task == task_name, MaintenanceRun.user_id == user_id,
+                    MaintenanceRun.status.in_(['running', 'interrupted', 'error']))
+            .order_by(MaintenanceRun.id.desc())
+            .first())
+
+def run_task(task_name, user_id=None, chunk_size=None, restart=False, job=None, progress=None):
+    """运行维护任务，返回运行记录
+
+    user_id 为 None 时处理所有用户的发票。restart 为 True 时忽略未完成的运行记录从头开始。
+    job 为后台任务时更新其进度并在块之间检查取消；progress(run) 在每块提交后调用。
+    """
+    task = TASKS[task_name]
+    chunk_size = chunk_size or current_app.config.get('MAINTENANCE_CHUNK_SIZE', 1000)
+    table = Invoice.__table__
+    scope = table.c.user_id == user_id if user_id is not None else true()
+
+    run = None if restart else resumable_run(task_name, user_id)
+    if run is None:
+        run = MaintenanceRun(task=task_name, user_id=user_id, status='running',
+                             last_id=0, total=0, processed=0, updated=0)
+        db.session.add(run)
+    else:
+        print(f"{task.description}: 从发票ID {run.last_id} 之后继续")
+    run.status = 'running'
+    run.error = None
+    run.total = run.processed + db.session.execute(
+        select(func.count()).select_from(table).where(scope, table.c.id > run.last_id)
+    ).scalar()
+    db.session.commit()
+
+    columns = list(dict.fromkeys(('id',) + TRACKED_FIELDS + task.columns))
+    row_update = update(table).where(table.c.id == bindparam('row_id'))
+    try:
+        while True:
+            if job:
+                job.check_cancelled()
+            chunk_ids = db.session.execute(
+                select(table.c.id).where(scope, table.c.id > run.last_id)
+                .order_by(table.c.id).limit(chunk_size)
+            ).scalars().all()
+            if not chunk_ids:
+                break
+            in_chunk = and_(scope, table.c.id.between(chunk_ids[0], chunk_ids[-1]))
+            conn = db.session.connection()
+            prepared = task.prepare(conn, table, in_chunk)
+
+            # 同一行可能先被 SQL 转换、再被逐行转换修改，按ID去重统计更新的行数
+            updated_ids = set()
+            for condition, values in task.sql_updates(table):
+                updated_ids.update(conn.execute(select(table.c.id).where(in_chunk, condition)).scalars())
+                conn.execute(update(table).where(in_chunk, condition).values(**values))
+
+            query = select(*[table.c[name] for name in columns]).where(in_chunk)
+            candidates = task.candidates(table)
+            if candidates is not None:
+                query = query.where(candidates)
+            params = []
+            deltas = {}
+            for row in conn.execute(query).mappings():
+                changes = dict(task.transform(row), **prepared.get(row['id'], {}))
+                if not changes:
+                    continue
+                params.append(changes)
+                changes['row_id'] = row['id']
+                updated_ids.add(row['id'])
+                if any(name in changes for name in TRACKED_FIELDS):
+                    add_delta(deltas, row, -1)
+                    add_delta(deltas, {name: changes.get(name, row[name]) for name in TRACKED_FIELDS}, 1)
+
+            # 字段组合不同的修改分组执行，每组一条批量 UPDATE
+            groups = {}
+            for changes in params:
+                groups.setdefault(tuple(sorted(changes)), []).append(changes)
+            for keys, group in groups.items():
+                names = [name for name in keys if name != 'row_id']
+                conn.execute(row_update.values(**{name: bindparam(f'new_{name}') for name in names}),
+                             [dict({f'new_{name}': changes[name] for name in names}, row_id=changes['row_id'])
+                              for changes in group])
+            apply_deltas(conn, deltas)
+
+            run.last_id = chunk_ids[-1]
+            run.processed += len(chunk_ids)
+            run.updated += len(updated_ids)
+            db.session.commit()
+
+            if job:
+                job.status['current'] = run.processed
+                job.status['total'] = run.total
+                job.status['current_file'] = f"已处理到发票ID {run.last_id}"
+            if progress:
+                progress(run)
+
+        run.status = 'complete'
+        run.finished_at = datetime.utcnow()
+        db.session.commit()
+    except BaseException as e:
+        db.session.rollback()
+        run.status = 'interrupted' if isinstance(e, (JobCancelled, KeyboardInterrupt)) else 'error'
+        run.error = str(e)[:500] or None
+        db.session.commit()
+        raise
+    finally:
+        cache = current_app.extensions.get('listing_cache')
+        if cache:
+            cache.invalidate(user_id)
+    return run
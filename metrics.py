@@ -0,0 +1,198 @@
+"""
+进程内运行指标
+
+导入流程各阶段的耗时直方图和计数器，以及每个路由的请求耗时和SQL语句数，以 Prometheus 文本格式
+在 /metrics 输出。不依赖 prometheus_client：每次记录只是在锁内更新几个整数，开销可以忽略。
+
+- 指标只在当前进程内累计，进程重启后清零；imap_idle.py、watch_folder.py、cli.py 等独立进程中
+  发生的导入不会出现在Web服务的 /metrics 中
+- 指标中包含各路由的访问量和导入情况，必须设置 METRICS_TOKEN 才注册 /metrics，请求须带
+  `Authorization: Bearer <METRICS_TOKEN>`；METRICS_ENABLED=false 时同样不注册
+"""
+
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import Response, abort, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# 阶段耗时的桶（秒）：覆盖从毫秒级的数据库写入到数十秒的大模型调用
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 500)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _labels(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """单调递增的计数器"""
+
+    type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f'{self.name}{_labels(self.labelnames, key)} {_number(value)}'
+
+class Histogram:
+    """按固定桶统计的直方图"""
+
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # {标签值: [各桶计数（不累加）..., 超出最大桶的计数, 总和]}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, '') for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            state[index] += 1
+            state[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """记录 with 代码块的耗时（代码块抛出异常时同样记录）"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = sorted((key, list(state)) for key, state in self._values.items())
+        for key, state in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), state[:-1]):
+                cumulative += count
+                le = 'le="+Inf"' if bound == '+Inf' else f'le="{_number(float(bound))}"'
+                yield f'{self.name}_bucket{_labels(self.labelnames, key, le)} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labelnames, key)} {_number(state[-1])}'
+            yield f'{self.name}_count{_labels(self.labelnames, key)} {cumulative}'
+
+STAGE_SECONDS = Histogram(
+    'invoice_stage_duration_seconds',
+    '导入流程各阶段的耗时：imap_connect, imap_search, imap_fetch, pdf_parse, llm_request, dedupe, db_write, zip_build',
+    ['stage'])
+LLM_REQUESTS = Counter('invoice_llm_requests_total', '大模型接口调用次数，status 为 ok 或 error', ['status'])
+LLM_TOKENS = Counter('invoice_llm_tokens_total', '大模型接口返回的 token 用量', ['type'])
+IMAP_MESSAGES = Counter('invoice_imap_messages_fetched_total', '从邮箱下载的邮件数')
+IMAP_BYTES = Counter('invoice_imap_fetched_bytes_total', '从邮箱下载的邮件字节数')
+IMPORT_FILES = Counter('invoice_import_files_total', '导入的文件数，result 为 saved、duplicate 或 failed', ['result'])
+HTTP_SECONDS = Histogram('http_request_duration_seconds', '请求处理耗时（流式响应不含发送时间）',
+                         ['endpoint', 'method', 'status'])
+HTTP_QUERIES = Histogram('http_request_queries', '每个请求执行的SQL语句数', ['endpoint'], buckets=QUERY_BUCKETS)
+
+METRICS = [STAGE_SECONDS, LLM_REQUESTS, LLM_TOKENS, IMAP_MESSAGES, IMAP_BYTES, IMPORT_FILES,
+           HTTP_SECONDS, HTTP_QUERIES]
+
+def stage_timer(stage):
+    """记录导入流程某个阶段的耗时：with stage_timer('pdf_parse'): ..."""
+    return STAGE_SECONDS.time(stage=stage)
+
+def timed_chunks(chunks, stage):
+    """转发生成器的数据，只累计生成数据本身的耗时（不含等待客户端读取的时间）"""
+    elapsed = 0.0
+    iterator = iter(chunks)
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                chunk = next(iterator)
+            except StopIteration:
+                elapsed += time.perf_counter() - started
+                break
+            elapsed += time.perf_counter() - started
+            yield chunk
+    finally:
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+
+def render(metrics=METRICS):
+    """生成 Prometheus 文本格式"""
+    lines = []
+    for metric in metrics:
+        documentation = metric.documentation.replace('\\', '\\\\').replace('\n', '\\n')
+        lines.append(f'# HELP {metric.name} {documentation}')
+        lines.append(f'# TYPE {metric.name} {metric.type}')
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+def _count_query(*_):
+    if has_request_context():
+        g._metrics_queries = g.get('_metrics_queries', 0) + 1
+
+class Metrics:
+    """记录每个请求的耗时和SQL语句数，并注册 /metrics"""
+
+    def __init__(self, app=None):
+        self.app = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('METRICS_ENABLED', True)
+        app.config.setdefault('METRICS_TOKEN', '')
+        app.extensions['metrics'] = self
+        self.app = app
+        if not app.config['METRICS_ENABLED']:
+            return
+        if not app.config['METRICS_TOKEN']:
+            return
+        if not event.contains(Engine, 'before_cursor_execute', _count_query):
+            event.listen(Engine, 'before_cursor_execute', _count_query)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics_view)
+
+    @staticmethod
+    def _start_request():
+        g._metrics_started = time.perf_counter()
+        g._metrics_queries = 0
+
+    @staticmethod
+    def _finish_request(response):
+        started = g.pop('_metrics_started', None)
+        if started is not None and request.endpoint != 'metrics':
+            endpoint = request.endpoint or 'unmatched'  # 不使用URL，避免标签数量无限增长
+            HTTP_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint, method=request.method,
+                                 status=response.status_code)
+            HTTP_QUERIES.observe(g.pop('_metrics_queries', 0), endpoint=endpoint)
+        return response
+
+    def metrics_view(self):
+        token = self.app.config['METRICS_TOKEN']
+        if request.headers.get('Authorization') != f'Bearer {token}':
+            abort(401)
+        return Response(render(), content_type='text/plain; version=0.0.4; charset=utf-8')
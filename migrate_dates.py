@@ -3,218 +3,39 @@
 
 """
 日期格式迁移脚本
-将数据库中的发票日期字段统一转换为标准格式 (YYYY-MM-DD)
+将数据库中的发票日期字段统一转换为标准格式 (YYYY-MM-DD)，同步标准日期字段，并更新文件名
+
+按发票ID分块处理，每块提交一次；中断后再次运行会从上次处理到的位置继续。
+
+用法:
+    python migrate_dates.py [--user-id N] [--chunk-size N] [--restart]
 """
 
-import os
-import re
-from datetime import datetime
-from app import app
-from models import db, Invoice
+import argparse
 
-def convert_date_format(date_str):
-    """
-    将各种格式的日期字符串转换为标准的 YYYY-MM-DD 格式
-    支持的格式:
-    - YYYY年MM月DD日
-    - YYYY-MM-DD
-    - YYYY/MM/DD
-    """
-    if not date_str:
-        return None
-    
-    # 尝试匹配中文日期格式: YYYY年MM月DD日
-    chinese_pattern = r'(\d{4})年(\d{1,2})月(\d{1,2})日'
-    match = re.search(chinese_pattern, date_str)
-    if match:
-        year, month, day = match.groups()
-        return f"{year}-{int(month):02d}-{int(day):02d}"
-    
-    # 尝试匹配标准日期格式: YYYY-MM-DD
-    std_pattern = r'(\d{4})-(\d{1,2})-(\d{1,2})'
-    match = re.search(std_pattern, date_str)
-    if match:
-        year, month, day = match.groups()
-        return f"{year}-{int(month):02d}-{int(day):02d}"
-    
-    # 尝试匹配斜杠日期格式: YYYY/MM/DD
-    slash_pattern = r'(\d{4})/(\d{1,2})/(\d{1,2})'
-    match = re.search(slash_pattern, date_str)
-    if match:
-        year, month, day = match.groups()
-        return f"{year}-{int(month):02d}-{int(day):02d}"
-    
-    # 如果无法识别格式，返回原始字符串
-    print(f"无法识别的日期格式: {date_str}")
-    return date_str
+from app_factory import create_app
+from maintenance import TASKS, run_task
 
-def migrate_invoice_dates():
-    """
-    迁移发票日期字段
-    """
-    print("开始迁移发票日期字段...")
-    
-    with app.app_context():
-        # 获取所有发票记录
-        invoices = Invoice.query.all()
-        print(f"找到 {len(invoices)} 条发票记录")
-        
-        updated_count = 0
-        error_count = 0
-        
-        for invoice in invoices:
-            try:
-                # 获取原始日期字符串
-                original_date = invoice.invoice_date
-                
-                # 转换为标准格式
-                standardized_date = convert_date_format(original_date)
-                
-                # 如果转换成功且格式发生变化，则更新数据库
-                if standardized_date and standardized_date != original_date:
-                    print(f"发票 {invoice.id}: {original_date} -> {standardized_date}")
-                    invoice.invoice_date = standardized_date
-                    updated_count += 1
-            except Exception as e:
-                print(f"处理发票 {invoice.id} 时出错: {str(e)}")
-                error_count += 1
-        
-        # 提交更改
-        if updated_count > 0:
-            db.session.commit()
-            print(f"成功更新 {updated_count} 条记录")
-        
-        if error_count > 0:
-            print(f"处理过程中有 {error_count} 条记录出错")
-        
-        print("日期格式迁移完成")
+def print_progress(run):
+    """打印处理进度"""
+    percent = run.processed * 100 // run.total if run.total else 100
+    print(f"  已处理 {run.processed}/{run.total} ({percent}%)，更新 {run.updated} 条，当前ID {run.last_id}")
 
-def update_filename_with_new_date():
-    """
-    根据新的日期格式更新文件名
-    """
-    print("开始更新发票文件名...")
-    
-    with app.app_context():
-        # 获取所有发票记录
-        invoices = Invoice.query.all()
-        print(f"找到 {len(invoices)} 条发票记录")
-        
-        updated_count = 0
-        error_count = 0
-        
-        for invoice in invoices:
-            try:
-                # 获取当前信息
-                invoice_date = invoice.invoice_date
-                seller = invoice.seller[:20].replace('/', '_').replace('\\', '_')
-                amount = invoice.amount
-                invoice_no = invoice.invoice_no
-                
-                # 构建新文件名
-                new_filename = f"[{invoice_date}-{seller}-{amount}-{invoice_no}].pdf"
-                new_filename = new_filename.replace(':', '_').replace('*', '_').replace('?', '_').replace('"', '_').replace('<', '_').replace('>', '_').replace('|', '_')
-                
-                # 如果文件名发生变化，则更新
-                if new_filename != invoice.current_filename:
-                    print(f"发票 {invoice.id} 文件名更新: {invoice.current_filename} -> {new_filename}")
-                    invoice.current_filename = new_filename
-                    updated_count += 1
-            except Exception as e:
-                print(f"更新发票 {invoice.id} 文件名时出错: {str(e)}")
-                error_count += 1
-        
-        # 提交更改
-        if updated_count > 0:
-            db.session.commit()
-            print(f"成功更新 {updated_count} 条记录的文件名")
-        
-        if error_count > 0:
-            print(f"处理过程中有 {error_count} 条记录出错")
-        
-        print("文件名更新完成")
+def main():
+    parser = argparse.ArgumentParser(description='标准化发票日期并更新文件名')
+    parser.add_argument('--user-id', type=int, default=None, help='只处理指定用户的发票')
+    parser.add_argument('--chunk-size', type=int, default=None, help='每块处理的发票数（默认 MAINTENANCE_CHUNK_SIZE）')
+    parser.add_argument('--restart', action='store_true', help='忽略未完成的进度，从头开始')
+    args = parser.parse_args()
 
-def update_invoice_date_std_field():
-    """
-    更新标准日期字段
-    """
-    print("开始更新标准日期字段...")
-    
+    app = create_app()
     with app.app_context():
-        # 获取所有发票记录
-        invoices = Invoice.query.all()
-        print(f"找到 {len(invoices)} 条发票记录")
-        
-        updated_count = 0
-        error_count = 0
-        
-        for invoice in invoices:
-            try:
-                # 获取原始日期字符串
-                original_date = invoice.invoice_date
-                
-                # 尝试解析不同格式的日期
-                date_obj = None
-                
-                # 尝试匹配中文日期格式: YYYY年MM月DD日
-                chinese_pattern = r'(\d{4})年(\d{1,2})月(\d{1,2})日'
-                match = re.search(chinese_pattern, original_date)
-                if match:
-                    year, month, day = match.groups()
-                    try:
-                        date_obj = datetime(int(year), int(month), int(day)).date()
-                    except ValueError:
-                        pass
-                
-                # 尝试匹配标准日期格式: YYYY-MM-DD
-                if not date_obj:
-                    std_pattern = r'(\d{4})-(\d{1,2})-(\d{1,2})'
-                    match = re.search(std_pattern, original_date)
-                    if match:
-                        year, month, day = match.groups()
-                        try:
-                            date_obj = datetime(int(year), int(month), int(day)).date()
-                        except ValueError:
-                            pass
-                
-                # 尝试匹配斜杠日期格式: YYYY/MM/DD
-                if not date_obj:
-                    slash_pattern = r'(\d{4})/(\d{1,2})/(\d{1,2})'
-                    match = re.search(slash_pattern, original_date)
-                    if match:
-                        year, month, day = match.groups()
-                        try:
-                            date_obj = datetime(int(year), int(month), int(day)).date()
-                        except ValueError:
-                            pass
-                
-                # 更新标准日期字段
-                if date_obj:
-                    print(f"发票 {invoice.id}: {original_date} -> {date_obj}")
-                    invoice.invoice_date_std = date_obj
-                    updated_count += 1
-                else:
-                    print(f"发票 {invoice.id}: 无法解析日期 '{original_date}'")
-                    error_count += 1
-            except Exception as e:
-                print(f"处理发票 {invoice.id} 时出错: {str(e)}")
-                error_count += 1
-        
-        # 提交更改
-        if updated_count > 0:
-            db.session.commit()
-            print(f"成功更新 {updated_count} 条记录的标准日期字段")
-        
-        if error_count > 0:
-            print(f"处理过程中有 {error_count} 条记录出错")
-        
-        print("标准日期字段更新完成")
+        for task_name in ('normalize_dates', 'repair_database'):
+            print(f"=== 开始{TASKS[task_name].description} ===")
+            run = run_task(task_name, user_id=args.user_id, chunk_size=args.chunk_size,
+                           restart=args.restart, progress=print_progress)
+            print(f"{TASKS[task_name].description}完成: 处理 {run.processed} 条记录，更新 {run.updated} 条记录\n")
+    print("迁移完成！")
 
 if __name__ == "__main__":
-    print("=== 开始日期格式迁移 ===")
-    migrate_invoice_dates()
-    print("\n=== 开始更新标准日期字段 ===")
-    update_invoice_date_std_field()
-    print("\n=== 开始更新文件名 ===")
-    update_filename_with_new_date()
-    print("\n迁移完成！") 
\ No newline at end of file
+    main()
@@ -0,0 +1,87 @@
+"""baseline schema
+
+Revision ID: 3f1c2a9d0b11
+Revises: 
+Create Date: 2025-03-14 10:00:00.000000
+
+已有数据库（由 db.create_all() 创建）请先执行 `flask db stamp 3f1c2a9d0b11`，
+再执行 `flask db upgrade`。
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c2a9d0b11'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('user',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('username', sa.String(length=64), nullable=True),
+    sa.Column('email', sa.String(length=120), nullable=True),
+    sa.Column('password_hash', sa.String(length=128), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('last_login', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_user_email'), ['email'], unique=True)
+        batch_op.create_index(batch_op.f('ix_user_username'), ['username'], unique=True)
+
+    op.create_table('email_account',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('email_address', sa.String(length=120), nullable=False),
+    sa.Column('password', sa.String(length=128), nullable=False),
+    sa.Column('description', sa.String(length=200), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('invoice_history',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('email_account_id', sa.Integer(), nullable=True),
+    sa.Column('search_date', sa.Date(), nullable=True),
+    sa.Column('invoice_count', sa.Integer(), nullable=True),
+    sa.Column('zip_filename', sa.String(length=200), nullable=True),
+    sa.Column('processed_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['email_account_id'], ['email_account.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('invoice',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('history_id', sa.Integer(), nullable=True),
+    sa.Column('invoice_no', sa.String(length=50), nullable=False),
+    sa.Column('invoice_date', sa.String(length=20), nullable=True),
+    sa.Column('seller', sa.String(length=200), nullable=True),
+    sa.Column('amount', sa.String(length=20), nullable=True),
+    sa.Column('project_name', sa.String(length=500), nullable=True),
+    sa.Column('original_filename', sa.String(length=200), nullable=True),
+    sa.Column('current_filename', sa.String(length=200), nullable=True),
+    sa.Column('file_path', sa.String(length=500), nullable=True),
+    sa.Column('notes', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['history_id'], ['invoice_history.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('invoice')
+    op.drop_table('invoice_history')
+    op.drop_table('email_account')
+    with op.batch_alter_table('user', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_user_username'))
+        batch_op.drop_index(batch_op.f('ix_user_email'))
+
+    op.drop_table('user')
@@ -0,0 +1,38 @@
+"""email account sync state
+
+Revision ID: 8c4e7b21d5a3
+Revises: 3f1c2a9d0b11
+Create Date: 2025-03-20 09:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4e7b21d5a3'
+down_revision = '3f1c2a9d0b11'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('email_account', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('sync_enabled', sa.Boolean(), nullable=False, server_default=sa.false()))
+        batch_op.add_column(sa.Column('sync_interval', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('last_synced_at', sa.DateTime(), nullable=True))
+        batch_op.add_column(sa.Column('last_sync_uid', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('sync_uidvalidity', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('sync_failures', sa.Integer(), nullable=False, server_default='0'))
+        batch_op.add_column(sa.Column('last_sync_error', sa.String(length=500), nullable=True))
+
+
+def downgrade():
+    with op.batch_alter_table('email_account', schema=None) as batch_op:
+        batch_op.drop_column('last_sync_error')
+        batch_op.drop_column('sync_failures')
+        batch_op.drop_column('sync_uidvalidity')
+        batch_op.drop_column('last_sync_uid')
+        batch_op.drop_column('last_synced_at')
+        batch_op.drop_column('sync_interval')
+        batch_op.drop_column('sync_enabled')
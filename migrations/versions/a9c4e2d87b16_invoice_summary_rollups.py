@@ -0,0 +1,40 @@
+"""invoice summary rollups
+
+Revision ID: a9c4e2d87b16
+Revises: f3a8d6c25e71
+Create Date: 2025-03-31 09:30:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from rollups import rebuild_rollups
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9c4e2d87b16'
+down_revision = 'f3a8d6c25e71'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('invoice_summary',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('month', sa.String(length=7), nullable=False),
+    sa.Column('seller', sa.String(length=200), nullable=False),
+    sa.Column('category', sa.String(length=100), nullable=False),
+    sa.Column('invoice_count', sa.Integer(), nullable=False),
+    sa.Column('amount_cents', sa.BigInteger(), nullable=False),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'month', 'seller', 'category', name='ux_invoice_summary_group')
+    )
+
+    # 由已有发票生成汇总数据
+    rebuild_rollups(conn=op.get_bind())
+
+
+def downgrade():
+    op.drop_table('invoice_summary')
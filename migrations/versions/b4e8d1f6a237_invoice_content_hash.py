@@ -0,0 +1,34 @@
+"""invoice content hash
+
+Revision ID: b4e8d1f6a237
+Revises: c6f2b9a31d48
+Create Date: 2025-04-03 10:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from invoice_search import create_fts
+
+
+# revision identifiers, used by Alembic.
+revision = 'b4e8d1f6a237'
+down_revision = 'c6f2b9a31d48'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('invoice', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('content_hash', sa.String(length=64), nullable=True))
+        batch_op.create_index('ix_invoice_content_hash', ['content_hash'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('invoice', schema=None) as batch_op:
+        batch_op.drop_index('ix_invoice_content_hash')
+        batch_op.drop_column('content_hash')
+    # SQLite 删除列时会重建发票表，需要重新创建全文索引的触发器
+    conn = op.get_bind()
+    if conn.dialect.name == 'sqlite':
+        create_fts(conn)
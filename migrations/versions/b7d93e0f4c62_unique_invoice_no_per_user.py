@@ -0,0 +1,36 @@
+"""unique invoice_no per user
+
+Revision ID: b7d93e0f4c62
+Revises: 8c4e7b21d5a3
+Create Date: 2025-03-24 15:10:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7d93e0f4c62'
+down_revision = '8c4e7b21d5a3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 先合并已有的重复发票：同一用户的同一发票号只保留最早导入的一条
+    op.execute(sa.text(
+        "DELETE FROM invoice "
+        "WHERE invoice_no != '' AND id NOT IN ("
+        "    SELECT MIN(id) FROM invoice WHERE invoice_no != '' GROUP BY user_id, invoice_no"
+        ")"
+    ))
+
+    with op.batch_alter_table('invoice', schema=None) as batch_op:
+        batch_op.create_index('ux_invoice_user_invoice_no', ['user_id', 'invoice_no'], unique=True,
+                              sqlite_where=sa.text("invoice_no != ''"),
+                              postgresql_where=sa.text("invoice_no != ''"))
+
+
+def downgrade():
+    with op.batch_alter_table('invoice', schema=None) as batch_op:
+        batch_op.drop_index('ux_invoice_user_invoice_no')
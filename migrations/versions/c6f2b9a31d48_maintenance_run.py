@@ -0,0 +1,39 @@
+"""maintenance run progress
+
+Revision ID: c6f2b9a31d48
+Revises: a9c4e2d87b16
+Create Date: 2025-04-01 14:15:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6f2b9a31d48'
+down_revision = 'a9c4e2d87b16'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('maintenance_run',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('task', sa.String(length=50), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=True),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('last_id', sa.Integer(), nullable=False),
+    sa.Column('total', sa.Integer(), nullable=False),
+    sa.Column('processed', sa.Integer(), nullable=False),
+    sa.Column('updated', sa.Integer(), nullable=False),
+    sa.Column('error', sa.String(length=500), nullable=True),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+
+
+def downgrade():
+    op.drop_table('maintenance_run')
@@ -0,0 +1,68 @@
+"""typed invoice amount and date
+
+Revision ID: d2a6f81c93b4
+Revises: b7d93e0f4c62
+Create Date: 2025-03-27 11:20:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+from models import parse_amount_cents, parse_invoice_date
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2a6f81c93b4'
+down_revision = 'b7d93e0f4c62'
+branch_labels = None
+depends_on = None
+
+BACKFILL_BATCH_SIZE = 1000
+
+
+def upgrade():
+    with op.batch_alter_table('invoice', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('invoice_date_std', sa.Date(), nullable=True))
+        batch_op.add_column(sa.Column('amount_cents', sa.BigInteger(), nullable=True))
+
+    # 按主键分批从字符串字段回填类型化字段
+    conn = op.get_bind()
+    invoice = sa.table('invoice',
+                       sa.column('id', sa.Integer),
+                       sa.column('invoice_date', sa.String),
+                       sa.column('amount', sa.String),
+                       sa.column('invoice_date_std', sa.Date),
+                       sa.column('amount_cents', sa.BigInteger))
+    update = (invoice.update()
+              .where(invoice.c.id == sa.bindparam('row_id'))
+              .values(invoice_date_std=sa.bindparam('date_value'),
+                      amount_cents=sa.bindparam('cents_value')))
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.select(invoice.c.id, invoice.c.invoice_date, invoice.c.amount)
+            .where(invoice.c.id > last_id)
+            .order_by(invoice.c.id)
+            .limit(BACKFILL_BATCH_SIZE)
+        ).all()
+        if not rows:
+            break
+        conn.execute(update, [
+            {'row_id': row.id,
+             'date_value': parse_invoice_date(row.invoice_date),
+             'cents_value': parse_amount_cents(row.amount)}
+            for row in rows
+        ])
+        last_id = rows[-1].id
+
+    with op.batch_alter_table('invoice', schema=None) as batch_op:
+        batch_op.create_index('ix_invoice_user_date', ['user_id', 'invoice_date_std'], unique=False)
+        batch_op.create_index('ix_invoice_user_amount', ['user_id', 'amount_cents'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('invoice', schema=None) as batch_op:
+        batch_op.drop_index('ix_invoice_user_amount')
+        batch_op.drop_index('ix_invoice_user_date')
+        batch_op.drop_column('amount_cents')
+        batch_op.drop_column('invoice_date_std')
@@ -0,0 +1,32 @@
+"""invoice full-text search
+
+Revision ID: e5b17c4a9f20
+Revises: d2a6f81c93b4
+Create Date: 2025-03-28 10:05:00.000000
+
+"""
+from alembic import op
+
+from invoice_search import create_fts, drop_fts
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b17c4a9f20'
+down_revision = 'd2a6f81c93b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # FTS5 仅 SQLite 支持，其他数据库继续使用 LIKE 查询
+    conn = op.get_bind()
+    if conn.dialect.name != 'sqlite':
+        return
+    create_fts(conn)
+
+
+def downgrade():
+    conn = op.get_bind()
+    if conn.dialect.name != 'sqlite':
+        return
+    drop_fts(conn)
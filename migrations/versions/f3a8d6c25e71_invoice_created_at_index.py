@@ -0,0 +1,25 @@
+"""invoice created_at index
+
+Revision ID: f3a8d6c25e71
+Revises: e5b17c4a9f20
+Create Date: 2025-03-28 16:40:00.000000
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'f3a8d6c25e71'
+down_revision = 'e5b17c4a9f20'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('invoice', schema=None) as batch_op:
+        batch_op.create_index('ix_invoice_user_created', ['user_id', 'created_at'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('invoice', schema=None) as batch_op:
+        batch_op.drop_index('ix_invoice_user_created')
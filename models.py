@@ -1,10 +1,45 @@
+import re
+from datetime import datetime
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy.orm import validates
 from werkzeug.security import generate_password_hash, check_password_hash
-from datetime import datetime
 
 db = SQLAlchemy()
 
+def parse_amount_cents(amount):
+    """将金额字符串（如 "1,234.50"、"¥336.00"）转换为以分为单位的整数，无法解析时返回None"""
+    if amount is None:
+        return None
+    cleaned = re.sub(r'[^\d.\-]', '', str(amount))
+    if not cleaned:
+        return None
+    try:
+        return int((Decimal(cleaned) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+    except (InvalidOperation, ValueError):
+        return None
+
+def parse_invoice_date(date_str):
+    """将 YYYY-MM-DD、YYYY年MM月DD日、YYYY/MM/DD、YYYY.MM.DD 格式的日期字符串转换为date，无法解析时返回None"""
+    if not date_str:
+        return None
+    match = re.search(r'(\d{4})\s*[-/.年]\s*(\d{1,2})\s*[-/.月]\s*(\d{1,2})', str(date_str))
+    if not match:
+        return None
+    try:
+        return datetime(*(int(part) for part in match.groups())).date()
+    except ValueError:
+        return None
+
+def parse_project_category(project_name):
+    """从项目名称中提取税收分类，如 "*运输服务*客运服务费" 提取为 "运输服务"，没有分类时返回空字符串"""
+    if not project_name:
+        return ''
+    match = re.search(r'\*([^*]+)\*', str(project_name))
+    return match.group(1).strip()[:100] if match else ''
+
 class User(UserMixin, db.Model):
     """用户模型"""
     id = db.Column(db.Integer, primary_key=True)
@@ -39,6 +74,15 @@ class EmailAccount(db.Model):
     description = db.Column(db.String(200))
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # 定时同步设置与状态
+    sync_enabled = db.Column(db.Boolean, nullable=False, default=False)
+    sync_interval = db.Column(db.Integer, nullable=True)  # 同步间隔（分钟），为空时使用全局默认值
+    last_synced_at = db.Column(db.DateTime, nullable=True)
+    last_sync_uid = db.Column(db.Integer, nullable=True)  # 上次同步到的最大邮件UID
+    sync_uidvalidity = db.Column(db.Integer, nullable=True)  # 收件箱UIDVALIDITY，变化时需重新同步
+    sync_failures = db.Column(db.Integer, nullable=False, default=0)  # 连续失败次数，用于退避
+    last_sync_error = db.Column(db.String(500), nullable=True)
+    
     def __repr__(self):
         return f'<EmailAccount {self.email_address}>'
 
@@ -59,6 +103,21 @@ class InvoiceHistory(db.Model):
 
 class Invoice(db.Model):
     """发票信息模型"""
+    __table_args__ = (
+        # 同一用户的发票号唯一（空发票号除外），重复检查走索引，并发导入时由数据库保证不重复
+        # 依赖部分索引（WHERE invoice_no != ''），只支持SQLite和PostgreSQL；MySQL没有部分索引，空发票号的发票也会互相冲突
+        db.Index('ux_invoice_user_invoice_no', 'user_id', 'invoice_no', unique=True,
+                 sqlite_where=db.text("invoice_no != ''"),
+                 postgresql_where=db.text("invoice_no != ''")),
+        # 按日期、金额筛选和排序时使用的索引
+        db.Index('ix_invoice_user_date', 'user_id', 'invoice_date_std'),
+        db.Index('ix_invoice_user_amount', 'user_id', 'amount_cents'),
+        # 发票列表默认按创建时间倒序分页
+        db.Index('ix_invoice_user_created', 'user_id', 'created_at'),
+        # 按文件内容去重，删除时检查存储中的文件是否仍被引用
+        db.Index('ix_invoice_content_hash', 'content_hash'),
+    )
+    
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     history_id = db.Column(db.Integer, db.ForeignKey('invoice_history.id'), nullable=True)
@@ -70,10 +129,15 @@ class Invoice(db.Model):
     amount = db.Column(db.String(20), nullable=True)
     project_name = db.Column(db.String(500), nullable=True)
     
+    # 由 invoice_date、amount 解析得到的类型化字段，用于筛选和排序
+    invoice_date_std = db.Column(db.Date, nullable=True)
+    amount_cents = db.Column(db.BigInteger, nullable=True)  # 含税金额，单位：分
+    
     # 文件信息
     original_filename = db.Column(db.String(200), nullable=True)
     current_filename = db.Column(db.String(200), nullable=True)
     file_path = db.Column(db.String(500), nullable=True)
+    content_hash = db.Column(db.String(64), nullable=True)  # 文件内容的SHA-256
     
     # 元数据
     notes = db.Column(db.Text, nullable=True)
@@ -82,5 +146,59 @@ class Invoice(db.Model):
     
     history = db.relationship('InvoiceHistory', backref='invoices')
     
+    @validates('invoice_date')
+    def _sync_invoice_date_std(self, key, value):
+        """修改日期字符串时同步更新标准日期字段"""
+        self.invoice_date_std = parse_invoice_date(value)
+        return value
+    
+    @validates('amount')
+    def _sync_amount_cents(self, key, value):
+        """修改金额字符串时同步更新以分为单位的金额"""
+        self.amount_cents = parse_amount_cents(value)
+        return value
+    
+    def __repr__(self):
+        return f'<Invoice {self.invoice_no}>' 
+
+class InvoiceSummary(db.Model):
+    """发票汇总表：按 用户×月份×开票方×项目分类 汇总发票数量和金额
+
+    由发票的新增、修改、删除增量维护，仪表盘和报表只读取此表。
+    月份格式为YYYY-MM，开票日期无法解析时为空字符串。
+    """
+    __tablename__ = 'invoice_summary'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'month', 'seller', 'category', name='ux_invoice_summary_group'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    month = db.Column(db.String(7), nullable=False, default='')
+    seller = db.Column(db.String(200), nullable=False, default='')
+    category = db.Column(db.String(100), nullable=False, default='')
+    invoice_count = db.Column(db.Integer, nullable=False, default=0)
+    amount_cents = db.Column(db.BigInteger, nullable=False, default=0)
+    
+    def __repr__(self):
+        return f'<InvoiceSummary {self.user_id} {self.month} {self.seller}>'
+
+class MaintenanceRun(db.Model):
+    """数据维护任务的运行记录，用于显示进度和中断后续跑"""
+    __tablename__ = 'maintenance_run'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    task = db.Column(db.String(50), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)  # 为空表示所有用户
+    status = db.Column(db.String(20), nullable=False, default='running')  # running, interrupted, error, complete
+    last_id = db.Column(db.Integer, nullable=False, default=0)  # 已处理到的发票ID
+    total = db.Column(db.Integer, nullable=False, default=0)
+    processed = db.Column(db.Integer, nullable=False, default=0)
+    updated = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.String(500), nullable=True)
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
     def __repr__(self):
-        return f'<Invoice {self.invoice_no}>' 
\ No newline at end of file
+        return f'<MaintenanceRun {self.task} {self.status}>'
@@ -8,13 +8,15 @@
 
 import os
 import sys
-from app import app, db
+from app_factory import create_app
+from models import db
 from models import User, EmailAccount, InvoiceHistory, Invoice
 
 def reset_database():
     """
     删除现有数据库并重新创建
     """
+    app = create_app()
     with app.app_context():
         # 获取数据库URI
         db_uri = app.config['SQLALCHEMY_DATABASE_URI']
@@ -0,0 +1,191 @@
+"""发票汇总表（invoice_summary）的增量维护与查询
+
+- 通过 ORM 新增、修改、删除发票时，before_flush 事件在同一事务内把增量写入汇总表
+- 绕过 ORM 的批量插入（INSERT ... ON CONFLICT DO NOTHING）由调用方调用 apply_invoice_records
+- 汇总表与发票表不一致时（如直接修改数据库后），用 `flask rebuild-rollups` 重建
+
+仪表盘和报表只读取汇总表，查询代价与分组数成正比，与发票数量无关。
+"""
+
+import click
+from sqlalchemy import delete, event, func, inspect, select, update
+
+from models import db, Invoice, InvoiceSummary, parse_project_category
+
+# 影响汇总分组或金额的发票字段
+TRACKED_FIELDS = ('user_id', 'invoice_date_std', 'seller', 'project_name', 'amount_cents')
+
+_registered = False
+
+def summary_key(user_id, invoice_date_std, seller, project_name):
+    """计算发票所属的汇总分组 (用户, 月份, 开票方, 项目分类)"""
+    month = invoice_date_std.strftime('%Y-%m') if invoice_date_std else ''
+    return (user_id, month, (seller or '')[:200], parse_project_category(project_name))
+
+def add_delta(deltas, values, sign=1):
+    """把一张发票计入（sign=1）或移出（sign=-1）汇总增量"""
+    key = summary_key(values['user_id'], values['invoice_date_std'], values['seller'], values['project_name'])
+    count, cents = deltas.get(key, (0, 0))
+    deltas[key] = (count + sign, cents + sign * (values['amount_cents'] or 0))
+
+def summary_upsert(conn):
+    """构建汇总表的累加写入语句，分组已存在时在原值上累加"""
+    table = InvoiceSummary.__table__
+    dialect = conn.dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        if dialect == 'sqlite':
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(table)
+        return stmt.on_conflict_do_update(
+            index_elements=['user_id', 'month', 'seller', 'category'],
+            set_={'invoice_count': table.c.invoice_count + stmt.excluded.invoice_count,
+                  'amount_cents': table.c.amount_cents + stmt.excluded.amount_cents}
+        )
+    if dialect == 'mysql':
+        from sqlalchemy.dialects.mysql import insert as dialect_insert
+        stmt = dialect_insert(table)
+        return stmt.on_duplicate_key_update(
+            invoice_count=table.c.invoice_count + stmt.inserted.invoice_count,
+            amount_cents=table.c.amount_cents + stmt.inserted.amount_cents
+        )
+    return None
+
+def apply_deltas(conn, deltas):
+    """在调用方的事务中把汇总增量写入汇总表，并删除已经没有发票的分组"""
+    rows = [
+        {'user_id': user_id, 'month': month, 'seller': seller, 'category': category,
+         'invoice_count': count, 'amount_cents': cents}
+        for (user_id, month, seller, category), (count, cents) in deltas.items()
+        if count or cents
+    ]
+    if not rows:
+        return
+    table = InvoiceSummary.__table__
+    stmt = summary_upsert(conn)
+    if stmt is not None:
+        conn.execute(stmt, rows)
+    else:
+        # 不支持 upsert 的数据库：先尝试累加，分组不存在时再插入
+        for row in rows:
+            result = conn.execute(
+                update(table)
+                .where(table.c.user_id == row['user_id'], table.c.month == row['month'],
+                       table.c.seller == row['seller'], table.c.category == row['category'])
+                .values(invoice_count=table.c.invoice_count + row['invoice_count'],
+                        amount_cents=table.c.amount_cents + row['amount_cents'])
+            )
+            if not result.rowcount:
+                conn.execute(table.insert(), row)
+    conn.execute(delete(table).where(
+        table.c.user_id.in_({row['user_id'] for row in rows}),
+        table.c.invoice_count <= 0
+    ))
+
+def apply_invoice_records(conn, records, sign=1):
+    """把一批发票记录（invoice_record 生成的字典）计入汇总表"""
+    deltas = {}
+    for record in records:
+        add_delta(deltas, record, sign)
+    apply_deltas(conn, deltas)
+
+def _track_invoice_changes(session, flush_context, instances):
+    """before_flush：根据待写入的发票变更计算汇总增量"""
+    new = [obj for obj in session.new if isinstance(obj, Invoice)]
+    deleted = [obj for obj in session.deleted if isinstance(obj, Invoice) and obj.id is not None]
+    changed = [
+        obj for obj in session.dirty
+        if isinstance(obj, Invoice) and obj.id is not None and session.is_modified(obj)
+        and any(inspect(obj).attrs[name].history.has_changes() for name in TRACKED_FIELDS)
+    ]
+    if not (new or deleted or changed):
+        return
+
+    deltas = {}
+    conn = session.connection()
+    old_ids = [obj.id for obj in deleted + changed]
+    if old_ids:
+        # flush 之前数据库中仍是修改前的值
+        columns = [getattr(Invoice, name) for name in TRACKED_FIELDS]
+        for row in conn.execute(select(*columns).where(Invoice.id.in_(old_ids))):
+            add_delta(deltas, row._mapping, -1)
+    for obj in new + changed:
+        add_delta(deltas, {name: getattr(obj, name) for name in TRACKED_FIELDS}, 1)
+    apply_deltas(conn, deltas)
+
+def rebuild_rollups(user_id=None, conn=None):
+    """按发票表重建汇总表，user_id 为 None 时重建所有用户，返回分组数
+
+    未指定 conn 时使用 db.session 并提交事务；指定 conn（如迁移脚本中）时由调用方管理事务。
+    """
+    # 先在数据库中按天和项目名称聚合，再在Python中归并到月份和项目分类
+    invoice = Invoice.__table__
+    query = (select(invoice.c.user_id, invoice.c.invoice_date_std, invoice.c.seller, invoice.c.project_name,
+                    func.count(invoice.c.id).label('invoice_count'),
+                    func.coalesce(func.sum(invoice.c.amount_cents), 0).label('amount_cents'))
+             .group_by(invoice.c.user_id, invoice.c.invoice_date_std, invoice.c.seller, invoice.c.project_name))
+    if user_id is not None:
+        query = query.where(invoice.c.user_id == user_id)
+
+    use_session = conn is None
+    if use_session:
+        conn = db.session.connection()
+    deltas = {}
+    for row in conn.execute(query.execution_options(yield_per=5000)):
+        key = summary_key(row.user_id, row.invoice_date_std, row.seller, row.project_name)
+        count, cents = deltas.get(key, (0, 0))
+        deltas[key] = (count + row.invoice_count, cents + row.amount_cents)
+
+    clear = delete(InvoiceSummary.__table__)
+    if user_id is not None:
+        clear = clear.where(InvoiceSummary.__table__.c.user_id == user_id)
+    conn.execute(clear)
+    apply_deltas(conn, deltas)
+    if use_session:
+        db.session.commit()
+    return len(deltas)
+
+def summary_totals(user_id, month_prefix=None):
+    """汇总发票数量和金额（分），month_prefix 为 YYYY 或 YYYY-MM 时只统计该年/月"""
+    query = select(func.coalesce(func.sum(InvoiceSummary.invoice_count), 0),
+                   func.coalesce(func.sum(InvoiceSummary.amount_cents), 0)).where(InvoiceSummary.user_id == user_id)
+    if month_prefix:
+        query = query.where(InvoiceSummary.month.like(f'{month_prefix}%'))
+    count, cents = db.session.execute(query).one()
+    return int(count), int(cents)
+
+def summary_by(user_id, field, year=None, order_by_amount=True, limit=None):
+    """按月份、开票方或项目分类汇总，返回 [(分组值, 数量, 金额分)]"""
+    column = getattr(InvoiceSummary, field)
+    total_cents = func.sum(InvoiceSummary.amount_cents)
+    query = (select(column, func.sum(InvoiceSummary.invoice_count), total_cents)
+             .where(InvoiceSummary.user_id == user_id)
+             .group_by(column))
+    if year:
+        query = query.where(InvoiceSummary.month.like(f'{year}-%'))
+    query = query.order_by(total_cents.desc() if order_by_amount else column.desc())
+    if limit:
+        query = query.limit(limit)
+    return [(value, int(count), int(cents)) for value, count, cents in db.session.execute(query)]
+
+def summary_years(user_id):
+    """有发票的年份列表（倒序）"""
+    year = func.substr(InvoiceSummary.month, 1, 4)
+    query = (select(year).where(InvoiceSummary.user_id == user_id, InvoiceSummary.month != '')
+             .group_by(year).order_by(year.desc()))
+    return [row[0] for row in db.session.execute(query)]
+
+def init_rollups(app):
+    """注册汇总表的增量维护事件和 rebuild-rollups 命令"""
+    global _registered
+    if not _registered:
+        event.listen(db.session, 'before_flush', _track_invoice_changes)
+        _registered = True
+
+    @app.cli.command('rebuild-rollups')
+    @click.option('--user-id', type=int, default=None, help='只重建指定用户的汇总')
+    def rebuild_rollups_command(user_id):
+        """按发票表重建发票汇总表"""
+        groups = rebuild_rollups(user_id)
+        click.echo(f'发票汇总表已重建，共 {groups} 个分组')
@@ -0,0 +1,253 @@
+"""发票文件的孤儿文件清理与存储用量统计
+
+- 扫描 downloads/、uploads/、store/ 以及 static/user_N/ 中的文件，与 Invoice.file_path、
+  InvoiceHistory.zip_filename 中的引用比对，删除没有被引用的文件
+- 分块上传的暂存目录（UPLOAD_STAGING_DIR）不扫描，未完成的上传由 chunked_upload.py 按 UPLOAD_EXPIRE_HOURS 清理
+- 修改时间在 STORAGE_GC_GRACE_HOURS 之内的文件不删除（可能属于正在进行的导入），
+  内容存储复用已有文件时会更新其修改时间
+- 每次最多检查 STORAGE_GC_BATCH 个文件，按路径顺序从上次结束的位置继续，一轮扫描完后从头开始；
+  扫描位置只保存在进程内，重启后从头开始
+"""
+
+import os
+import threading
+import time
+from itertools import islice
+
+import click
+from sqlalchemy import func, select
+
+from models import db, Invoice, InvoiceHistory
+
+def path_key(path):
+    """规范化的路径分量元组，用于比较扫描顺序"""
+    return tuple(os.path.normpath(path).split(os.sep))
+
+class StorageGC:
+    """孤儿文件清理（命令行 `flask storage-gc`，或由后台线程定时执行）"""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.cursor = None
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('STORAGE_GC_DIRS', 'downloads,uploads,store,static')
+        app.config.setdefault('STORAGE_GC_GRACE_HOURS', 24)
+        app.config.setdefault('STORAGE_GC_BATCH', 2000)
+        app.config.setdefault('STORAGE_GC_INTERVAL_MINUTES', 60)
+        app.extensions['storage_gc'] = self
+        self.app = app
+        self._register_commands(app)
+
+    def roots(self):
+        """要扫描的目录；static 中只扫描各用户的目录"""
+        roots = []
+        for name in self.app.config['STORAGE_GC_DIRS'].split(','):
+            name = name.strip()
+            if not name or not os.path.isdir(name):
+                continue
+            if os.path.normpath(name) == 'static':
+                roots.extend(entry.path for entry in os.scandir(name)
+                             if entry.is_dir() and entry.name.startswith('user_'))
+            else:
+                roots.append(name)
+        return sorted(roots, key=path_key)
+
+    def _excluded(self, path):
+        """是否为不扫描的目录（分块上传的暂存目录）"""
+        staging = self.app.config.get('UPLOAD_STAGING_DIR')
+        return bool(staging) and os.path.abspath(path) == os.path.abspath(staging)
+
+    def _walk(self, directory, cursor):
+        """按路径顺序遍历目录下的文件，跳过不在 cursor 之后的部分"""
+        if self._excluded(directory):
+            return
+        try:
+            entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+        except (FileNotFoundError, NotADirectoryError):
+            return
+        for entry in entries:
+            key = path_key(entry.path)
+            if cursor and key < cursor[:len(key)]:
+                continue
+            if entry.is_dir(follow_symlinks=False):
+                yield from self._walk(entry.path, cursor)
+            elif entry.is_file(follow_symlinks=False):
+                if cursor and key <= cursor:
+                    continue
+                yield entry
+
+    def _files(self, cursor):
+        for root in self.roots():
+            key = path_key(root)
+            if cursor and key < cursor[:len(key)]:
+                continue
+            yield from self._walk(root, cursor)
+
+    def _referenced(self, paths):
+        """返回 paths 中仍被发票或处理历史引用的路径"""
+        paths = list(paths)
+        referenced = set()
+        chunk_size = 500
+        for i in range(0, len(paths), chunk_size):
+            chunk = paths[i:i + chunk_size]
+            variants = {}
+            for path in chunk:
+                variants[path] = path
+                variants[os.path.abspath(path)] = path
+            rows = db.session.execute(
+                select(Invoice.file_path).where(Invoice.file_path.in_(list(variants))).distinct()
+            ).scalars()
+            referenced.update(variants[row] for row in rows)
+
+            zips = {}
+            for path in chunk:
+                parts = path_key(path)
+                if len(parts) == 3 and parts[0] == 'static' and parts[1].startswith('user_'):
+                    zips.setdefault(parts[2], []).append((parts[1][len('user_'):], path))
+            if zips:
+                rows = db.session.execute(
+                    select(InvoiceHistory.user_id, InvoiceHistory.zip_filename)
+                    .where(InvoiceHistory.zip_filename.in_(list(zips)))
+                )
+                for user_id, zip_filename in rows:
+                    for owner, path in zips.get(zip_filename, []):
+                        if owner == str(user_id):
+                            referenced.add(path)
+        return referenced
+
+    def run_pass(self, max_files=None, dry_run=False):
+        """执行一次清理，返回统计信息；max_files 为 0 时扫描全部文件"""
+        with self._lock:
+            if max_files is None:
+                max_files = self.app.config['STORAGE_GC_BATCH']
+            grace_seconds = self.app.config['STORAGE_GC_GRACE_HOURS'] * 3600
+            cutoff = time.time() - grace_seconds
+            entries = self._files(self.cursor)
+            batch = list(islice(entries, max_files)) if max_files else list(entries)
+            complete = not max_files or len(batch) < max_files
+
+            stats = {'scanned': len(batch), 'recent': 0, 'deleted': 0, 'freed_bytes': 0,
+                     'complete': complete, 'dry_run': dry_run}
+            candidates = {}
+            for entry in batch:
+                try:
+                    stat = entry.stat(follow_symlinks=False)
+                except FileNotFoundError:
+                    continue
+                if stat.st_mtime > cutoff:
+                    stats['recent'] += 1
+                    continue
+                candidates[os.path.normpath(entry.path)] = stat.st_size
+
+            referenced = self._referenced(candidates)
+            roots = {os.path.normpath(root) for root in self.roots()}
+            for path, size in candidates.items():
+                if path in referenced:
+                    continue
+                if not dry_run:
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        continue
+                    except OSError as e:
+                        print(f"删除孤儿文件 {path} 时出错: {e}")
+                        continue
+                    self._remove_empty_parents(path, roots)
+                stats['deleted'] += 1
+                stats['freed_bytes'] += size
+
+            # 本轮扫描完毕后下次从头开始
+            self.cursor = None if complete else path_key(batch[-1].path)
+            return stats
+
+    @staticmethod
+    def _remove_empty_parents(path, roots):
+        directory = os.path.dirname(path)
+        while directory and directory not in roots and os.path.dirname(directory) != directory:
+            try:
+                os.rmdir(directory)
+            except OSError:
+                break
+            directory = os.path.dirname(directory)
+
+    def start(self):
+        """启动定时清理线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._loop, name='storage-gc', daemon=True)
+        self._thread.start()
+        print(f"孤儿文件清理已启动: 间隔 {self.app.config['STORAGE_GC_INTERVAL_MINUTES']} 分钟, "
+              f"每次最多检查 {self.app.config['STORAGE_GC_BATCH']} 个文件")
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+
+    def _loop(self):
+        while not self._stop_event.wait(self.app.config['STORAGE_GC_INTERVAL_MINUTES'] * 60):
+            try:
+                with self.app.app_context():
+                    stats = self.run_pass()
+                if stats['deleted']:
+                    print(f"孤儿文件清理: 检查 {stats['scanned']} 个文件，删除 {stats['deleted']} 个，"
+                          f"释放 {stats['freed_bytes'] / 1024 / 1024:.1f} MB")
+            except Exception as e:
+                print(f"孤儿文件清理出错: {e}")
+
+    def _register_commands(self, app):
+        @app.cli.command('storage-gc')
+        @click.option('--dry-run', is_flag=True, help='只统计，不删除文件')
+        @click.option('--max-files', type=int, default=0, help='本次最多检查的文件数（默认扫描全部）')
+        def storage_gc_command(dry_run, max_files):
+            """删除没有被发票或处理历史引用的文件"""
+            stats = self.run_pass(max_files=max_files, dry_run=dry_run)
+            action = '可删除' if dry_run else '删除'
+            click.echo(f"检查 {stats['scanned']} 个文件，{action} {stats['deleted']} 个孤儿文件，"
+                       f"共 {stats['freed_bytes'] / 1024 / 1024:.1f} MB；"
+                       f"{stats['recent']} 个文件在保留期内未处理")
+
+        @app.cli.command('storage-usage')
+        def storage_usage_command():
+            """统计每个用户的发票文件占用空间"""
+            click.echo(f"{'用户ID':>8} {'发票数':>8} {'文件数':>8} {'缺失':>6} {'占用(MB)':>10}")
+            for user_id, usage in sorted(storage_usage().items()):
+                click.echo(f"{user_id:>8} {usage['invoices']:>8} {usage['files']:>8} "
+                           f"{usage['missing']:>6} {usage['bytes'] / 1024 / 1024:>10.1f}")
+
+def storage_usage(user_id=None):
+    """按用户统计发票文件和历史ZIP的占用空间
+
+    内容存储中被多个用户共用的文件计入每个引用它的用户，同一用户重复引用只计一次。
+    返回 {用户ID: {'invoices': 发票数, 'files': 文件数, 'missing': 缺失文件数, 'bytes': 字节数}}
+    """
+    query = select(Invoice.user_id, Invoice.file_path, func.count(Invoice.id)).group_by(Invoice.user_id, Invoice.file_path)
+    zip_query = select(InvoiceHistory.user_id, InvoiceHistory.zip_filename).where(InvoiceHistory.zip_filename.isnot(None))
+    if user_id is not None:
+        query = query.where(Invoice.user_id == user_id)
+        zip_query = zip_query.where(InvoiceHistory.user_id == user_id)
+
+    usage = {}
+    def add(owner, path, invoices=0):
+        entry = usage.setdefault(owner, {'invoices': 0, 'files': 0, 'missing': 0, 'bytes': 0})
+        entry['invoices'] += invoices
+        if not path:
+            return
+        try:
+            entry['bytes'] += os.path.getsize(path)
+            entry['files'] += 1
+        except OSError:
+            entry['missing'] += 1
+
+    for owner, path, count in db.session.execute(query.execution_options(yield_per=5000)):
+        add(owner, path, count)
+    for owner, zip_filename in db.session.execute(zip_query):
+        add(owner, os.path.join('static', f'user_{owner}', zip_filename))
+    return usage
@@ -0,0 +1,233 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from models import db, EmailAccount
+
+try:
+    import fcntl
+except ImportError:  # Windows 没有 fcntl，只能在进程内互斥
+    fcntl = None
+
+class AccountLock:
+    """邮箱账号的同步锁
+
+    进程内用线程锁互斥；进程之间（定时同步、imap_idle.py、cli.py）用锁目录中每个账号一个文件的
+    fcntl 文件锁互斥，进程退出时文件锁自动释放。接口与 threading.Lock 相同，可以在其他线程中释放。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = None
+
+    def acquire(self, blocking=True):
+        if not self._lock.acquire(blocking):
+            return False
+        if fcntl is None:
+            return True
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            lock_file = open(self.path, 'a')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BaseException:
+                lock_file.close()
+                raise
+        except BlockingIOError:
+            # 其他进程正在同步该账号
+            self._lock.release()
+            return False
+        except BaseException:
+            self._lock.release()
+            raise
+        self._file = lock_file
+        return True
+
+    def release(self):
+        lock_file, self._file = self._file, None
+        if lock_file is not None:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+class SyncScheduler:
+    """按邮箱账号定时执行增量同步的后台调度器
+
+    - 每个账号按各自的间隔（或全局默认间隔）运行，并叠加随机抖动，避免所有账号同时同步
+    - 每个账号持有一把锁（跨进程有效），同一账号的同步不会重叠执行，包括 imap_idle.py 和 cli.py 中的同步
+    - 连续失败时按指数退避延长下次同步时间
+    - 以 gunicorn 或 flask run 部署时Web进程不会启动调度，单独运行 python sync_scheduler.py
+    """
+
+    def __init__(self, app=None, sync_func=None):
+        self.app = None
+        self.sync_func = sync_func
+        self._locks = {}
+        self._locks_guard = threading.Lock()
+        self._next_run = {}
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._executor = None
+        if app is not None:
+            self.init_app(app, sync_func)
+
+    def init_app(self, app, sync_func=None):
+        """绑定Flask应用与同步函数"""
+        self.app = app
+        if sync_func is not None:
+            self.sync_func = sync_func
+        app.config.setdefault('SYNC_INTERVAL_MINUTES', 60)
+        app.config.setdefault('SYNC_JITTER_RATIO', 0.1)
+        app.config.setdefault('SYNC_MAX_BACKOFF_MINUTES', 24 * 60)
+        app.config.setdefault('SYNC_WORKERS', 2)
+        app.config.setdefault('SYNC_TICK_SECONDS', 30)
+        app.config.setdefault('SYNC_LOCK_DIR', 'locks')
+        app.extensions['sync_scheduler'] = self
+
+    def account_lock(self, account_id):
+        """获取指定邮箱账号的锁（不存在时创建）"""
+        with self._locks_guard:
+            lock = self._locks.get(account_id)
+            if lock is None:
+                lock = AccountLock(os.path.join(self.app.config['SYNC_LOCK_DIR'], f'email_account_{account_id}.lock'))
+                self._locks[account_id] = lock
+            return lock
+
+    def start(self):
+        """启动调度线程"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.app.config['SYNC_WORKERS'],
+            thread_name_prefix='email-sync'
+        )
+        self._thread = threading.Thread(target=self._loop, name='sync-scheduler', daemon=True)
+        self._thread.start()
+        print(f"定时同步已启动: 默认间隔 {self.app.config['SYNC_INTERVAL_MINUTES']} 分钟, "
+              f"并发数 {self.app.config['SYNC_WORKERS']}")
+
+    def run_forever(self):
+        """作为独立守护进程运行调度，直到收到中断信号"""
+        self.start()
+        try:
+            while not self._stop_event.wait(1):
+                pass
+        except KeyboardInterrupt:
+            print("收到中断信号，正在停止...")
+        finally:
+            self.stop()
+
+    def stop(self, wait=True):
+        """停止调度线程"""
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        if self._executor:
+            self._executor.shutdown(wait=wait)
+
+    def compute_delay(self, interval_minutes, failures=0):
+        """计算下次同步前的等待秒数（含指数退避与随机抖动）"""
+        base = interval_minutes * 60
+        if failures:
+            max_backoff = self.app.config['SYNC_MAX_BACKOFF_MINUTES'] * 60
+            base = min(base * (2 ** failures), max(max_backoff, base))
+        jitter = base * self.app.config['SYNC_JITTER_RATIO']
+        return max(1.0, base + random.uniform(-jitter, jitter))
+
+    def _loop(self):
+        while not self._stop_event.is_set():
+            try:
+                self.run_pending()
+            except Exception as e:
+                print(f"定时同步调度出错: {e}")
+            self._stop_event.wait(self.app.config['SYNC_TICK_SECONDS'])
+
+    def run_pending(self):
+        """检查所有开启同步的账号，提交到期的同步任务"""
+        default_interval = self.app.config['SYNC_INTERVAL_MINUTES']
+        with self.app.app_context():
+            accounts = [
+                (account.id, account.sync_interval or default_interval,
+                 account.sync_failures or 0, account.last_synced_at)
+                for account in EmailAccount.query.filter_by(sync_enabled=True).all()
+            ]
+
+        now = time.time()
+        active_ids = set()
+        for account_id, interval, failures, last_synced_at in accounts:
+            active_ids.add(account_id)
+            next_run = self._next_run.get(account_id)
+            if next_run is None:
+                next_run = self._initial_run_time(now, interval, failures, last_synced_at)
+                self._next_run[account_id] = next_run
+            if now < next_run:
+                continue
+
+            lock = self.account_lock(account_id)
+            if not lock.acquire(blocking=False):
+                # 上一次同步仍在进行
+                continue
+            # 先占位，避免在本次同步结束前被重复提交
+            self._next_run[account_id] = float('inf')
+            self._executor.submit(self._run_account, account_id, interval, failures, lock)
+
+        # 清理已关闭同步或已删除的账号
+        for account_id in list(self._next_run):
+            if account_id not in active_ids:
+                self._next_run.pop(account_id, None)
+
+    def _initial_run_time(self, now, interval, failures, last_synced_at):
+        """计算账号首次被调度的时间，把各账号的同步均匀分散在一个间隔内"""
+        if last_synced_at:
+            elapsed = (datetime.utcnow() - last_synced_at).total_seconds()
+            return now + max(0.0, self.compute_delay(interval, failures) - elapsed)
+        return now + random.uniform(0, interval * 60)
+
+    def _run_account(self, account_id, interval, failures, lock):
+        """执行单个账号的同步，并记录结果"""
+        try:
+            started = time.time()
+            self.sync_func(account_id)
+            failures = 0
+            self._record_result(account_id, None)
+            print(f"邮箱账号 {account_id} 同步完成，用时 {time.time() - started:.2f} 秒")
+        except Exception as e:
+            failures += 1
+            self._record_result(account_id, str(e))
+            print(f"邮箱账号 {account_id} 同步失败（连续 {failures} 次）: {e}")
+        finally:
+            self._next_run[account_id] = time.time() + self.compute_delay(interval, failures)
+            lock.release()
+
+    def _record_result(self, account_id, error):
+        """保存同步失败次数与错误信息"""
+        try:
+            with self.app.app_context():
+                account = db.session.get(EmailAccount, account_id)
+                if not account:
+                    return
+                if error is None:
+                    account.sync_failures = 0
+                    account.last_sync_error = None
+                else:
+                    account.sync_failures = (account.sync_failures or 0) + 1
+                    account.last_sync_error = error[:500]
+                db.session.commit()
+        except Exception as e:
+            print(f"保存同步状态时出错: {e}")
+
+if __name__ == '__main__':
+    from app import sync_scheduler
+    sync_scheduler.run_forever()
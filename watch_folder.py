@@ -0,0 +1,297 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+监控目录导入守护进程
+监控扫描仪或共享盘写入PDF的目录，文件写完（大小和修改时间不再变化）后按目录所属用户导入，
+提取与保存流程与邮箱导入相同。
+
+用法:
+    WATCH_DIRS="/srv/scans/zhang=zhang,/srv/scans/li=li" python watch_folder.py
+
+- Linux 上使用 inotify 接收文件写入通知，其他系统或 WATCH_MODE=poll 时定期扫描目录；
+  网络共享目录上 inotify 收不到其他机器写入的通知，使用 inotify 时也会每 WATCH_RESCAN_SECONDS 秒补扫一次
+- 待导入文件放入长度为 WATCH_QUEUE_SIZE 的有界队列，队列满时暂停入队，文件留在目录中稍后再处理
+- 同一目录的文件每 WATCH_BATCH_SIZE 个（或等待 WATCH_BATCH_WAIT_SECONDS 秒后）作为一次导入提交，
+  生成一条处理历史并批量写入数据库
+- 导入成功的文件移入内容存储；内容重复的文件直接删除；无法识别的文件移到目录下的 failed/ 子目录
+"""
+
+import ctypes
+import ctypes.util
+import os
+import queue
+import select
+import struct
+import sys
+import threading
+import time
+
+from models import db, User
+
+# inotify 事件（见 inotify(7)）
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_Q_OVERFLOW = 0x00004000
+EVENT_HEADER = struct.Struct('iIII')
+
+FAILED_DIR = 'failed'
+
+class Inotify:
+    """通过 libc 调用 inotify，只监控目录中写完和移入的文件"""
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 失败')
+        self.watches = {}
+
+    def add_watch(self, directory):
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(directory), IN_CLOSE_WRITE | IN_MOVED_TO)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'无法监控目录 {directory}')
+        self.watches[wd] = directory
+
+    def read(self, timeout):
+        """等待事件，返回 (文件路径列表, 是否发生事件队列溢出)"""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return [], False
+        try:
+            data = os.read(self.fd, 64 * 1024)
+        except BlockingIOError:
+            return [], False
+        paths = []
+        overflow = False
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+            offset += EVENT_HEADER.size + length
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+            elif name and wd in self.watches:
+                paths.append(os.path.join(self.watches[wd], os.fsdecode(name)))
+        return paths, overflow
+
+    def close(self):
+        os.close(self.fd)
+
+def parse_watch_dirs(value):
+    """解析 WATCH_DIRS（`目录=用户名` 以逗号分隔），返回 [(目录, 用户名)]"""
+    entries = []
+    for item in (value or '').split(','):
+        directory, sep, owner = item.strip().rpartition('=')
+        if not sep or not directory.strip() or not owner.strip():
+            if item.strip():
+                print(f"忽略格式错误的监控目录配置: {item.strip()}")
+            continue
+        entries.append((os.path.normpath(directory.strip()), owner.strip()))
+    return entries
+
+class WatchFolder:
+    """监控目录并把写完的PDF交给导入函数处理
+
+    ingest_func(user_id, file_paths) 按 import_invoice_files 的格式返回导入结果。
+    """
+
+    def __init__(self, app=None, ingest_func=None):
+        self.app = None
+        self.ingest_func = ingest_func
+        self.owners = {}
+        self._queue = None
+        self._candidates = {}
+        self._queued = set()
+        self._queued_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        if app is not None:
+            self.init_app(app, ingest_func)
+
+    def init_app(self, app, ingest_func=None):
+        """绑定Flask应用与导入函数"""
+        self.app = app
+        if ingest_func is not None:
+            self.ingest_func = ingest_func
+        app.config.setdefault('WATCH_DIRS', '')
+        app.config.setdefault('WATCH_MODE', 'auto')
+        app.config.setdefault('WATCH_SETTLE_SECONDS', 5)
+        app.config.setdefault('WATCH_POLL_SECONDS', 2)
+        app.config.setdefault('WATCH_RESCAN_SECONDS', 60)
+        app.config.setdefault('WATCH_QUEUE_SIZE', 200)
+        app.config.setdefault('WATCH_BATCH_SIZE', 50)
+        app.config.setdefault('WATCH_BATCH_WAIT_SECONDS', 10)
+        app.config.setdefault('WATCH_WORKERS', 1)
+        app.extensions['watch_folder'] = self
+
+    def resolve_owners(self):
+        """把配置中的用户名（或用户ID）解析为用户ID，返回 {目录: 用户ID}"""
+        owners = {}
+        with self.app.app_context():
+            for directory, owner in parse_watch_dirs(self.app.config['WATCH_DIRS']):
+                user = User.query.filter_by(username=owner).first()
+                if not user and owner.isdigit():
+                    user = db.session.get(User, int(owner))
+                if not user:
+                    print(f"监控目录 {directory} 的用户 {owner} 不存在，已跳过")
+                    continue
+                if not os.path.isdir(directory):
+                    print(f"监控目录 {directory} 不存在，已跳过")
+                    continue
+                owners[directory] = user.id
+        return owners
+
+    def run_forever(self):
+        """启动导入线程并持续监控目录"""
+        self._stop_event.clear()
+        self.owners = self.resolve_owners()
+        if not self.owners:
+            print("没有可监控的目录，请通过 WATCH_DIRS 配置（格式: 目录=用户名,目录=用户名）")
+            return
+        self._queue = queue.Queue(maxsize=self.app.config['WATCH_QUEUE_SIZE'])
+        for i in range(self.app.config['WATCH_WORKERS']):
+            threading.Thread(target=self._ingest_loop, name=f'watch-ingest-{i}', daemon=True).start()
+
+        inotify = self._open_inotify()
+        print(f"目录监控已启动（{'inotify' if inotify else '定期扫描'}）: {', '.join(self.owners)}")
+        poll_seconds = self.app.config['WATCH_POLL_SECONDS']
+        last_scan = 0
+        try:
+            while not self._stop_event.is_set():
+                rescan = time.monotonic() - last_scan >= self.app.config['WATCH_RESCAN_SECONDS']
+                if inotify:
+                    paths, overflow = inotify.read(poll_seconds)
+                    for path in paths:
+                        self._add_candidate(path)
+                    rescan = rescan or overflow
+                else:
+                    self._stop_event.wait(poll_seconds)
+                    rescan = True
+                if rescan:
+                    self.scan()
+                    last_scan = time.monotonic()
+                self.promote()
+        except KeyboardInterrupt:
+            print("收到中断信号，正在停止...")
+        finally:
+            self.stop()
+            if inotify:
+                inotify.close()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _open_inotify(self):
+        if self.app.config['WATCH_MODE'] == 'poll' or not sys.platform.startswith('linux'):
+            return None
+        try:
+            inotify = Inotify()
+            for directory in self.owners:
+                inotify.add_watch(directory)
+            return inotify
+        except (OSError, AttributeError) as e:
+            print(f"无法使用 inotify，改为定期扫描: {e}")
+            return None
+
+    def _add_candidate(self, path):
+        name = os.path.basename(path)
+        if name.startswith(('.', '~')) or not name.lower().endswith('.pdf'):
+            return
+        with self._queued_lock:
+            if path in self._queued:
+                return
+        self._candidates.setdefault(path, None)
+
+    def scan(self):
+        """扫描所有监控目录（不含子目录），记录新出现的PDF"""
+        for directory in self.owners:
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_file():
+                            self._add_candidate(os.path.join(directory, entry.name))
+            except OSError as e:
+                print(f"扫描监控目录 {directory} 时出错: {e}")
+
+    def promote(self):
+        """把已经写完的文件放入导入队列；两次检查之间大小和修改时间都没有变化、
+        且最后修改距今超过 WATCH_SETTLE_SECONDS 的文件视为写完"""
+        settle = self.app.config['WATCH_SETTLE_SECONDS']
+        now = time.time()
+        for path, previous in list(self._candidates.items()):
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                del self._candidates[path]
+                continue
+            signature = (stat.st_size, stat.st_mtime_ns)
+            if signature != previous or stat.st_size == 0 or now - stat.st_mtime < settle:
+                self._candidates[path] = signature
+                continue
+            try:
+                self._queue.put_nowait((os.path.dirname(path), path))
+            except queue.Full:
+                break  # 队列已满，剩下的文件下次再检查
+            with self._queued_lock:
+                self._queued.add(path)
+            del self._candidates[path]
+
+    def _ingest_loop(self):
+        """按目录攒批导入，每批满 WATCH_BATCH_SIZE 个或等待超时后提交"""
+        batch_size = self.app.config['WATCH_BATCH_SIZE']
+        batch_wait = self.app.config['WATCH_BATCH_WAIT_SECONDS']
+        pending = {}  # {目录: (第一个文件入批的时间, [文件路径])}
+        while not self._stop_event.is_set():
+            try:
+                directory, path = self._queue.get(timeout=1)
+                started, paths = pending.setdefault(directory, (time.monotonic(), []))
+                paths.append(path)
+                self._queue.task_done()
+            except queue.Empty:
+                pass
+            for directory, (started, paths) in list(pending.items()):
+                if len(paths) >= batch_size or time.monotonic() - started >= batch_wait:
+                    del pending[directory]
+                    self.import_batch(directory, paths)
+
+    def import_batch(self, directory, paths):
+        """导入一批文件，并清理目录中没有导入的文件"""
+        user_id = self.owners[directory]
+        try:
+            result = self.ingest_func(user_id, paths)
+        except Exception as e:
+            # 文件留在原处，下次补扫时重试
+            print(f"导入监控目录 {directory} 中的 {len(paths)} 个文件时出错: {e}")
+            with self._queued_lock:
+                self._queued.difference_update(paths)
+            return
+
+        duplicates = {info.get('filename') for info in result['duplicate_invoices']}
+        failed = 0
+        for path in paths:
+            if os.path.exists(path):
+                try:
+                    if os.path.basename(path) in duplicates:
+                        os.remove(path)
+                    else:
+                        self._move_failed(directory, path)
+                        failed += 1
+                except OSError as e:
+                    print(f"清理文件 {path} 时出错: {e}")
+        with self._queued_lock:
+            self._queued.difference_update(paths)
+        print(f"监控目录 {directory}: 导入 {len(result['saved_invoices'])} 张新发票，"
+              f"{len(result['duplicate_invoices'])} 张重复，{failed} 个文件未能识别")
+
+    @staticmethod
+    def _move_failed(directory, path):
+        failed_dir = os.path.join(directory, FAILED_DIR)
+        os.makedirs(failed_dir, exist_ok=True)
+        target = os.path.join(failed_dir, os.path.basename(path))
+        if os.path.exists(target):
+            target = os.path.join(failed_dir, f"{time.strftime('%Y%m%d%H%M%S')}_{os.path.basename(path)}")
+        os.replace(path, target)
+
+if __name__ == '__main__':
+    from app import watch_folder
+    watch_folder.run_forever()
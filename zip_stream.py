@@ -0,0 +1,116 @@
+"""流式生成ZIP压缩包
+
+直接读取发票原文件，在压缩包中使用新文件名，CSV汇总表由内存中的行生成，
+不需要复制文件或在磁盘上生成临时ZIP：
+- ZIP边生成边发送，大批量导出也能立即开始下载，内存占用只与读取块大小有关
+- PDF本身已经是压缩格式，使用 ZIP_STORED 直接存储；CSV 使用 ZIP_DEFLATED 压缩
+"""
+
+import csv
+import io
+import os
+import time
+import zipfile
+
+CHUNK_SIZE = 64 * 1024
+
+class _StreamBuffer(io.RawIOBase):
+    """只写、不可定位的缓冲区，zipfile 写入的数据由生成器取走后清空"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        # zipfile 需要当前偏移量计算本地文件头的位置
+        return self._position
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def unique_name(name, used):
+    """压缩包内文件名重复时在扩展名前加序号"""
+    if name not in used:
+        used.add(name)
+        return name
+    stem, ext = os.path.splitext(name)
+    index = 2
+    while f"{stem}({index}){ext}" in used:
+        index += 1
+    name = f"{stem}({index}){ext}"
+    used.add(name)
+    return name
+
+def csv_bytes(fieldnames, rows):
+    """逐行生成带BOM的UTF-8 CSV内容（Excel可直接打开）"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fieldnames)
+    buffer.write('\ufeff')
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= CHUNK_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+def _file_chunks(path):
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+
+def stream_zip(entries):
+    """生成ZIP压缩包内容
+
+    entries 为 (压缩包内文件名, 源文件路径或字节块迭代器) 的迭代器。
+    .pdf 文件以 ZIP_STORED 存储，其余以 ZIP_DEFLATED 压缩；源文件不存在时跳过。
+    """
+    buffer = _StreamBuffer()
+    used = set()
+    with zipfile.ZipFile(buffer, 'w', allowZip64=True) as zipf:
+        for name, source in entries:
+            if isinstance(source, str):
+                if not os.path.exists(source):
+                    print(f"打包时跳过不存在的文件: {source}")
+                    continue
+                mtime = time.localtime(os.path.getmtime(source))
+                size = os.path.getsize(source)
+                chunks = _file_chunks(source)
+            else:
+                mtime = time.localtime()
+                size = 0
+                chunks = source
+            info = zipfile.ZipInfo(unique_name(name, used), date_time=mtime[:6])
+            # 预先给出文件大小，zipfile 据此决定是否需要ZIP64扩展（超过4GB的文件）
+            info.file_size = size
+            if name.lower().endswith('.pdf'):
+                info.compress_type = zipfile.ZIP_STORED
+            else:
+                info.compress_type = zipfile.ZIP_DEFLATED
+            with zipf.open(info, 'w') as entry:
+                for chunk in chunks:
+                    entry.write(chunk)
+                    data = buffer.take()
+                    if data:
+                        yield data
+            data = buffer.take()
+            if data:
+                yield data
+    yield buffer.take()